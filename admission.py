@@ -0,0 +1,177 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+class AdmissionRejected(Exception):
+    """Requisição recusada pelo controle de admissão."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionTicket:
+    """Lugar de uma requisição na fila de espera, da chegada até ganhar vaga."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.waiting = True
+
+class AdmissionController:
+    """
+    Limita quantas transcrições rodam ao mesmo tempo no processo.
+
+    - MAX_CONCURRENT_TRANSCRIPTIONS: limite global de áudios em processamento
+    - MAX_CONCURRENT_PER_INSTANCE: limite por instância da Evolution API,
+      para que uma instância barulhenta não ocupe todas as vagas
+    - ADMISSION_QUEUE_SIZE: quantas requisições podem aguardar vaga; com a
+      fila cheia a requisição é recusada na hora com 429
+    - ADMISSION_QUEUE_TIMEOUT: espera máxima (s) por uma vaga; ao estourar,
+      a requisição é recusada com 503
+
+    A espera começa na chegada da requisição (ver `queued`): o tempo e a
+    posição na fila de áudios do chat contam para ADMISSION_QUEUE_SIZE e
+    ADMISSION_QUEUE_TIMEOUT. As recusas trazem um Retry-After estimado pelo
+    tempo médio de processamento e pelo tamanho da fila.
+    """
+
+    def __init__(self):
+        self.max_concurrent = int(os.getenv("MAX_CONCURRENT_TRANSCRIPTIONS", 8))
+        self.max_per_instance = int(os.getenv("MAX_CONCURRENT_PER_INSTANCE", 4))
+        self.queue_size = int(os.getenv("ADMISSION_QUEUE_SIZE", 32))
+        self.queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+        self._global = asyncio.Semaphore(self.max_concurrent)
+        self._instances: Dict[str, asyncio.Semaphore] = {}
+        self._instance_in_flight: Dict[str, int] = {}
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self._total_wait = 0.0
+        self.max_wait = 0.0
+        # Média móvel do tempo de processamento, usada no Retry-After
+        self._avg_service = None
+
+    def _instance_semaphore(self, instance: str) -> asyncio.Semaphore:
+        semaphore = self._instances.get(instance)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_instance)
+            self._instances[instance] = semaphore
+        return semaphore
+
+    def retry_after(self) -> int:
+        """Estimativa (s) de quando haverá vaga para uma nova requisição."""
+        rounds = (self.waiting + 1) / max(self.max_concurrent, 1)
+        avg_service = self._avg_service if self._avg_service is not None else 10.0
+        return max(1, math.ceil(avg_service * rounds))
+
+    def _enter_queue(self) -> AdmissionTicket:
+        if self.waiting >= self.queue_size:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(429, "Fila de transcrição cheia", self.retry_after())
+        self.waiting += 1
+        return AdmissionTicket()
+
+    def _leave_queue(self, ticket: AdmissionTicket):
+        if ticket.waiting:
+            ticket.waiting = False
+            self.waiting -= 1
+
+    def _remaining(self, ticket: AdmissionTicket) -> float:
+        return self.queue_timeout - (time.monotonic() - ticket.started)
+
+    def _reject_timeout(self):
+        self.rejected_timeout += 1
+        raise AdmissionRejected(503, "Tempo de espera por vaga esgotado", self.retry_after())
+
+    @asynccontextmanager
+    async def queued(self):
+        """
+        Reserva um lugar na fila de espera na chegada da requisição, antes
+        de ela entrar na fila do chat; o ticket é passado depois ao `slot`.
+        Lança AdmissionRejected (429) quando a fila de espera está cheia.
+        """
+        ticket = self._enter_queue()
+        try:
+            yield ticket
+        finally:
+            self._leave_queue(ticket)
+
+    @asynccontextmanager
+    async def slot(self, instance: str, ticket: Optional[AdmissionTicket] = None):
+        """
+        Reserva uma vaga global e uma da instância durante o processamento.
+        Lança AdmissionRejected quando a fila de espera está cheia ou a
+        espera, contada desde a chegada do `ticket`, passa de
+        ADMISSION_QUEUE_TIMEOUT.
+        """
+        own_ticket = ticket is None
+        if own_ticket:
+            ticket = self._enter_queue()
+
+        instance_semaphore = self._instance_semaphore(instance)
+        acquired_instance = False
+        acquired_global = False
+        try:
+            # O tempo na fila do chat já conta: sem prazo, nem tenta a vaga
+            if self._remaining(ticket) <= 0:
+                self._reject_timeout()
+            await asyncio.wait_for(instance_semaphore.acquire(), timeout=self._remaining(ticket))
+            acquired_instance = True
+            remaining = max(self._remaining(ticket), 0.001)
+            await asyncio.wait_for(self._global.acquire(), timeout=remaining)
+            acquired_global = True
+        except asyncio.TimeoutError:
+            self._reject_timeout()
+        finally:
+            self._leave_queue(ticket)
+            if acquired_instance and not acquired_global:
+                instance_semaphore.release()
+
+        wait = time.monotonic() - ticket.started
+        self.admitted += 1
+        self._total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.in_flight += 1
+        self._instance_in_flight[instance] = self._instance_in_flight.get(instance, 0) + 1
+        service_started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - service_started
+            if self._avg_service is None:
+                self._avg_service = elapsed
+            else:
+                self._avg_service = 0.8 * self._avg_service + 0.2 * elapsed
+            self.in_flight -= 1
+            self._instance_in_flight[instance] -= 1
+            if not self._instance_in_flight[instance]:
+                del self._instance_in_flight[instance]
+            self._global.release()
+            instance_semaphore.release()
+
+    def get_stats(self) -> dict:
+        """Métricas atuais para monitoramento."""
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_per_instance": self.max_per_instance,
+            "queue_size": self.queue_size,
+            "in_flight_by_instance": dict(self._instance_in_flight),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_seconds": round(self._total_wait / self.admitted, 3) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3),
+            "avg_processing_seconds": round(self._avg_service or 0.0, 3),
+        }
+
+# Instância única por processo
+admission = AdmissionController()
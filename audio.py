@@ -0,0 +1,280 @@
+import base64
+import hashlib
+import io
+import os
+import tempfile
+from typing import IO, Optional, Union
+
+class _FileReader(io.RawIOBase):
+    """
+    Leitor do arquivo temporário com posição própria (os.pread): uploads
+    simultâneos do mesmo áudio não disputam o offset do descritor, que é
+    compartilhado entre cópias feitas com os.dup.
+    """
+
+    def __init__(self, fd: int):
+        self._fd = os.dup(fd)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += os.fstat(self._fd).st_size
+        self._position = max(offset, 0)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        data = os.pread(self._fd, len(buffer), self._position)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+class AudioBuffer:
+    """
+    Áudio de uma mensagem, mantido em memória do download até o upload.
+
+    O conteúdo fica em um bytearray e só vai para um arquivo temporário
+    anônimo (apagado automaticamente pelo sistema ao fechar) quando passa
+    de AUDIO_SPOOL_MAX_BYTES. `payload()` entrega o conteúdo pronto para
+    um campo multipart do aiohttp sem cópias nem releituras do disco.
+    """
+
+    def __init__(self, filename: str = "audio.mp3", spool_size: Optional[int] = None):
+        self.filename = filename
+        self.spool_size = spool_size or int(os.getenv("AUDIO_SPOOL_MAX_BYTES", 8 * 1024 * 1024))
+        self.size = 0
+        self._memory = bytearray()
+        self._file = None
+
+    @classmethod
+    def from_bytes(cls, data: bytes, filename: str = "audio.mp3") -> "AudioBuffer":
+        audio = cls(filename)
+        audio.write(data)
+        return audio
+
+    @property
+    def on_disk(self) -> bool:
+        return self._file is not None
+
+    def write(self, data: bytes):
+        if self._file is None and self.size + len(data) > self.spool_size:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self._memory)
+            self._memory = bytearray()
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._memory += data
+        self.size += len(data)
+
+    def payload(self) -> Union[memoryview, IO[bytes]]:
+        """
+        Conteúdo para upload: memoryview quando em memória; quando em disco,
+        um leitor próprio posicionado no início (o aiohttp fecha o arquivo
+        ao terminar o envio, e o buffer precisa continuar aberto).
+        """
+        if self._file is None:
+            return memoryview(self._memory)
+        self._file.flush()
+        return io.BufferedReader(_FileReader(self._file.fileno()))
+
+    def read(self) -> bytes:
+        """Retorna uma cópia de todo o conteúdo."""
+        if self._file is None:
+            return bytes(self._memory)
+        self._file.flush()
+        self._file.seek(0)
+        return self._file.read()
+
+    def head(self, size: int) -> bytes:
+        """Primeiros `size` bytes (cabeçalho do container)."""
+        if self._file is None:
+            return bytes(self._memory[:size])
+        self._file.flush()
+        self._file.seek(0)
+        return self._file.read(size)
+
+    def tail(self, size: int) -> bytes:
+        """Últimos `size` bytes (última página de um Ogg, por exemplo)."""
+        if self._file is None:
+            return bytes(self._memory[-size:])
+        self._file.flush()
+        self._file.seek(max(self.size - size, 0))
+        return self._file.read(size)
+
+    def sha256(self) -> str:
+        """SHA-256 do conteúdo (mesmo valor do fileSha256 das mensagens do WhatsApp)."""
+        if self._file is None:
+            return hashlib.sha256(self._memory).hexdigest()
+        digest = hashlib.sha256()
+        self._file.flush()
+        self._file.seek(0)
+        for chunk in iter(lambda: self._file.read(65536), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def close(self):
+        # Reatribui em vez de limpar: uploads podem ainda segurar um memoryview
+        self._memory = bytearray()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Base64FieldDecoder:
+    """
+    Extrai o campo `base64` de um JSON recebido em blocos e decodifica o
+    valor incrementalmente para um AudioBuffer, sem montar o texto inteiro
+    da resposta nem a string base64 em memória.
+
+    Só o campo de primeiro nível é considerado; os demais campos (pequenos)
+    são apenas percorridos. Escapes JSON dentro do valor (`\\/`, quebras de
+    linha) são tratados.
+    """
+    # Escapes possíveis dentro de uma string base64 serializada em JSON
+    VALUE_ESCAPES = {b"/": b"/", b"n": b"", b"r": b"", b"t": b""}
+
+    def __init__(self, output: AudioBuffer, field: str = "base64"):
+        self.output = output
+        self.field = field.encode()
+        self.found = False
+        self.done = False
+        self._pending = b""
+        self._carry = b""
+        self._depth = 0
+        self._expect_key = False
+        self._in_string = False
+        self._string_is_key = False
+        self._key = b""
+        self._awaiting_value = False
+        self._in_value = False
+
+    def feed(self, chunk: bytes):
+        if self.done:
+            return
+        data = self._pending + chunk
+        # Um escape partido entre blocos é completado no próximo feed
+        trailing = len(data) - len(data.rstrip(b"\\"))
+        if trailing % 2:
+            self._pending = data[-1:]
+            data = data[:-1]
+        else:
+            self._pending = b""
+
+        position = 0
+        while position < len(data) and not self.done:
+            if self._in_value:
+                position = self._feed_value(data, position)
+            elif self._in_string:
+                position = self._feed_string(data, position)
+            else:
+                position = self._feed_structure(data, position)
+
+    def close(self):
+        """Confirma que o campo foi encontrado e lido por completo."""
+        if not self.found:
+            raise ValueError(f"Campo '{self.field.decode()}' não encontrado na resposta")
+        if not self.done:
+            raise ValueError(f"Campo '{self.field.decode()}' incompleto na resposta")
+
+    def _feed_structure(self, data: bytes, position: int) -> int:
+        """Percorre a estrutura do JSON fora de strings."""
+        byte = data[position:position + 1]
+        if byte in b" \t\r\n:":
+            return position + 1
+        if byte == b'"':
+            if self._awaiting_value:
+                self._awaiting_value = False
+                self._in_value = True
+                self.found = True
+            else:
+                self._in_string = True
+                self._string_is_key = self._depth == 1 and self._expect_key
+                self._key = b""
+                self._expect_key = False
+        elif byte == b",":
+            self._expect_key = self._depth == 1
+        elif byte in b"{[":
+            self._depth += 1
+            self._expect_key = byte == b"{" and self._depth == 1
+        elif byte in b"}]":
+            self._depth -= 1
+        # Um valor que não é string no lugar do campo (null, número) é ignorado
+        self._awaiting_value = self._awaiting_value and byte == b'"'
+        return position + 1
+
+    def _feed_string(self, data: bytes, position: int) -> int:
+        """Percorre uma string comum (chaves e valores pequenos)."""
+        while True:
+            quote = data.find(b'"', position)
+            backslash = data.find(b"\\", position)
+            if backslash != -1 and (quote == -1 or backslash < quote):
+                self._collect(data[position:backslash + 2])
+                position = backslash + 2
+                continue
+            if quote == -1:
+                self._collect(data[position:])
+                return len(data)
+            self._collect(data[position:quote])
+            self._in_string = False
+            if self._string_is_key and self._key == self.field:
+                self._awaiting_value = True
+            return quote + 1
+
+    def _collect(self, part: bytes):
+        # Só interessa comparar chaves com o nome do campo
+        if self._string_is_key and len(self._key) <= len(self.field):
+            self._key += part
+
+    def _feed_value(self, data: bytes, position: int) -> int:
+        """Decodifica o valor base64 em blocos múltiplos de 4 caracteres."""
+        quote = data.find(b'"', position)
+        backslash = data.find(b"\\", position)
+        if backslash != -1 and (quote == -1 or backslash < quote):
+            self._decode(data[position:backslash])
+            escaped = data[backslash + 1:backslash + 2]
+            if escaped not in self.VALUE_ESCAPES:
+                raise ValueError(f"Escape inesperado no base64: \\{escaped.decode(errors='replace')}")
+            self._decode(self.VALUE_ESCAPES[escaped])
+            return backslash + 2
+        if quote == -1:
+            self._decode(data[position:])
+            return len(data)
+        self._decode(data[position:quote])
+        if self._carry:
+            raise ValueError("Base64 truncado na resposta")
+        self._in_value = False
+        self.done = True
+        return quote + 1
+
+    def _decode(self, part: bytes):
+        if not part:
+            return
+        data = self._carry + part
+        usable = len(data) - len(data) % 4
+        if usable:
+            self.output.write(base64.b64decode(data[:usable]))
+        self._carry = data[usable:]
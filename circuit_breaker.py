@@ -0,0 +1,233 @@
+import os
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from config import logger
+from local_whisper import local_whisper
+from log_sink import log_sink
+from settings_cache import settings_cache
+from utils import create_async_redis_client
+
+# Decide se a chamada pode seguir e faz a transição open -> half_open quando
+# o tempo de espera acabou. Retorna {permitido (0/1), estado anterior, estado atual}.
+ALLOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local open_ms = tonumber(ARGV[2])
+local max_probes = tonumber(ARGV[3])
+local old = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if old == 'closed' then
+    return {1, old, old}
+end
+local state = old
+if state == 'open' then
+    local opened_at = tonumber(redis.call('HGET', KEYS[1], 'opened_at') or '0')
+    if now - opened_at < open_ms then
+        return {0, old, old}
+    end
+    state = 'half_open'
+    redis.call('HSET', KEYS[1], 'state', state, 'probes', 0, 'successes', 0, 'probe_at', now)
+    redis.call('HINCRBY', KEYS[2], ARGV[4] .. ':' .. state, 1)
+end
+-- half_open: até max_probes chamadas de teste por vez; a vaga de uma
+-- sonda sem resultado volta após open_ms
+local probes = tonumber(redis.call('HGET', KEYS[1], 'probes') or '0')
+local probe_at = tonumber(redis.call('HGET', KEYS[1], 'probe_at') or '0')
+if probes >= max_probes then
+    if now - probe_at < open_ms then
+        return {0, old, state}
+    end
+    probes = 0
+end
+redis.call('HSET', KEYS[1], 'probes', probes + 1, 'probe_at', now)
+return {1, old, state}
+"""
+
+# Registra o resultado de uma chamada. ARGV[2] = 1 para sucesso.
+# Retorna {estado anterior, estado atual}.
+RECORD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local success = tonumber(ARGV[2]) == 1
+local threshold = tonumber(ARGV[3])
+local needed = tonumber(ARGV[4])
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local new_state = state
+if success then
+    if state == 'half_open' then
+        local successes = redis.call('HINCRBY', KEYS[1], 'successes', 1)
+        redis.call('HINCRBY', KEYS[1], 'probes', -1)
+        if successes >= needed then
+            new_state = 'closed'
+        end
+    end
+    if new_state == 'closed' then
+        redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', 0)
+    end
+else
+    local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+    if state == 'half_open' or (state == 'closed' and failures >= threshold) then
+        new_state = 'open'
+        redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', now)
+    end
+end
+if new_state ~= state then
+    redis.call('HINCRBY', KEYS[2], ARGV[5] .. ':' .. new_state, 1)
+end
+return {state, new_state}
+"""
+
+# Caminhos das APIs compatíveis com OpenAI, por endpoint protegido
+ENDPOINT_PATHS = {
+    "/audio/transcriptions": "transcription",
+    "/chat/completions": "chat",
+}
+# Erros que indicam problema do provedor (não da chave ou da requisição);
+# o limite de taxa só é registrado quando a troca de chaves não resolveu
+BREAKER_ERRORS = {"server", "network", "rate_limit"}
+
+def endpoint_for_url(url: str) -> Optional[str]:
+    path = urlparse(url).path
+    for suffix, endpoint in ENDPOINT_PATHS.items():
+        if path.endswith(suffix):
+            return endpoint
+    return None
+
+class CircuitBreaker:
+    """
+    Circuit breaker por provedor e endpoint (transcrição e chat), com o
+    estado compartilhado no Redis entre a API e os workers.
+
+    - closed: chamadas normais; CIRCUIT_FAILURE_THRESHOLD falhas seguidas
+      do provedor (5xx, rede, limite de taxa em todas as chaves) abrem o
+      circuito
+    - open: chamadas vão para o provedor secundário por CIRCUIT_OPEN_SECONDS
+    - half_open: até CIRCUIT_HALF_OPEN_PROBES chamadas reais testam o
+      provedor; CIRCUIT_HALF_OPEN_SUCCESSES sucessos fecham o circuito e uma
+      falha o reabre
+
+    Transições são registradas nos logs e contadas no hash
+    `transcrevezap:circuit_transitions`; failovers em `transcrevezap:circuit_failovers`.
+    """
+    KEY_PREFIX = "transcrevezap:circuit"
+    TRANSITIONS_KEY = "transcrevezap:circuit_transitions"
+    FAILOVERS_KEY = "transcrevezap:circuit_failovers"
+    PROVIDERS = ("groq", "openai")
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        self.enabled = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+        self.failure_threshold = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+        self.open_seconds = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+        self.half_open_probes = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", 1))
+        self.half_open_successes = int(os.getenv("CIRCUIT_HALF_OPEN_SUCCESSES", 2))
+        self._allow = self.redis.register_script(ALLOW_SCRIPT)
+        self._record = self.redis.register_script(RECORD_SCRIPT)
+
+    def _get_key(self, provider: str, endpoint: str) -> str:
+        return f"{self.KEY_PREFIX}:{provider}:{endpoint}"
+
+    def _log_transition(self, provider: str, endpoint: str, old_state: str, new_state: str):
+        if old_state == new_state:
+            return
+        level = "WARNING" if new_state == "open" else "INFO"
+        if new_state == "open":
+            logger.warning(f"Circuito {provider}/{endpoint} aberto")
+        else:
+            logger.info(f"Circuito {provider}/{endpoint}: {old_state} -> {new_state}")
+        log_sink.emit(level, "Transição de circuit breaker", {
+            "provider": provider,
+            "endpoint": endpoint,
+            "from": old_state,
+            "to": new_state
+        })
+
+    async def allow(self, provider: str, endpoint: str) -> bool:
+        if not self.enabled:
+            return True
+        try:
+            allowed, old_state, new_state = await self._allow(
+                keys=[self._get_key(provider, endpoint), self.TRANSITIONS_KEY],
+                args=[
+                    int(time.time() * 1000), int(self.open_seconds * 1000),
+                    self.half_open_probes, f"{provider}:{endpoint}"
+                ]
+            )
+        except Exception as e:
+            logger.warning(f"Erro ao consultar circuit breaker: {e}")
+            return True
+        self._log_transition(provider, endpoint, old_state, new_state)
+        return bool(int(allowed))
+
+    async def record(self, provider: str, endpoint: str, error_class: Optional[str]):
+        """Registra o resultado de uma tentativa; só erros do provedor contam como falha."""
+        if not self.enabled or not provider or not endpoint:
+            return
+        if error_class is not None and error_class not in BREAKER_ERRORS:
+            return
+        try:
+            old_state, new_state = await self._record(
+                keys=[self._get_key(provider, endpoint), self.TRANSITIONS_KEY],
+                args=[
+                    int(time.time() * 1000), 1 if error_class is None else 0,
+                    self.failure_threshold, self.half_open_successes, f"{provider}:{endpoint}"
+                ]
+            )
+        except Exception as e:
+            logger.warning(f"Erro ao registrar resultado no circuit breaker: {e}")
+            return
+        self._log_transition(provider, endpoint, old_state, new_state)
+
+    async def record_failover(self, primary: str, secondary: str, endpoint: str):
+        log_sink.emit("WARNING", "Failover de provedor", {
+            "from": primary,
+            "to": secondary,
+            "endpoint": endpoint
+        })
+        try:
+            await self.redis.hincrby(self.FAILOVERS_KEY, f"{primary}->{secondary}:{endpoint}", 1)
+        except Exception as e:
+            logger.warning(f"Erro ao registrar failover: {e}")
+
+    async def get_stats(self) -> dict:
+        pipe = self.redis.pipeline(transaction=False)
+        names = [(provider, endpoint) for provider in self.PROVIDERS for endpoint in ENDPOINT_PATHS.values()]
+        for provider, endpoint in names:
+            pipe.hget(self._get_key(provider, endpoint), "state")
+        pipe.hgetall(self.TRANSITIONS_KEY)
+        pipe.hgetall(self.FAILOVERS_KEY)
+        *states, transitions, failovers = await pipe.execute()
+        return {
+            "states": {f"{provider}:{endpoint}": state or "closed" for (provider, endpoint), state in zip(names, states)},
+            "transitions": {name: int(count) for name, count in transitions.items()},
+            "failovers": {name: int(count) for name, count in failovers.items()},
+        }
+
+# Instância única por processo
+circuit_breaker = CircuitBreaker()
+
+async def select_provider(endpoint: str, allow_local: bool = True) -> str:
+    """
+    Provedor para a próxima chamada ao endpoint: o configurado no manager
+    ou, com o circuito dele aberto, o outro provedor, se tiver chaves.
+    `allow_local=False` pede um provedor remoto mesmo com o "local"
+    configurado (ex.: o modelo local não carregou).
+    """
+    runtime_settings = await settings_cache.current()
+    primary = runtime_settings.llm_provider
+    if primary == "local":
+        if endpoint == "transcription" and allow_local and local_whisper.available:
+            return primary
+        # O Whisper local só transcreve (e só com o faster-whisper
+        # instalado): os demais usos vão para o GROQ ou, sem chaves GROQ,
+        # para a OpenAI
+        primary = "openai" if runtime_settings.openai_keys and not runtime_settings.groq_keys else "groq"
+    if await circuit_breaker.allow(primary, endpoint):
+        return primary
+
+    secondary = "openai" if primary == "groq" else "groq"
+    secondary_keys = runtime_settings.openai_keys if secondary == "openai" else runtime_settings.groq_keys
+    if secondary_keys and await circuit_breaker.allow(secondary, endpoint):
+        await circuit_breaker.record_failover(primary, secondary, endpoint)
+        return secondary
+    # Sem alternativa: segue com o principal mesmo com o circuito aberto
+    return primary
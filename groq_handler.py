@@ -1,10 +1,10 @@
-import aiohttp
-import json
 from typing import Optional, Tuple, Any
-from datetime import datetime
 import logging
-from storage import StorageHandler
-import asyncio
+from storage import AsyncStorageHandler
+from http_client import http_client
+from key_health import key_health, provider_for_url
+from key_scheduler import key_scheduler
+from retry import request_with_retry
 
 logger = logging.getLogger("GROQHandler")
 logger.setLevel(logging.DEBUG)
@@ -19,12 +19,12 @@ async def test_groq_key(key: str) -> bool:
     headers = {"Authorization": f"Bearer {key}"}
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return bool(data.get("data"))
-                return False
+        session = http_client.get_session("groq")
+        async with session.get(url, headers=headers) as response:
+            if response.status == 200:
+                data = await response.json()
+                return bool(data.get("data"))
+            return False
     except Exception as e:
         logger.error(f"Erro ao testar chave GROQ: {e}")
         return False
@@ -38,74 +38,58 @@ async def validate_transcription_response(response_text: str) -> bool:
         logger.error(f"Erro ao validar resposta da transcrição: {e}")
         return False
 
-async def get_working_groq_key(storage: StorageHandler) -> Optional[str]:
-    """Obtenha uma chave GROQ funcional do pool disponível."""
-    keys = storage.get_groq_keys()
+async def get_working_key(provider: str, storage: AsyncStorageHandler, exclude: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """
+    Obtenha uma chave funcional do pool do provedor (GROQ ou OpenAI). A
+    saúde das chaves vem do monitor em segundo plano (key_health), sem
+    sondar a chave aqui, e a escolha entre as saudáveis é do key_scheduler,
+    pela folga nos limites de taxa. A chave fica reservada até
+    request_with_retry encerrar o lease retornado junto com ela. `exclude`
+    deixa uma chave de fora (a da requisição original, no hedging).
 
-    for _ in range(len(keys)):
-        key = storage.get_next_groq_key()
-        if not key:
-            continue
+    Returns:
+        (chave, id do lease) ou None
+    """
+    keys = await storage.get_openai_keys() if provider == "openai" else await storage.get_groq_keys()
+    health = await key_health.get_health(provider)
+    candidates = [key for key in keys if key != exclude and health.get(key, {}).get("healthy", True)]
+    if exclude and not candidates:
+        return None
 
-        penalized_until = storage.get_penalized_until(key)
-        if penalized_until and penalized_until > datetime.utcnow():
-            continue
+    lease = await key_scheduler.acquire(provider, candidates)
+    if lease:
+        return lease
 
-        if await test_groq_key(key):
-            return key
-        else:
-            storage.penalize_key(key, penalty_duration=300)
-
-    storage.add_log("ERROR", "Nenhuma chave GROQ funcional disponível.")
+    await storage.add_log("ERROR", f"Nenhuma chave {'OpenAI' if provider == 'openai' else 'GROQ'} funcional disponível.")
     return None
 
+async def get_working_groq_key(storage: AsyncStorageHandler, exclude: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """Obtenha uma chave GROQ funcional do pool disponível (ver get_working_key)."""
+    return await get_working_key("groq", storage, exclude)
+
+async def get_provider_key(provider: str, storage: AsyncStorageHandler) -> Optional[Tuple[str, str]]:
+    """Próxima chave do provedor, usada também na troca de chave entre tentativas."""
+    return await get_working_key("openai" if provider == "openai" else "groq", storage)
+
 async def handle_groq_request(
     url: str, 
     headers: dict, 
     data: Any, 
-    storage: StorageHandler,
-    is_form_data: bool = False
+    storage: AsyncStorageHandler,
+    is_form_data: bool = False,
+    lease_id: Optional[str] = None
 ) -> Tuple[bool, dict, str]:
-    """Lida com requisições para a API GROQ com suporte a retries e rotação de chaves."""
-    max_retries = len(storage.get_groq_keys())
-    
-    for attempt in range(max_retries):
-        try:
-            storage.add_log("DEBUG", "Iniciando tentativa de requisição para GROQ", {
-                "url": url,
-                "is_form_data": is_form_data,
-                "attempt": attempt + 1
-            })
-
-            async with aiohttp.ClientSession() as session:
-                if is_form_data:
-                    async with session.post(url, headers=headers, data=data) as response:
-                        response_data = await response.json()
-                        if response.status == 200 and response_data.get("text"):
-                            return True, response_data, ""
-                else:
-                    async with session.post(url, headers=headers, json=data) as response:
-                        response_data = await response.json()
-                        if response.status == 200 and response_data.get("choices"):
-                            return True, response_data, ""
-                
-                error_msg = response_data.get("error", {}).get("message", "")
-                
-                if "organization_restricted" in error_msg or "invalid_api_key" in error_msg:
-                    new_key = await get_working_groq_key(storage)
-                    if new_key:
-                        headers["Authorization"] = f"Bearer {new_key}"
-                        await asyncio.sleep(1)
-                        continue
-
-                return False, response_data, error_msg
+    """
+    Lida com requisições para a API GROQ (ou OpenAI, pela URL) com a
+    política de retry comum e rotação de chaves. Para multipart, `data`
+    deve ser uma fábrica que monta um FormData novo a cada tentativa;
+    `lease_id` é o lease da chave, vindo de get_working_key.
+    """
+    provider = provider_for_url(url) or "groq"
 
-        except Exception as e:
-            storage.add_log("ERROR", "Erro na requisição", {"error": str(e)})
-            if attempt < max_retries - 1:
-                await asyncio.sleep(1)
-                continue
-            return False, {}, f"Request failed: {str(e)}"
+    async def rotate_key():
+        return await get_provider_key(provider, storage)
 
-    storage.add_log("ERROR", "Todas as chaves GROQ falharam.")
-    return False, {}, "All GROQ keys exhausted."
\ No newline at end of file
+    return await request_with_retry(
+        url, headers, data, storage, is_form_data=is_form_data, rotate_key=rotate_key, lease_id=lease_id
+    )
@@ -0,0 +1,134 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from config import logger
+from utils import create_async_redis_client
+
+T = TypeVar("T")
+
+class TranscriptionHedger:
+    """
+    Hedging das transcrições: se a requisição não terminar até o percentil
+    TRANSCRIPTION_HEDGE_PERCENTILE das latências recentes, uma cópia é
+    enviada por outra chave ou provedor; vale a primeira resposta e a outra
+    é cancelada.
+
+    As latências e o limite de cópias (TRANSCRIPTION_HEDGE_MAX_RATE das
+    últimas TRANSCRIPTION_HEDGE_WINDOW requisições) são por processo; os
+    contadores de requisições, cópias enviadas e cópias vencedoras ficam no
+    hash `transcrevezap:hedge_stats`.
+    """
+    STATS_KEY = "transcrevezap:hedge_stats"
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        self.enabled = os.getenv("TRANSCRIPTION_HEDGE_ENABLED", "false").lower() == "true"
+        self.percentile = float(os.getenv("TRANSCRIPTION_HEDGE_PERCENTILE", 95))
+        self.min_delay = float(os.getenv("TRANSCRIPTION_HEDGE_MIN_DELAY", 1))
+        self.min_samples = int(os.getenv("TRANSCRIPTION_HEDGE_MIN_SAMPLES", 20))
+        self.max_rate = float(os.getenv("TRANSCRIPTION_HEDGE_MAX_RATE", 0.1))
+        window = int(os.getenv("TRANSCRIPTION_HEDGE_WINDOW", 200))
+        self._latencies = deque(maxlen=window)
+        # Se cada uma das requisições recentes gerou cópia
+        self._hedged = deque(maxlen=window)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Tempo de espera antes da cópia; None enquanto não há amostras suficientes."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(math.ceil(len(ordered) * self.percentile / 100) - 1, len(ordered) - 1)
+        return max(ordered[max(index, 0)], self.min_delay)
+
+    def _can_hedge(self) -> bool:
+        # Conta a requisição atual, para a taxa nunca passar do limite
+        return sum(self._hedged) + 1 <= self.max_rate * (len(self._hedged) + 1)
+
+    async def _count(self, field: str):
+        try:
+            await self.redis.hincrby(self.STATS_KEY, field, 1)
+        except Exception as e:
+            logger.warning(f"Erro ao registrar contador de hedge: {e}")
+
+    async def run(
+        self,
+        primary: Callable[[], Awaitable[T]],
+        hedge: Callable[[], Awaitable[Optional[Callable[[], Awaitable[T]]]]],
+    ) -> T:
+        """
+        Executa `primary()`. `hedge()` é chamado só quando a cópia vai ser
+        enviada e retorna a chamada da cópia (já com a chave/provedor
+        escolhidos) ou None se não houver alternativa.
+        """
+        delay = self.hedge_delay() if self.enabled else None
+        started = time.monotonic()
+        first = asyncio.ensure_future(primary())
+        if self.enabled:
+            await self._count("requests")
+
+        hedged = False
+        try:
+            if delay is not None and self._can_hedge():
+                done, _ = await asyncio.wait({first}, timeout=delay)
+                if not done:
+                    try:
+                        second_call = await hedge()
+                    except Exception as e:
+                        logger.warning(f"Erro ao preparar cópia da transcrição: {e}")
+                        second_call = None
+                    if second_call is not None:
+                        hedged = True
+                        return await self._race(first, second_call, started)
+            result = await first
+            self._latencies.append(time.monotonic() - started)
+            return result
+        finally:
+            if self.enabled:
+                self._hedged.append(hedged)
+            if not first.done():
+                first.cancel()
+
+    async def _race(self, first: asyncio.Future, second_call, started: float):
+        await self._count("fired")
+        hedge_started = time.monotonic()
+        second = asyncio.ensure_future(second_call())
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    now = time.monotonic()
+                    if task is second:
+                        # A original entra com o tempo até ser cancelada, um
+                        # limite inferior da latência dela
+                        self._latencies.extend([now - hedge_started, now - started])
+                        await self._count("won")
+                        logger.debug(f"Cópia da transcrição venceu após {now - started:.2f}s")
+                    else:
+                        self._latencies.append(now - started)
+                    return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_stats(self) -> dict:
+        stats = await self.redis.hgetall(self.STATS_KEY)
+        return {
+            "enabled": self.enabled,
+            "delay": self.hedge_delay(),
+            "requests": int(stats.get("requests", 0)),
+            "fired": int(stats.get("fired", 0)),
+            "won": int(stats.get("won", 0)),
+        }
+
+# Instância única por processo
+transcription_hedger = TranscriptionHedger()
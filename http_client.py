@@ -0,0 +1,120 @@
+import asyncio
+import os
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from config import logger
+
+# Configuração de cada classe de upstream: timeouts (s) e conexões por host
+UPSTREAMS = {
+    "groq": {
+        "base_url": "https://api.groq.com",
+        "total_timeout": float(os.getenv("GROQ_TIMEOUT", 120)),
+        "limit_per_host": int(os.getenv("GROQ_POOL_SIZE", 20)),
+    },
+    "openai": {
+        "base_url": "https://api.openai.com",
+        "total_timeout": float(os.getenv("OPENAI_TIMEOUT", 120)),
+        "limit_per_host": int(os.getenv("OPENAI_POOL_SIZE", 20)),
+    },
+    "evolution": {
+        "total_timeout": float(os.getenv("EVOLUTION_TIMEOUT", 60)),
+        "limit_per_host": int(os.getenv("EVOLUTION_POOL_SIZE", 20)),
+    },
+    "media": {
+        "total_timeout": float(os.getenv("MEDIA_TIMEOUT", 60)),
+        "read_timeout": float(os.getenv("MEDIA_READ_TIMEOUT", 15)),
+        "limit_per_host": int(os.getenv("MEDIA_POOL_SIZE", 10)),
+    },
+    "webhooks": {
+        "total_timeout": float(os.getenv("WEBHOOK_TIMEOUT", 10)),
+        "limit_per_host": int(os.getenv("WEBHOOK_POOL_SIZE", 10)),
+    },
+}
+
+# Hosts conhecidos de provedores, para escolher o pool pela URL
+PROVIDER_HOSTS = {
+    "api.groq.com": "groq",
+    "api.openai.com": "openai",
+}
+
+class HTTPClientManager:
+    """
+    Mantém uma aiohttp.ClientSession de longa duração por classe de upstream
+    (Groq, OpenAI, cada servidor da Evolution API, downloads de mídia e
+    webhooks), reaproveitando conexões TCP/TLS com keep-alive e cache de DNS.
+
+    Criado no startup da API/workers e fechado no shutdown; as sessões são
+    criadas sob demanda dentro do event loop.
+    """
+
+    def __init__(self):
+        self.connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+        self.keepalive_timeout = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+        self.dns_cache_ttl = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+        self.prewarm_enabled = os.getenv("HTTP_PREWARM", "true").lower() == "true"
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    async def start(self):
+        """Cria as sessões dos provedores e, opcionalmente, pré-aquece o TLS."""
+        for upstream in PROVIDER_HOSTS.values():
+            self.get_session(upstream)
+        if self.prewarm_enabled:
+            await self.prewarm()
+
+    async def prewarm(self):
+        """Abre uma conexão TLS com cada provedor para que a primeira requisição não pague o handshake."""
+        async def _warm(upstream):
+            base_url = UPSTREAMS[upstream]["base_url"]
+            try:
+                async with self.get_session(upstream).head(base_url, timeout=aiohttp.ClientTimeout(total=5)):
+                    pass
+                logger.debug(f"Conexão com {upstream} pré-aquecida")
+            except Exception as e:
+                logger.debug(f"Falha ao pré-aquecer conexão com {upstream}: {e}")
+
+        await asyncio.gather(*[_warm(upstream) for upstream in set(PROVIDER_HOSTS.values())])
+
+    def get_session(self, upstream: str, server_url: Optional[str] = None) -> aiohttp.ClientSession:
+        """
+        Retorna a sessão compartilhada do upstream. Para a Evolution API,
+        cada `server_url` tem sua própria sessão (e seu próprio limite de conexões).
+        """
+        name = f"{upstream}:{server_url}" if server_url else upstream
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            session = self._create_session(upstream)
+            self._sessions[name] = session
+        return session
+
+    def get_session_for_url(self, url: str) -> aiohttp.ClientSession:
+        """Escolhe a sessão do provedor a partir do host da URL."""
+        upstream = PROVIDER_HOSTS.get(urlparse(url).hostname or "", "media")
+        return self.get_session(upstream)
+
+    async def close(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+
+    def _create_session(self, upstream: str) -> aiohttp.ClientSession:
+        config = UPSTREAMS.get(upstream, UPSTREAMS["media"])
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=config["limit_per_host"],
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=config["total_timeout"],
+            connect=self.connect_timeout,
+            sock_read=config.get("read_timeout"),
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+# Instância única por processo
+http_client = HTTPClientManager()
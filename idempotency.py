@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime
+from typing import Optional
+
+from utils import create_async_redis_client
+
+# Reserva atômica: só assume a mensagem se não houver registro ou se o
+# processamento anterior falhou. Retorna o registro existente caso contrário.
+CLAIM_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ok, record = pcall(cjson.decode, current)
+    if ok and record['state'] ~= 'failed' then
+        return current
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+return false
+"""
+
+class IdempotencyGuard:
+    """
+    Deduplicação de webhooks por `instance` + `data.key.id`.
+
+    Cada mensagem tem um registro no Redis com o estado do processamento:
+    - in_flight: em processamento; duplicatas são absorvidas
+    - done: concluído; duplicatas recebem o resultado armazenado
+    - failed: falhou; uma nova entrega pode reprocessar a mensagem
+    """
+    IN_FLIGHT = "in_flight"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        self.in_flight_ttl = int(os.getenv("DEDUP_IN_FLIGHT_TTL", 900))
+        self.done_ttl = int(os.getenv("DEDUP_DONE_TTL", 86400))
+        self.failed_ttl = int(os.getenv("DEDUP_FAILED_TTL", 3600))
+        self._claim = self.redis.register_script(CLAIM_SCRIPT)
+
+    def _get_key(self, instance: str, message_id: str) -> str:
+        return f"transcrevezap:dedup:{instance}:{message_id}"
+
+    async def claim(self, instance: str, message_id: str) -> Optional[dict]:
+        """
+        Tenta reservar a mensagem para processamento.
+        Retorna None se a reserva foi obtida, ou o registro existente
+        (in_flight/done) se a mensagem é uma duplicata.
+        """
+        record = json.dumps({
+            "state": self.IN_FLIGHT,
+            "started_at": datetime.now().isoformat(),
+        })
+        current = await self._claim(
+            keys=[self._get_key(instance, message_id)],
+            args=[record, self.in_flight_ttl]
+        )
+        if not current:
+            return None
+        try:
+            return json.loads(current)
+        except (TypeError, ValueError):
+            return {"state": self.IN_FLIGHT}
+
+    async def complete(self, instance: str, message_id: str, outcome: dict):
+        """Marca a mensagem como concluída e guarda o resultado para replays."""
+        await self.redis.set(
+            self._get_key(instance, message_id),
+            json.dumps({
+                "state": self.DONE,
+                "finished_at": datetime.now().isoformat(),
+                "outcome": outcome,
+            }),
+            ex=self.done_ttl
+        )
+
+    async def fail(self, instance: str, message_id: str, error: str):
+        """Marca a mensagem como falha, liberando uma nova tentativa."""
+        await self.redis.set(
+            self._get_key(instance, message_id),
+            json.dumps({
+                "state": self.FAILED,
+                "finished_at": datetime.now().isoformat(),
+                "error": error,
+            }),
+            ex=self.failed_ttl
+        )
+
+# Instância única por processo
+idempotency = IdempotencyGuard()
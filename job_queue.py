@@ -0,0 +1,157 @@
+import json
+import os
+from datetime import datetime
+from typing import List, Tuple
+
+import redis
+from utils import create_async_redis_client
+
+class JobQueue:
+    """
+    Fila durável de jobs de transcrição baseada em Redis Streams.
+
+    O endpoint publica o payload do webhook com `enqueue` e responde 202;
+    os workers consomem via consumer group, confirmam com `ack` e
+    recuperam jobs parados de workers que morreram com `claim_stalled`.
+    """
+    STREAM_KEY = "transcrevezap:jobs"
+    DEAD_LETTER_KEY = "transcrevezap:jobs:dead"
+    ATTEMPTS_KEY = "transcrevezap:jobs:attempts"
+    GROUP = "transcrevezap-workers"
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        self.max_length = int(os.getenv("JOB_STREAM_MAXLEN", 10000))
+        self.max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+        self.claim_idle_ms = int(os.getenv("JOB_CLAIM_IDLE_MS", 60000))
+        self._group_ready = False
+        # Posição do XAUTOCLAIM entre chamadas; volta a "0-0" ao fim da lista de pendentes
+        self._claim_cursor = "0-0"
+
+    async def ensure_group(self):
+        """Cria o consumer group (e o stream) caso ainda não existam."""
+        if self._group_ready:
+            return
+        try:
+            await self.redis.xgroup_create(self.STREAM_KEY, self.GROUP, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    async def enqueue(self, payload: dict) -> str:
+        """Publica um job no stream e retorna o ID gerado pelo Redis."""
+        await self.ensure_group()
+        return await self.redis.xadd(
+            self.STREAM_KEY,
+            {
+                "payload": json.dumps(payload),
+                "enqueued_at": datetime.now().isoformat(),
+            },
+            maxlen=self.max_length,
+            approximate=True,
+        )
+
+    async def read(self, consumer: str, count: int = 1, block_ms: int = 5000) -> List[Tuple[str, dict]]:
+        """Lê novos jobs para o consumidor, bloqueando até `block_ms`."""
+        await self.ensure_group()
+        response = await self.redis.xreadgroup(
+            self.GROUP, consumer, {self.STREAM_KEY: ">"}, count=count, block=block_ms
+        )
+        jobs = []
+        for _, entries in response or []:
+            jobs.extend(self._decode_entries(entries))
+        return jobs
+
+    async def claim_stalled(self, consumer: str, count: int = 1) -> List[Tuple[str, dict]]:
+        """
+        Assume até `count` jobs pendentes há mais de `claim_idle_ms` (worker
+        morto ou falha sem ack), para que sejam reprocessados por este
+        consumidor. Percorre a lista de pendentes a partir de onde a chamada
+        anterior parou, até juntar `count` jobs ou chegar ao fim dela.
+        """
+        await self.ensure_group()
+        jobs = []
+        while len(jobs) < count:
+            result = await self.redis.xautoclaim(
+                self.STREAM_KEY, self.GROUP, consumer,
+                min_idle_time=self.claim_idle_ms, start_id=self._claim_cursor, count=count - len(jobs)
+            )
+            if not result:
+                self._claim_cursor = "0-0"
+                break
+            # Redis >= 7 retorna também a lista de IDs removidos do stream
+            self._claim_cursor = result[0]
+            jobs.extend(self._decode_entries(result[1]))
+            if self._claim_cursor in ("0-0", b"0-0"):
+                self._claim_cursor = "0-0"
+                break
+        return jobs
+
+    async def touch(self, consumer: str, job_ids: List[str]):
+        """
+        Zera o tempo ocioso de jobs que este consumidor ainda está segurando
+        (aguardando a vez do chat ou em processamento), para que não sejam
+        reassumidos por outro worker.
+        """
+        if not job_ids:
+            return
+        await self.redis.xclaim(
+            self.STREAM_KEY, self.GROUP, consumer,
+            min_idle_time=0, message_ids=job_ids, justid=True
+        )
+
+    async def register_attempt(self, job_id: str) -> int:
+        """Incrementa e retorna o número de tentativas do job."""
+        return await self.redis.hincrby(self.ATTEMPTS_KEY, job_id, 1)
+
+    async def ack(self, job_id: str):
+        """Confirma o processamento do job e remove seus metadados."""
+        pipe = self.redis.pipeline()
+        pipe.xack(self.STREAM_KEY, self.GROUP, job_id)
+        pipe.xdel(self.STREAM_KEY, job_id)
+        pipe.hdel(self.ATTEMPTS_KEY, job_id)
+        await pipe.execute()
+
+    async def dead_letter(self, job_id: str, payload: dict, error: str):
+        """Move um job que esgotou as tentativas para o stream de falhas."""
+        await self.redis.xadd(
+            self.DEAD_LETTER_KEY,
+            {
+                "job_id": job_id,
+                "payload": json.dumps(payload),
+                "error": error,
+                "failed_at": datetime.now().isoformat(),
+            },
+            maxlen=1000,
+            approximate=True,
+        )
+        await self.ack(job_id)
+
+    async def get_stats(self) -> dict:
+        """Retorna tamanho do stream, pendentes e falhas definitivas."""
+        await self.ensure_group()
+        pending = await self.redis.xpending(self.STREAM_KEY, self.GROUP)
+        return {
+            "stream_length": await self.redis.xlen(self.STREAM_KEY),
+            "pending": pending.get("pending", 0) if pending else 0,
+            "dead_letter": await self.redis.xlen(self.DEAD_LETTER_KEY),
+        }
+
+    async def close(self):
+        await self.redis.close()
+
+    def _decode_entries(self, entries) -> List[Tuple[str, dict]]:
+        jobs = []
+        for job_id, fields in entries:
+            if not fields:
+                continue
+            try:
+                jobs.append((job_id, json.loads(fields["payload"])))
+            except (KeyError, json.JSONDecodeError):
+                jobs.append((job_id, None))
+        return jobs
+
+def is_queue_mode() -> bool:
+    """Indica se o endpoint deve apenas enfileirar os jobs (PROCESSING_MODE=queue)."""
+    return os.getenv("PROCESSING_MODE", "inline").lower() == "queue"
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from config import logger
+from http_client import PROVIDER_HOSTS, http_client
+from utils import create_async_redis_client
+
+# Endpoint leve usado para sondar cada chave
+PROBE_URLS = {
+    "groq": "https://api.groq.com/openai/v1/models",
+    "openai": "https://api.openai.com/v1/models",
+}
+
+def provider_for_url(url: str) -> Optional[str]:
+    return PROVIDER_HOSTS.get(urlparse(url).hostname or "")
+
+def key_from_headers(headers: dict) -> Optional[str]:
+    authorization = headers.get("Authorization", "")
+    return authorization[len("Bearer "):] if authorization.startswith("Bearer ") else None
+
+def classify_error(status: Optional[int], message: str = "") -> Optional[str]:
+    """
+    Classe do erro de uma resposta do provedor: "auth", "rate_limit",
+    "server", "bad_request" ou "network" (sem resposta). None quando a
+    resposta foi bem-sucedida.
+    """
+    message = (message or "").lower()
+    if status is None:
+        return "network"
+    if (status in (401, 403) or "invalid_api_key" in message
+            or "invalid api key" in message or "organization_restricted" in message):
+        return "auth"
+    if status == 429:
+        return "rate_limit"
+    if status >= 500:
+        return "server"
+    if status >= 400:
+        return "bad_request"
+    return None
+
+class KeyHealthMonitor:
+    """
+    Saúde das chaves GROQ e OpenAI, sem sondar a chave no caminho da
+    requisição.
+
+    Uma tarefa em segundo plano sonda todas as chaves a cada
+    KEY_HEALTH_INTERVAL segundos (um único processo por intervalo, por um
+    lock no Redis) e as respostas reais das chamadas atualizam o estado
+    passivamente. O estado fica no hash `transcrevezap:key_health:<provedor>`
+    (saudável, horário da última verificação e classe do último erro) e é
+    lido com cache local de KEY_HEALTH_REFRESH segundos.
+
+    Só erros de autenticação tornam a chave não saudável; limite de taxa e
+    falhas do provedor não são culpa da chave.
+    """
+    KEY_PREFIX = "transcrevezap:key_health"
+    LOCK_KEY = "transcrevezap:key_health_probe_lock"
+    KEY_SETS = {
+        "groq": "transcrevezap:groq_keys",
+        "openai": "transcrevezap:openai_keys",
+    }
+    UNHEALTHY_ERRORS = {"auth"}
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        self.interval = float(os.getenv("KEY_HEALTH_INTERVAL", 300))
+        self.refresh = float(os.getenv("KEY_HEALTH_REFRESH", 10))
+        self._local: Dict[str, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # Só um processo (API ou worker) sonda as chaves por intervalo
+                if await self.redis.set(self.LOCK_KEY, os.getpid(), nx=True, ex=max(int(self.interval), 1)):
+                    await self.probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Erro no monitor de saúde das chaves: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def probe_all(self):
+        for provider, key_set in self.KEY_SETS.items():
+            keys = list(await self.redis.smembers(key_set))
+            results = await asyncio.gather(*(self.probe(provider, key) for key in keys))
+            for key, error in zip(keys, results):
+                await self.report(provider, key, error, source="probe")
+
+            # Remove o estado de chaves que saíram do pool
+            stale = set(await self.redis.hkeys(self._get_key(provider))) - set(keys)
+            if stale:
+                await self.redis.hdel(self._get_key(provider), *stale)
+                self._local.pop(provider, None)
+
+            unhealthy = [key[-4:] for key, error in zip(keys, results) if error in self.UNHEALTHY_ERRORS]
+            if unhealthy:
+                logger.warning(f"Chaves {provider} com falha de autenticação (últimos caracteres): {unhealthy}")
+
+    async def probe(self, provider: str, key: str) -> Optional[str]:
+        """Sonda uma chave e retorna a classe do erro (None quando saudável)."""
+        try:
+            session = http_client.get_session(provider)
+            async with session.get(PROBE_URLS[provider], headers={"Authorization": f"Bearer {key}"}) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return None if data.get("data") else "bad_request"
+                return classify_error(response.status, await response.text())
+        except Exception:
+            return "network"
+
+    def _get_key(self, provider: str) -> str:
+        return f"{self.KEY_PREFIX}:{provider}"
+
+    async def report(self, provider: str, key: str, error: Optional[str], source: str = "request"):
+        """Registra o resultado de uma sonda ou de uma chamada real com a chave."""
+        if not provider or not key:
+            return
+        health = await self.get_health(provider)
+        current = health.get(key)
+        # Sucessos em chaves já saudáveis não precisam de escrita no Redis
+        if source == "request" and error is None and current and current["healthy"] and current["error"] is None:
+            return
+
+        entry = {
+            "healthy": error not in self.UNHEALTHY_ERRORS,
+            "error": error,
+            "checked_at": time.time(),
+            "source": source,
+        }
+        health[key] = entry
+        try:
+            await self.redis.hset(self._get_key(provider), key, json.dumps(entry))
+        except Exception as e:
+            logger.warning(f"Erro ao gravar saúde da chave {provider}: {e}")
+        if current and current["healthy"] != entry["healthy"]:
+            logger.warning(f"Chave {provider} ...{key[-4:]} agora {'saudável' if entry['healthy'] else 'não saudável'} ({error})")
+
+    async def get_health(self, provider: str) -> Dict[str, dict]:
+        """Estado de todas as chaves do provedor (cache local de KEY_HEALTH_REFRESH s)."""
+        loaded_at, health = self._local.get(provider, (0, None))
+        if health is not None and time.monotonic() - loaded_at < self.refresh:
+            return health
+        try:
+            raw = await self.redis.hgetall(self._get_key(provider))
+        except Exception as e:
+            logger.warning(f"Erro ao ler saúde das chaves {provider}: {e}")
+            return health or {}
+        health = {}
+        for key, value in raw.items():
+            try:
+                health[key] = json.loads(value)
+            except ValueError:
+                continue
+        self._local[provider] = (time.monotonic(), health)
+        return health
+
+    async def is_healthy(self, provider: str, key: str) -> bool:
+        """Chaves ainda não verificadas são consideradas saudáveis."""
+        entry = (await self.get_health(provider)).get(key)
+        return entry is None or entry["healthy"]
+
+    def get_stats(self) -> dict:
+        stats = {}
+        for provider, (_, health) in self._local.items():
+            stats[provider] = {
+                "healthy": sum(1 for entry in health.values() if entry["healthy"]),
+                "unhealthy": sum(1 for entry in health.values() if not entry["healthy"]),
+            }
+        return stats
+
+# Instância única por processo
+key_health = KeyHealthMonitor()
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import re
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from config import logger
+from utils import create_async_redis_client
+
+# Escolhe, entre as chaves candidatas, a de maior folga nos limites de taxa
+# e registra um lease nela. Retorna {posição da chave (0 = nenhuma), espera
+# em ms até alguma chave liberar}.
+LEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local best, best_score, best_inflight, wait = 0, -1, 0, nil
+for i = 1, #KEYS, 2 do
+    local state = {}
+    local raw = redis.call('HGETALL', KEYS[i])
+    for j = 1, #raw, 2 do
+        state[raw[j]] = raw[j + 1]
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[i + 1], '-inf', now)
+    local inflight = redis.call('ZCARD', KEYS[i + 1])
+
+    local blocked_until = tonumber(state['parked_until'] or '0')
+    local score = 1
+    if blocked_until <= now then
+        blocked_until = 0
+        for field, value in pairs(state) do
+            local bucket = string.match(field, '^(.+):remaining$')
+            if bucket then
+                local remaining = tonumber(value)
+                local limit = tonumber(state[bucket .. ':limit'] or value)
+                local reset_at = tonumber(state[bucket .. ':reset_at'] or '0')
+                if reset_at <= now then
+                    remaining = limit
+                end
+                if bucket == 'requests' then
+                    remaining = remaining - inflight
+                end
+                if remaining <= 0 then
+                    blocked_until = math.max(blocked_until, reset_at, now + 250)
+                elseif limit > 0 then
+                    score = math.min(score, remaining / limit)
+                end
+            end
+        end
+    end
+
+    if blocked_until > now then
+        if not wait or blocked_until - now < wait then
+            wait = blocked_until - now
+        end
+    elseif score > best_score or (score == best_score and inflight < best_inflight) then
+        best, best_score, best_inflight = i, score, inflight
+    end
+end
+
+if best == 0 then
+    return {0, wait or 0}
+end
+redis.call('ZADD', KEYS[best + 1], now + tonumber(ARGV[2]), ARGV[3])
+redis.call('PEXPIRE', KEYS[best + 1], tonumber(ARGV[2]))
+return {(best + 1) / 2, 0}
+"""
+
+# Encerra o lease e grava os limites informados pelo provedor
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+if #ARGV > 2 then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 1
+"""
+
+RATE_LIMIT_HEADER = re.compile(r"^x-ratelimit-(limit|remaining|reset)-(.+)$")
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+def parse_duration(value: str) -> Optional[float]:
+    """Converte durações como "2m59.56s", "120ms" ou "7" para segundos."""
+    value = (value or "").strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def parse_rate_limit_headers(headers, now_ms: int) -> Dict[str, float]:
+    """
+    Campos de estado a partir dos cabeçalhos x-ratelimit-* (requests,
+    tokens e quaisquer outros baldes informados) e do retry-after.
+    """
+    fields = {}
+    for name, value in (headers or {}).items():
+        match = RATE_LIMIT_HEADER.match(name.lower())
+        if not match:
+            continue
+        kind, bucket = match.groups()
+        if kind == "reset":
+            seconds = parse_duration(value)
+            if seconds is not None:
+                fields[f"{bucket}:reset_at"] = now_ms + int(seconds * 1000)
+        else:
+            try:
+                fields[f"{bucket}:{kind}"] = float(value)
+            except ValueError:
+                continue
+    retry_after = parse_duration((headers or {}).get("retry-after", ""))
+    if retry_after:
+        fields["parked_until"] = now_ms + int(retry_after * 1000)
+    return fields
+
+class KeyScheduler:
+    """
+    Agenda o uso das chaves GROQ/OpenAI respeitando os limites de taxa.
+
+    Cada chave tem no Redis um hash com os baldes informados pelos
+    cabeçalhos `x-ratelimit-*` das respostas (restante, limite e horário de
+    reposição de requests, tokens etc.) e um zset com os leases em uso.
+    O lease e a liberação são scripts Lua, então todos os processos da API
+    e dos workers compartilham a mesma visão: a chave escolhida é a de
+    maior folga, descontadas as requisições em andamento, e chaves sem
+    folga ou com `retry-after` ficam estacionadas até a reposição.
+    """
+    KEY_PREFIX = "transcrevezap:key_scheduler"
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        self.lease_ttl = float(os.getenv("KEY_LEASE_TTL", 120))
+        self.max_wait = float(os.getenv("KEY_SCHEDULER_MAX_WAIT", 5))
+        self.default_park = float(os.getenv("KEY_SCHEDULER_DEFAULT_PARK", 10))
+        self.state_ttl = 86400
+        self._lease = self.redis.register_script(LEASE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+    def _get_keys(self, provider: str, key: str) -> List[str]:
+        return [f"{self.KEY_PREFIX}:{provider}:{key}", f"{self.KEY_PREFIX}:{provider}:{key}:leases"]
+
+    async def acquire(self, provider: str, keys: List[str]) -> Optional[Tuple[str, str]]:
+        """
+        Reserva a chave com mais folga. Se todas estiverem sem folga, espera
+        a primeira reposição por até KEY_SCHEDULER_MAX_WAIT segundos.
+
+        Returns:
+            (chave, id do lease), ou None se nenhuma chave liberar a tempo
+        """
+        if not keys:
+            return None
+        redis_keys = [name for key in keys for name in self._get_keys(provider, key)]
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            lease_id = uuid.uuid4().hex
+            index, wait_ms = await self._lease(
+                keys=redis_keys,
+                args=[int(time.time() * 1000), int(self.lease_ttl * 1000), lease_id]
+            )
+            if index:
+                return keys[int(index) - 1], lease_id
+            wait = int(wait_ms) / 1000
+            if time.monotonic() + wait > deadline:
+                logger.warning(f"Todas as chaves {provider} sem folga de limite; próxima em {wait:.1f}s")
+                return None
+            await asyncio.sleep(wait)
+
+    async def release(self, provider: str, key: str, lease_id: Optional[str], headers=None, status: Optional[int] = None):
+        """
+        Encerra o lease `lease_id` da chave (sem lease, só registra a
+        resposta) e atualiza os baldes com os cabeçalhos da resposta. Um 429
+        sem retry-after estaciona a chave por KEY_SCHEDULER_DEFAULT_PARK
+        segundos.
+        """
+        if not provider or not key:
+            return
+
+        now_ms = int(time.time() * 1000)
+        fields = parse_rate_limit_headers(headers, now_ms)
+        if status == 429 and "parked_until" not in fields:
+            fields["parked_until"] = now_ms + int(self.default_park * 1000)
+        if "parked_until" in fields:
+            logger.warning(f"Chave {provider} ...{key[-4:]} estacionada por {(fields['parked_until'] - now_ms) / 1000:.1f}s")
+
+        args = [lease_id or "", self.state_ttl]
+        for field, value in fields.items():
+            args.extend([field, value])
+        try:
+            await self._release(keys=self._get_keys(provider, key), args=args)
+        except Exception as e:
+            logger.warning(f"Erro ao liberar chave {provider}: {e}")
+
+    async def park(self, provider: str, key: str, seconds: float):
+        """Estaciona a chave por um tempo, sem lease (equivalente à antiga penalidade)."""
+        parked_until = int(time.time() * 1000 + seconds * 1000)
+        await self._release(keys=self._get_keys(provider, key), args=["", self.state_ttl, "parked_until", parked_until])
+
+# Instância única por processo
+key_scheduler = KeyScheduler()
@@ -0,0 +1,120 @@
+import asyncio
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from admission import AdmissionRejected
+
+JobFactory = Callable[[], Awaitable[Any]]
+
+class KeyedExecutor:
+    """
+    Executa jobs na ordem de chegada dentro de cada chave (o `remote_jid`)
+    e em paralelo entre chaves diferentes.
+
+    Cada chave tem uma fila própria, drenada por uma única task; assim os
+    áudios de um mesmo chat são respondidos na ordem em que chegaram. A
+    fila de cada chave é limitada a `max_pending_per_key` jobs para que um
+    grupo muito ativo não acumule trabalho sem limite. `max_concurrency`
+    (0 = sem limite) limita quantas chaves executam ao mesmo tempo.
+    """
+
+    def __init__(self, max_pending_per_key: Optional[int] = None, max_concurrency: int = 0):
+        if max_pending_per_key is None:
+            max_pending_per_key = int(os.getenv("CHAT_QUEUE_MAX_PENDING", 10))
+        self.max_pending_per_key = max_pending_per_key
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self._queues: Dict[str, Deque[Tuple[JobFactory, asyncio.Future]]] = {}
+        self._runners: Dict[str, asyncio.Task] = {}
+        self._job_done: Optional[asyncio.Event] = None
+
+    def pending(self, key: str) -> int:
+        """Jobs da chave ainda não concluídos (em execução + aguardando)."""
+        queue = self._queues.get(key)
+        return len(queue) if queue else 0
+
+    def has_room(self, key: str) -> bool:
+        return self.pending(key) < self.max_pending_per_key
+
+    def spawn(self, key: str, factory: JobFactory, park: bool = False) -> asyncio.Future:
+        """
+        Coloca o job na fila da chave e retorna um Future com o resultado.
+        Lança AdmissionRejected (429) se a fila da chave estiver cheia, a
+        menos que `park` seja True: o job fica estacionado no fim da fila e
+        roda na sua vez (jobs que o worker já leu do Redis e não pode
+        recusar).
+        """
+        if not park and not self.has_room(key):
+            raise AdmissionRejected(429, "Fila de áudios do chat cheia", self._retry_after(key))
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(key, deque())
+        queue.append((factory, future))
+        runner = self._runners.get(key)
+        if runner is None or runner.done():
+            self._runners[key] = asyncio.create_task(self._drain(key))
+        return future
+
+    async def submit(self, key: str, factory: JobFactory) -> Any:
+        """Enfileira o job na chave e aguarda o seu resultado."""
+        return await self.spawn(key, factory)
+
+    def total_pending(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def wait_for_capacity(self, limit: int):
+        """Aguarda até haver menos de `limit` jobs pendentes no total."""
+        while self.total_pending() >= limit:
+            await self._wait_job_done()
+
+    async def join(self):
+        """Aguarda todas as filas esvaziarem."""
+        while self._runners:
+            await asyncio.gather(*list(self._runners.values()), return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        return {
+            "active_keys": len(self._queues),
+            "pending_jobs": self.total_pending(),
+            "max_pending_per_key": self.max_pending_per_key,
+            "longest_queue": max((len(queue) for queue in self._queues.values()), default=0),
+        }
+
+    async def _wait_job_done(self):
+        if self._job_done is None:
+            self._job_done = asyncio.Event()
+        await self._job_done.wait()
+
+    def _notify_job_done(self):
+        if self._job_done is not None:
+            self._job_done.set()
+            self._job_done = None
+
+    def _retry_after(self, key: str) -> int:
+        return max(1, self.pending(key) * 5)
+
+    async def _drain(self, key: str):
+        queue = self._queues[key]
+        try:
+            while queue:
+                factory, future = queue[0]
+                try:
+                    if self._semaphore is not None:
+                        async with self._semaphore:
+                            result = await factory()
+                    else:
+                        result = await factory()
+                    if not future.done():
+                        future.set_result(result)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                finally:
+                    # O job só sai da fila ao terminar, para contar como pendente
+                    queue.popleft()
+                    self._notify_job_done()
+        finally:
+            if not queue:
+                self._queues.pop(key, None)
+            self._runners.pop(key, None)
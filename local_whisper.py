@@ -0,0 +1,149 @@
+import asyncio
+import importlib.util
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from audio import AudioBuffer
+from config import logger
+
+# Modelo carregado uma vez em cada processo do pool (ver _load_model)
+_model = None
+_beam_size = 1
+
+def _load_model(model_size: str, compute_type: str, threads: int, beam_size: int, model_dir: Optional[str]):
+    """Inicializador dos processos do pool: mantém o modelo carregado entre as transcrições."""
+    global _model, _beam_size
+    from faster_whisper import WhisperModel
+
+    _model = WhisperModel(
+        model_size,
+        device="cpu",
+        compute_type=compute_type,
+        cpu_threads=threads,
+        download_root=model_dir,
+    )
+    _beam_size = beam_size
+
+def _warm() -> int:
+    return os.getpid()
+
+def _transcribe(data: bytes, language: Optional[str]) -> dict:
+    """
+    Executado no pool de processos. Retorna o mesmo formato do verbose_json
+    das APIs (texto, idioma, duração e segmentos), que também serve onde só
+    o texto é usado.
+    """
+    segments, info = _model.transcribe(io.BytesIO(data), language=language, beam_size=_beam_size)
+    segments = [
+        {"id": index, "start": round(segment.start, 2), "end": round(segment.end, 2), "text": segment.text}
+        for index, segment in enumerate(segments)
+    ]
+    return {
+        "text": "".join(segment["text"] for segment in segments).strip(),
+        "language": info.language,
+        "duration": info.duration,
+        "segments": segments,
+    }
+
+class LocalWhisper:
+    """
+    Provedor de transcrição local ("local"), com faster-whisper
+    (CTranslate2) na CPU, sem chamada de rede nem custo por áudio.
+
+    O modelo (LOCAL_WHISPER_MODEL, quantizado em LOCAL_WHISPER_COMPUTE_TYPE)
+    fica carregado em um pool de LOCAL_WHISPER_WORKERS processos, cada um
+    com LOCAL_WHISPER_THREADS threads; com LOCAL_WHISPER_PRELOAD=true os
+    processos sobem e carregam o modelo na inicialização da API/worker.
+
+    Além de provedor principal no manager, pode atender só os áudios de até
+    LOCAL_WHISPER_MAX_SECONDS (ver AudioRouter) e servir de fallback quando
+    o GROQ/OpenAI falha (LOCAL_WHISPER_FALLBACK=true). O pacote
+    `faster-whisper` é opcional: sem ele o provedor fica indisponível, e
+    se o modelo não carregar fica indisponível por
+    LOCAL_WHISPER_RETRY_SECONDS, com as transcrições indo para o GROQ/OpenAI.
+    """
+
+    def __init__(self):
+        self.model_size = os.getenv("LOCAL_WHISPER_MODEL", "small")
+        self.compute_type = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+        self.workers = int(os.getenv("LOCAL_WHISPER_WORKERS", 1))
+        self.threads = int(os.getenv("LOCAL_WHISPER_THREADS", 2))
+        self.beam_size = int(os.getenv("LOCAL_WHISPER_BEAM_SIZE", 1))
+        self.model_dir = os.getenv("LOCAL_WHISPER_MODEL_DIR") or None
+        self.max_seconds = float(os.getenv("LOCAL_WHISPER_MAX_SECONDS", 0))
+        self.fallback_enabled = os.getenv("LOCAL_WHISPER_FALLBACK", "false").lower() == "true"
+        self.preload = os.getenv("LOCAL_WHISPER_PRELOAD", "false").lower() == "true"
+        self.retry_seconds = float(os.getenv("LOCAL_WHISPER_RETRY_SECONDS", 300))
+        self._failed_until = 0.0
+        self._installed = importlib.util.find_spec("faster_whisper") is not None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if (self.max_seconds > 0 or self.fallback_enabled or self.preload) and not self._installed:
+            logger.warning("Whisper local configurado, mas o pacote faster-whisper não está instalado; provedor local desativado")
+
+    @property
+    def available(self) -> bool:
+        return self._installed and time.monotonic() >= self._failed_until
+
+    @property
+    def fallback(self) -> bool:
+        return self.fallback_enabled and self.available
+
+    @property
+    def model_name(self) -> str:
+        return f"faster-whisper-{self.model_size}"
+
+    def should_route(self, seconds: Optional[float]) -> bool:
+        """Áudio curto o bastante para ir direto ao Whisper local."""
+        return self.available and self.max_seconds > 0 and seconds is not None and seconds <= self.max_seconds
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_load_model,
+                initargs=(self.model_size, self.compute_type, self.threads, self.beam_size, self.model_dir),
+            )
+        return self._pool
+
+    async def start(self):
+        """Sobe os processos do pool e carrega o modelo (LOCAL_WHISPER_PRELOAD)."""
+        if not (self.preload and self._installed):
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            pids = await asyncio.gather(*[
+                loop.run_in_executor(self._get_pool(), _warm) for _ in range(self.workers)
+            ])
+            logger.info(f"Whisper local ({self.model_name}) carregado em {len(set(pids))} processo(s)")
+        except Exception as e:
+            logger.error(f"Erro ao carregar o Whisper local: {e}")
+            self._mark_failed()
+
+    async def transcribe(self, audio: AudioBuffer, language: Optional[str] = None) -> dict:
+        if not self._installed:
+            raise Exception("Whisper local indisponível: instale o pacote faster-whisper")
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_pool(), _transcribe, audio.read(), language)
+        except BrokenProcessPool as e:
+            # Um processo morreu (ex.: falta de memória ao carregar o modelo);
+            # depois de LOCAL_WHISPER_RETRY_SECONDS o próximo uso recria o pool
+            self._mark_failed()
+            raise Exception(f"Pool do Whisper local interrompido: {e}")
+
+    def _mark_failed(self):
+        self.shutdown()
+        self._failed_until = time.monotonic() + self.retry_seconds
+        logger.warning(f"Whisper local indisponível pelos próximos {self.retry_seconds:.0f}s")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+# Instância única por processo
+local_whisper = LocalWhisper()
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from settings_cache import settings_cache
+from utils import create_async_redis_client
+
+class LogSink:
+    """
+    Buffer em memória para os logs gravados no Redis pelo AsyncStorageHandler.
+
+    - O nível é filtrado antes de qualquer serialização; logs DEBUG só são
+      aceitos com o modo debug ativo no manager, DEBUG_MODE=true ou
+      LOG_LEVEL=DEBUG, e podem ser amostrados com LOG_DEBUG_SAMPLE_RATE.
+      O modo debug do manager é acompanhado pelo settings_cache.
+    - Os registros aceitos vão para um deque limitado (LOG_BUFFER_SIZE); se
+      o buffer encher, os mais antigos são descartados em vez de bloquear a
+      requisição.
+    - Uma task em segundo plano grava os registros em lote, com um único
+      pipeline (LPUSH + LTRIM), a cada LOG_FLUSH_INTERVAL segundos ou
+      quando LOG_FLUSH_BATCH registros se acumulam.
+    """
+    LOGS_KEY = "transcrevezap:logs"
+    MAX_LOGS = 1000
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        debug_mode = os.getenv("DEBUG_MODE", "false").lower() == "true"
+        level_name = "DEBUG" if debug_mode else os.getenv("LOG_LEVEL", "INFO").upper()
+        # Nível do ambiente; o modo debug do manager só pode baixá-lo
+        self.base_level = getattr(logging, level_name, logging.INFO)
+        self.min_level = self.base_level
+        self.debug_sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 1.0))
+        self.flush_interval = float(os.getenv("LOG_FLUSH_INTERVAL", 1.0))
+        self.flush_batch = int(os.getenv("LOG_FLUSH_BATCH", 100))
+        self.buffer = deque(maxlen=int(os.getenv("LOG_BUFFER_SIZE", 5000)))
+        self.dropped = 0
+        self.console = logging.getLogger("StorageHandler")
+        self._flush_event: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def apply_settings(self, snapshot):
+        """Atualiza o nível mínimo com o modo debug salvo no manager."""
+        self.min_level = logging.DEBUG if snapshot.debug_mode else self.base_level
+
+    def accepts(self, level: str) -> bool:
+        """Decide se um registro deste nível deve ser mantido."""
+        levelno = getattr(logging, level.upper(), logging.INFO)
+        if levelno < self.min_level:
+            return False
+        if levelno == logging.DEBUG and self.debug_sample_rate < 1.0:
+            return random.random() < self.debug_sample_rate
+        return True
+
+    def emit(self, level: str, message: str, metadata: dict = None):
+        """Enfileira um registro sem fazer I/O; nunca bloqueia o chamador."""
+        if not self.accepts(level):
+            return
+
+        log_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "level": level,
+            "message": message,
+            "metadata": json.dumps(metadata, default=str) if metadata else None
+        }
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(json.dumps(log_entry))
+        self.console.log(getattr(logging, level.upper(), logging.INFO), f"{message} | Metadata: {metadata}")
+
+        self._ensure_started()
+        if len(self.buffer) >= self.flush_batch and self._flush_event is not None:
+            self._flush_event.set()
+
+    async def flush(self):
+        """Grava todo o buffer no Redis em um único pipeline."""
+        if not self.buffer:
+            return
+        entries = list(self.buffer)
+        self.buffer.clear()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            # LPUSH com vários valores mantém o mais recente no topo da lista
+            pipe.lpush(self.LOGS_KEY, *entries)
+            pipe.ltrim(self.LOGS_KEY, 0, self.MAX_LOGS - 1)
+            await pipe.execute()
+        except Exception as e:
+            self.console.error(f"Erro ao gravar logs no Redis ({len(entries)} descartados): {e}")
+
+    async def start(self):
+        settings_cache.on_change(self.apply_settings)
+        self._ensure_started()
+
+    async def stop(self):
+        """Para a task de gravação e grava o que restou no buffer."""
+        if self._task is not None:
+            self._stopping = True
+            self._flush_event.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+        if self.dropped:
+            self.console.warning(f"{self.dropped} logs descartados por excesso no buffer")
+
+    def _ensure_started(self):
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_event = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+# Instância única por processo
+log_sink = LogSink()
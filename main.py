@@ -1,110 +1,157 @@
 from fastapi import FastAPI, Request, HTTPException
-from services import (
-    convert_base64_to_file,
-    transcribe_audio,
-    send_message_to_whatsapp,
-    get_audio_base64,
-    summarize_text_if_needed,
-    download_remote_audio,
-)
+from fastapi.responses import JSONResponse
 from models import WebhookRequest
 from config import logger, settings, redis_client
-from storage import StorageHandler
+from storage import AsyncStorageHandler
+from pipeline import process_audio_message
+from settings_cache import settings_cache
+from http_client import http_client
+from log_sink import log_sink
+from stages import drain_background
+from preprocess import audio_preprocessor
+from key_health import key_health
+from local_whisper import local_whisper
+from circuit_breaker import circuit_breaker
+from hedging import transcription_hedger
+from idempotency import idempotency
+from admission import admission, AdmissionRejected
+from keyed_executor import KeyedExecutor
+from job_queue import JobQueue, is_queue_mode
+from utils import close_async_redis_pool
 import traceback
 import os
 import asyncio
-import aiohttp
 
 app = FastAPI()
-storage = StorageHandler()
+storage = AsyncStorageHandler()
+job_queue = JobQueue()
+# Áudios do mesmo chat são processados em ordem; chats diferentes em paralelo
+chat_executor = KeyedExecutor()
+
+# Encaminhamentos para webhooks em andamento (limitados por WEBHOOK_FORWARD_MAX_PENDING)
+forward_tasks = set()
+WEBHOOK_FORWARD_MAX_PENDING = int(os.getenv("WEBHOOK_FORWARD_MAX_PENDING", 100))
+
 @app.on_event("startup")
 async def startup_event():
     api_domain = os.getenv("API_DOMAIN", "seu.dominio.com")
     redis_client.set("API_DOMAIN", api_domain)
-# Função para buscar configurações do Redis com fallback para valores padrão
-def get_config(key, default=None):
-    try:
-        value = redis_client.get(key)
-        if value is None:
-            logger.warning(f"Configuração '{key}' não encontrada no Redis. Usando padrão: {default}")
-            return default
-        return value
-    except Exception as e:
-        logger.error(f"Erro ao acessar Redis: {e}")
-        return default
+    await settings_cache.start()
+    await http_client.start()
+    await log_sink.start()
+    await key_health.start()
+    if is_queue_mode():
+        await job_queue.ensure_group()
+        logger.info("Modo fila ativo: áudios serão processados pelos workers")
+    else:
+        # No modo fila o modelo local fica carregado só nos workers
+        await local_whisper.start()
 
-# Carregando configurações dinâmicas do Redis
-def load_dynamic_settings():
-    return {
-        "GROQ_API_KEY": get_config("GROQ_API_KEY", "default_key"),
-        "BUSINESS_MESSAGE": get_config("BUSINESS_MESSAGE", "*Impacte AI* Premium Services"),
-        "PROCESS_GROUP_MESSAGES": get_config("PROCESS_GROUP_MESSAGES", "false") == "true",
-        "PROCESS_SELF_MESSAGES": get_config("PROCESS_SELF_MESSAGES", "true") == "true",
-        "DEBUG_MODE": get_config("DEBUG_MODE", "false") == "true",
-    }
+@app.on_event("shutdown")
+async def shutdown_event():
+    await drain_background()
+    audio_preprocessor.shutdown()
+    local_whisper.shutdown()
+    await key_health.stop()
+    await settings_cache.stop()
+    await http_client.close()
+    await log_sink.stop()
+    await job_queue.close()
+    await close_async_redis_pool()
 
-async def forward_to_webhooks(body: dict, storage: StorageHandler):
+def payload_for_log(body: dict) -> dict:
+    """Cópia do payload sem o áudio base64 inline, que pode ter vários MB."""
+    message = body.get("data", {}).get("message")
+    if not isinstance(message, dict) or not message.get("base64"):
+        return body
+    data = {**body["data"], "message": {**message, "base64": f"<{len(message['base64'])} caracteres>"}}
+    return {**body, "data": data}
+
+async def forward_to_webhooks(body: dict, storage: AsyncStorageHandler, webhooks):
     """Encaminha o payload para todos os webhooks cadastrados."""
-    webhooks = storage.get_webhook_redirects()
-    
-    async with aiohttp.ClientSession() as session:
-        for webhook in webhooks:
-            try:
-                # Configura os headers mantendo o payload intacto
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-TranscreveZAP-Forward": "true",  # Header para identificação da origem
-                    "X-TranscreveZAP-Webhook-ID": webhook["id"]
-                }
-                
-                async with session.post(
-                    webhook["url"],
-                    json=body,  # Envia o payload original sem modificações
-                    headers=headers,
-                    timeout=10
-                ) as response:
-                    if response.status in [200, 201, 202]:
-                        storage.update_webhook_stats(webhook["id"], True)
-                    else:
-                        error_text = await response.text()
-                        storage.update_webhook_stats(
-                            webhook["id"],
-                            False,
-                            f"Status {response.status}: {error_text}"
-                        )
-                        # Registra falha para retry posterior
-                        storage.add_failed_delivery(webhook["id"], body)
-            except Exception as e:
-                storage.update_webhook_stats(
-                    webhook["id"],
-                    False,
-                    f"Erro ao encaminhar: {str(e)}"
-                )
-                # Registra falha para retry posterior
-                storage.add_failed_delivery(webhook["id"], body)
+    session = http_client.get_session("webhooks")
+    for webhook in webhooks:
+        try:
+            # Configura os headers mantendo o payload intacto
+            headers = {
+                "Content-Type": "application/json",
+                "X-TranscreveZAP-Forward": "true",  # Header para identificação da origem
+                "X-TranscreveZAP-Webhook-ID": webhook["id"]
+            }
+            
+            async with session.post(
+                webhook["url"],
+                json=body,  # Envia o payload original sem modificações
+                headers=headers
+            ) as response:
+                if response.status in [200, 201, 202]:
+                    await storage.update_webhook_stats(webhook["id"], True)
+                else:
+                    error_text = await response.text()
+                    await storage.update_webhook_stats(
+                        webhook["id"],
+                        False,
+                        f"Status {response.status}: {error_text}"
+                    )
+                    # Registra falha para retry posterior
+                    await storage.add_failed_delivery(webhook["id"], body)
+        except Exception as e:
+            await storage.update_webhook_stats(
+                webhook["id"],
+                False,
+                f"Erro ao encaminhar: {str(e)}"
+            )
+            # Registra falha para retry posterior
+            await storage.add_failed_delivery(webhook["id"], body)
+
+@app.get("/status")
+async def status():
+    """Métricas de carga para monitoramento."""
+    stats = {
+        "processing_mode": "queue" if is_queue_mode() else "inline",
+        "admission": admission.get_stats(),
+        "chat_queues": chat_executor.get_stats(),
+        "webhook_forwards_pending": len(forward_tasks),
+        "log_buffer": len(log_sink.buffer),
+        "key_health": key_health.get_stats(),
+        "circuits": await circuit_breaker.get_stats(),
+        "hedging": await transcription_hedger.get_stats(),
+    }
+    if is_queue_mode():
+        stats["job_queue"] = await job_queue.get_stats()
+    return stats
 
 @app.post("/transcreve-audios")
 async def transcreve_audios(request: Request):
     try:
         body = await request.json()
-        dynamic_settings = load_dynamic_settings()
+        runtime_settings = await settings_cache.current()
         # Iniciar o encaminhamento em background
-        asyncio.create_task(forward_to_webhooks(body, storage))
+        if runtime_settings.webhooks:
+            if len(forward_tasks) < WEBHOOK_FORWARD_MAX_PENDING:
+                task = asyncio.create_task(forward_to_webhooks(body, storage, runtime_settings.webhooks))
+                forward_tasks.add(task)
+                task.add_done_callback(forward_tasks.discard)
+            else:
+                # Sem vaga: registra para retry posterior em vez de acumular tasks
+                for webhook in runtime_settings.webhooks:
+                    await storage.add_failed_delivery(webhook["id"], body)
+                await storage.add_log("WARNING", "Encaminhamento para webhooks adiado - limite de envios pendentes", {
+                    "pending": len(forward_tasks)
+                })
         # Log inicial da requisição
-        storage.add_log("INFO", "Nova requisição de transcrição recebida", {
+        await storage.add_log("INFO", "Nova requisição de transcrição recebida", {
             "instance": body.get("instance"),
             "event": body.get("event")
         })
 
-        if dynamic_settings["DEBUG_MODE"]:
-            storage.add_log("DEBUG", "Payload completo recebido", {
-                "body": body
+        if runtime_settings.debug_mode:
+            await storage.add_log("DEBUG", "Payload completo recebido", {
+                "body": payload_for_log(body)
             })
 
         # Extraindo informações
-        server_url = body["server_url"]
         instance = body["instance"]
-        apikey = body["apikey"]
         audio_key = body["data"]["key"]["id"]
         from_me = body["data"]["key"]["fromMe"]
         remote_jid = body["data"]["key"]["remoteJid"]
@@ -112,16 +159,16 @@ async def transcreve_audios(request: Request):
 
         # Verificação de tipo de mensagem
         if "audioMessage" not in message_type:
-            storage.add_log("INFO", "Mensagem ignorada - não é áudio", {
+            await storage.add_log("INFO", "Mensagem ignorada - não é áudio", {
                 "message_type": message_type,
                 "remote_jid": remote_jid
             })
             return {"message": "Mensagem recebida não é um áudio"}
 
         # Verificação de permissões
-        if not storage.can_process_message(remote_jid):
+        if not runtime_settings.can_process_message(remote_jid):
             is_group = "@g.us" in remote_jid
-            storage.add_log("INFO", 
+            await storage.add_log("INFO", 
                 "Mensagem não autorizada para processamento",
                 {
                     "remote_jid": remote_jid,
@@ -132,114 +179,81 @@ async def transcreve_audios(request: Request):
             return {"message": "Mensagem não autorizada para processamento"}
 
         # Verificação do modo de processamento (grupos/todos)
-        process_mode = storage.get_process_mode()
+        process_mode = runtime_settings.process_mode
         is_group = "@g.us" in remote_jid
         
         if process_mode == "groups_only" and not is_group:
-            storage.add_log("INFO", "Mensagem ignorada - modo apenas grupos ativo", {
+            await storage.add_log("INFO", "Mensagem ignorada - modo apenas grupos ativo", {
                 "remote_jid": remote_jid,
                 "process_mode": process_mode,
                 "is_group": is_group
             })
             return {"message": "Modo apenas grupos ativo - mensagens privadas ignoradas"}
 
-        if from_me and not dynamic_settings["PROCESS_SELF_MESSAGES"]:
-            storage.add_log("INFO", "Mensagem própria ignorada", {
+        if from_me and not runtime_settings.process_self_messages:
+            await storage.add_log("INFO", "Mensagem própria ignorada", {
                 "remote_jid": remote_jid
             })
             return {"message": "Mensagem enviada por mim, sem operação"}
 
-        # Obter áudio
-        try:
-            if "mediaUrl" in body["data"]["message"]:
-                media_url = body["data"]["message"]["mediaUrl"]
-                storage.add_log("DEBUG", "Baixando áudio via URL", {"mediaUrl": media_url})
-                audio_source = await download_remote_audio(media_url)   # Baixa o arquivo remoto e retorna o caminho local
-            else:
-                storage.add_log("DEBUG", "Obtendo áudio via base64")
-                base64_audio = await get_audio_base64(server_url, instance, apikey, audio_key)
-                audio_source = await convert_base64_to_file(base64_audio)
-                storage.add_log("DEBUG", "Áudio convertido", {"source": audio_source})
-
-            # Carregar configurações de formatação
-            output_mode = get_config("output_mode", "both")
-            summary_header = get_config("summary_header", "🤖 *Resumo do áudio:*")
-            transcription_header = get_config("transcription_header", "🔊 *Transcrição do áudio:*")
-            character_limit = int(get_config("character_limit", "500"))
-
-            # Verificar se timestamps estão habilitados
-            use_timestamps = get_config("use_timestamps", "false") == "true"
-            
-            storage.add_log("DEBUG", "Informações da mensagem", {
-                "from_me": from_me,
-                "remote_jid": remote_jid,
-                "is_group": is_group
+        # Deduplicação: reentregas do mesmo webhook não são processadas de novo
+        previous = await idempotency.claim(instance, audio_key)
+        if previous is not None:
+            await storage.add_log("INFO", "Mensagem duplicada ignorada", {
+                "instance": instance,
+                "message_id": audio_key,
+                "state": previous.get("state")
             })
+            if previous.get("state") == idempotency.DONE and previous.get("outcome"):
+                return previous["outcome"]
+            return {"message": "Áudio já está em processamento", "state": previous.get("state")}
 
-            # Transcrever áudio
-            storage.add_log("INFO", "Iniciando transcrição")
-            transcription_text, has_timestamps = await transcribe_audio(
-                audio_source,
-                apikey=apikey,
-                remote_jid=remote_jid,
-                from_me=from_me,
-                use_timestamps=use_timestamps
-            )
-            # Log do resultado
-            storage.add_log("INFO", "Transcrição concluída", {
-                "has_timestamps": has_timestamps,
-                "text_length": len(transcription_text),
+        # Modo fila: apenas enfileira o job e responde imediatamente
+        if is_queue_mode():
+            try:
+                job_id = await job_queue.enqueue(body)
+            except Exception as e:
+                await idempotency.fail(instance, audio_key, str(e))
+                raise
+            await storage.add_log("INFO", "Áudio enfileirado para transcrição", {
+                "job_id": job_id,
                 "remote_jid": remote_jid
             })
-            # Determinar se precisa de resumo baseado no modo de saída
-            summary_text = None
-            if output_mode in ["both", "summary_only"] or (
-                output_mode == "smart" and len(transcription_text) > character_limit
-            ):
-                summary_text = await summarize_text_if_needed(transcription_text)
+            return JSONResponse(
+                status_code=202,
+                content={"message": "Áudio enfileirado para transcrição", "job_id": job_id}
+            )
 
-            # Construir mensagem baseada no modo de saída
-            message_parts = []
-            
-            if output_mode == "smart":
-                if len(transcription_text) > character_limit:
-                    message_parts.append(f"{summary_header}\n\n{summary_text}")
-                else:
-                    message_parts.append(f"{transcription_header}\n\n{transcription_text}")
-            else:
-                if output_mode in ["both", "summary_only"] and summary_text:
-                    message_parts.append(f"{summary_header}\n\n{summary_text}")
-                if output_mode in ["both", "transcription_only"]:
-                    message_parts.append(f"{transcription_header}\n\n{transcription_text}")
-            
-            # Adicionar mensagem de negócio
-            message_parts.append(dynamic_settings['BUSINESS_MESSAGE'])
-            
-            # Juntar todas as partes da mensagem
-            summary_message = "\n\n".join(message_parts)            
+        try:
+            # A espera na fila do chat já conta para a admissão
+            async with admission.queued() as ticket:
+                async def run_in_slot():
+                    async with admission.slot(instance, ticket):
+                        return await process_audio_message(body, runtime_settings)
 
-            # Enviar resposta
-            await send_message_to_whatsapp(
-                server_url,
-                instance,
-                apikey,
-                summary_message,
-                remote_jid,
-                audio_key,
-            )
+                outcome = await chat_executor.submit(remote_jid, run_in_slot)
+            await idempotency.complete(instance, audio_key, outcome)
+            return outcome
 
-            # Registrar sucesso
-            storage.record_processing(remote_jid)
-            storage.add_log("INFO", "Áudio processado com sucesso", {
+        except AdmissionRejected as e:
+            # Libera a mensagem para que a reentrega seja processada
+            await idempotency.fail(instance, audio_key, e.reason)
+            await storage.add_log("WARNING", f"Requisição recusada: {e.reason}", {
+                "instance": instance,
                 "remote_jid": remote_jid,
-                "transcription_length": len(transcription_text) if transcription_text else 0,
-                "summary_length": len(summary_text) if summary_text else 0  # Adiciona verificação
+                "status_code": e.status_code,
+                "retry_after": e.retry_after,
+                **admission.get_stats()
             })
-
-            return {"message": "Áudio transcrito e resposta enviada com sucesso"}
+            return JSONResponse(
+                status_code=e.status_code,
+                content={"message": e.reason, "retry_after": e.retry_after},
+                headers={"Retry-After": str(e.retry_after)}
+            )
 
         except Exception as e:
-            storage.add_log("ERROR", f"Erro ao processar áudio: {str(e)}", {
+            await idempotency.fail(instance, audio_key, str(e))
+            await storage.add_log("ERROR", f"Erro ao processar áudio: {str(e)}", {
                 "error_type": type(e).__name__,
                 "remote_jid": remote_jid,
                 "traceback": traceback.format_exc()
@@ -250,7 +264,7 @@ async def transcreve_audios(request: Request):
             )
 
     except Exception as e:
-        storage.add_log("ERROR", f"Erro na requisição: {str(e)}", {
+        await storage.add_log("ERROR", f"Erro na requisição: {str(e)}", {
             "error_type": type(e).__name__,
             "traceback": traceback.format_exc()
         })
@@ -3,6 +3,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 from storage import StorageHandler
+from local_whisper import local_whisper
 import plotly.express as px
 import os
 import redis
@@ -146,6 +147,7 @@ IDIOMAS = {
 def save_to_redis(key, value):
     try:
         redis_client.set(key, value)
+        storage.notify_settings_changed()
         st.success(f"Configuração {key} salva com sucesso!")
     except Exception as e:
         st.error(f"Erro ao salvar no Redis: {key} -> {e}")
@@ -724,6 +726,27 @@ def show_language_statistics():
         st.subheader("📋 Detalhamento por Idioma")
         st.dataframe(df.sort_values('Total', ascending=False))
 
+def show_key_usage(provider: str):
+    """Exibe o uso e a saúde de cada chave do provedor"""
+    usage = storage.get_key_usage(provider)
+    if not usage:
+        return
+
+    usage_data = []
+    for key, data in usage.items():
+        usage_data.append({
+            'Chave': f"{key[:10]}...{key[-4:]}",
+            'Chamadas': data['requests'],
+            'Erros': data['errors'],
+            'Limite de taxa': data['rate_limited'],
+            'Último uso': data['last_used'] or '-',
+            'Saudável': "✅" if data['healthy'] else f"❌ {data['last_error']}"
+        })
+
+    st.write("Uso por chave:")
+    df = pd.DataFrame(usage_data)
+    st.dataframe(df.sort_values('Chamadas', ascending=False))
+
 def manage_settings():
     st.title("⚙️ Configurações")
     
@@ -785,20 +808,40 @@ def manage_settings():
                         st.error("Chave inválida! A chave deve começar com 'gsk_'")
                 else:
                     st.warning("Por favor, insira uma chave válida")
-        pass
+
+        show_key_usage("groq")
     
     with tab2:
         st.subheader("Configuração do Provedor LLM")
         
         # Select provider
         current_provider = storage.get_llm_provider()
+        provider_labels = {
+            "groq": "Groq (Open Source)",
+            "openai": "OpenAI (API Paga)",
+        }
+        # O Whisper local só é oferecido com o faster-whisper instalado
+        if local_whisper.available:
+            provider_labels["local"] = "Local (CPU, faster-whisper)"
+        elif current_provider == "local":
+            st.warning("O provedor local está selecionado, mas o pacote faster-whisper não está instalado; as transcrições usam o GROQ/OpenAI.")
+        provider_options = list(provider_labels)
         provider = st.selectbox(
             "Provedor de Serviço",
-            options=["groq", "openai"],
-            format_func=lambda x: "Groq (Open Source)" if x == "groq" else "OpenAI (API Paga)",
-            index=0 if current_provider == "groq" else 1
+            options=provider_options,
+            format_func=lambda x: provider_labels[x],
+            index=provider_options.index(current_provider) if current_provider in provider_options else 0
         )
         
+        if provider == "local":
+            st.info("""
+            A transcrição é feita por um modelo Whisper rodando na CPU dos workers,
+            sem custo por áudio. Requer o pacote faster-whisper instalado na imagem
+            (modelo, threads e beam size pelas variáveis LOCAL_WHISPER_*).
+            Resumo, detecção de idioma e tradução continuam usando as chaves GROQ
+            (ou OpenAI, se não houver chaves GROQ).
+            """)
+
         if provider == "openai":
             st.info("""
             A OpenAI é um serviço pago que requer uma chave API válida.
@@ -818,6 +861,22 @@ def manage_settings():
                     st.success("✅ Chave OpenAI adicionada com sucesso!")
                 else:
                     st.error("Chave inválida! Deve começar com 'sk-'")
+
+            # Exibir chaves existentes (todas entram no rodízio)
+            openai_keys = storage.get_openai_keys()
+            if openai_keys:
+                st.write("Chaves configuradas para rodízio:")
+                for key in openai_keys:
+                    col1, col2 = st.columns([4, 1])
+                    with col1:
+                        st.code(f"{key[:10]}...{key[-4:]}", language=None)
+                    with col2:
+                        if st.button("🗑️", key=f"remove_openai_{key}", help="Remover esta chave"):
+                            storage.remove_openai_key(key)
+                            st.success("Chave removida do rodízio!")
+                            st.experimental_rerun()
+
+                show_key_usage("openai")
                     
         # Save provider selection
         if st.button("💾 Salvar Configuração do Provedor"):
@@ -963,6 +1022,7 @@ def manage_settings():
             
             # Salvamento do modo de processamento
             storage.redis.set(storage._get_redis_key("process_mode"), process_mode)
+            storage.notify_settings_changed()
             
             st.success("✅ Todas as configurações foram salvas com sucesso!")
             
@@ -1,8 +1,8 @@
-import aiohttp
-import json
-from datetime import datetime
 import logging
-from storage import StorageHandler
+from storage import AsyncStorageHandler
+from http_client import http_client
+from groq_handler import get_working_key
+from retry import request_with_retry
 
 logger = logging.getLogger("OpenAIHandler")
 logger.setLevel(logging.DEBUG)
@@ -17,12 +17,12 @@ async def test_openai_key(key: str) -> bool:
     headers = {"Authorization": f"Bearer {key}"}
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return len(data.get("data", [])) > 0
-                return False
+        session = http_client.get_session("openai")
+        async with session.get(url, headers=headers) as response:
+            if response.status == 200:
+                data = await response.json()
+                return len(data.get("data", [])) > 0
+            return False
     except Exception as e:
         logger.error(f"Error testing OpenAI key: {e}")
         return False
@@ -31,44 +31,18 @@ async def handle_openai_request(
     url: str, 
     headers: dict, 
     data: any, 
-    storage: StorageHandler,
-    is_form_data: bool = False
+    storage: AsyncStorageHandler,
+    is_form_data: bool = False,
+    lease_id: str = None
 ) -> tuple[bool, dict, str]:
-    """Handle requests to OpenAI API with retries."""
-    max_retries = 3
-    
-    for attempt in range(max_retries):
-        try:
-            async with aiohttp.ClientSession() as session:
-                if is_form_data:
-                    async with session.post(url, headers=headers, data=data) as response:
-                        response_data = await response.json()
-                        if response.status == 200:
-                            if is_form_data and response_data.get("text"):
-                                return True, response_data, ""
-                            elif not is_form_data and response_data.get("choices"):
-                                return True, response_data, ""
-                else:
-                    async with session.post(url, headers=headers, json=data) as response:
-                        response_data = await response.json()
-                        if response.status == 200 and response_data.get("choices"):
-                            return True, response_data, ""
-                
-                error_msg = response_data.get("error", {}).get("message", "")
-                
-                if "invalid_api_key" in error_msg or "invalid authorization" in error_msg.lower():
-                    logger.error(f"OpenAI API key invalid or expired")
-                    return False, response_data, error_msg
-                
-                if attempt < max_retries - 1:
-                    continue
+    """
+    Handle requests to OpenAI API with the shared retry policy. For
+    multipart requests, `data` must be a factory building a fresh FormData
+    on every attempt; `lease_id` is the key's lease from get_working_key.
+    """
+    async def rotate_key():
+        return await get_working_key("openai", storage)
 
-                return False, response_data, error_msg
-
-        except Exception as e:
-            logger.error(f"Error in request: {str(e)}")
-            if attempt < max_retries - 1:
-                continue
-            return False, {}, f"Request failed: {str(e)}"
-
-    return False, {}, "All retries failed"
\ No newline at end of file
+    return await request_with_retry(
+        url, headers, data, storage, is_form_data=is_form_data, rotate_key=rotate_key, lease_id=lease_id
+    )
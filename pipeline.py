@@ -0,0 +1,345 @@
+import os
+import time
+from typing import Optional
+
+from services import (
+    transcribe_audio_raw,
+    select_transcription_target,
+    transcription_model,
+    translate_transcription,
+    detect_new_contact_language,
+    record_transcription_stats,
+    send_message_to_whatsapp,
+    get_audio_from_evolution,
+    decode_base64_audio,
+    summarize_text_if_needed,
+    download_remote_audio,
+)
+from storage import AsyncStorageHandler
+from settings_cache import SettingsSnapshot, settings_cache
+from transcription_cache import transcription_cache
+from stages import StageGraph
+from audio import AudioBuffer
+from preprocess import audio_preprocessor
+from routing import audio_router
+from whatsapp_media import download_whatsapp_media, encrypted_media_url, is_encrypted_media_url
+
+storage = AsyncStorageHandler()
+
+# Decifra localmente a mídia da CDN do WhatsApp em vez de pedir à Evolution API
+WHATSAPP_MEDIA_DECRYPT = os.getenv("WHATSAPP_MEDIA_DECRYPT", "true").lower() == "true"
+
+async def get_cache_language(settings: SettingsSnapshot, remote_jid: str) -> Optional[str]:
+    """
+    Idioma sob o qual a transcrição pode ser compartilhada pelo cache, ou
+    None quando o resultado depende do contato (idioma próprio, tradução
+    ou detecção automática ainda pendente).
+    """
+    system_language = settings.transcription_language
+    if "@s.whatsapp.net" not in remote_jid:
+        return system_language
+
+    contact_id = remote_jid.split('@')[0]
+    contact_language = await storage.get_contact_language(contact_id)
+    if not contact_language and settings.auto_language_detection:
+        cached_lang = await storage.get_cached_language(contact_id)
+        contact_language = cached_lang.get('language') if cached_lang else None
+        if not contact_language:
+            return None
+    if contact_language and contact_language != system_language:
+        return None
+    return system_language
+
+async def fetch_audio(body: dict) -> AudioBuffer:
+    """
+    Obtém o áudio da mensagem para um AudioBuffer em memória, na ordem:
+    base64 inline do webhook, mídia cifrada da CDN do WhatsApp decifrada
+    localmente, `mediaUrl` comum e, por fim, getBase64FromMediaMessage.
+    """
+    message = body["data"]["message"]
+    audio_message = message.get("audioMessage") or {}
+    media_url = message.get("mediaUrl")
+
+    # Com "Webhook Base64" ativo na Evolution, o áudio já vem no payload
+    inline_base64 = message.get("base64")
+    if inline_base64:
+        try:
+            audio = await decode_base64_audio(inline_base64)
+            await storage.add_log("DEBUG", "Usando áudio base64 do próprio webhook", {"bytes": audio.size})
+            return audio
+        except Exception as e:
+            await storage.add_log("WARNING", "Base64 do webhook inválido, buscando o áudio por outro meio", {
+                "error": str(e)
+            })
+
+    # Mídia cifrada do WhatsApp: baixa da CDN e decifra com o mediaKey
+    if WHATSAPP_MEDIA_DECRYPT and audio_message.get("mediaKey"):
+        encrypted_url = media_url if media_url and is_encrypted_media_url(media_url) else encrypted_media_url(audio_message)
+        if encrypted_url:
+            started = time.monotonic()
+            try:
+                audio = await download_whatsapp_media(encrypted_url, audio_message)
+                await storage.add_log("INFO", "Áudio baixado e decifrado localmente", {
+                    "bytes": audio.size,
+                    "seconds": round(time.monotonic() - started, 3)
+                })
+                return audio
+            except Exception as e:
+                await storage.add_log("WARNING", "Falha ao decifrar mídia localmente, usando a Evolution API", {
+                    "error": str(e),
+                    "type": type(e).__name__
+                })
+
+    if media_url and not is_encrypted_media_url(media_url):
+        await storage.add_log("DEBUG", "Baixando áudio via URL", {"mediaUrl": media_url})
+        return await download_remote_audio(media_url)
+
+    await storage.add_log("DEBUG", "Obtendo áudio via base64")
+    return await get_audio_from_evolution(
+        body["server_url"], body["instance"], body["apikey"], body["data"]["key"]["id"]
+    )
+
+async def process_audio_message(body: dict, settings: SettingsSnapshot = None) -> dict:
+    """
+    Executa o pipeline completo de um áudio já validado:
+    download, transcrição, resumo e envio da resposta no WhatsApp.
+
+    Usado tanto pelo endpoint (modo inline) quanto pelos workers da fila.
+    """
+    if settings is None:
+        settings = await settings_cache.current()
+
+    server_url = body["server_url"]
+    instance = body["instance"]
+    apikey = body["apikey"]
+    audio_key = body["data"]["key"]["id"]
+    from_me = body["data"]["key"]["fromMe"]
+    remote_jid = body["data"]["key"]["remoteJid"]
+    is_group = "@g.us" in remote_jid
+
+    # Configurações de formatação
+    output_mode = settings.output_mode
+    summary_header = settings.summary_header
+    transcription_header = settings.transcription_header
+    character_limit = settings.character_limit
+
+    # Verificar se timestamps estão habilitados
+    use_timestamps = settings.use_timestamps
+
+    await storage.add_log("DEBUG", "Informações da mensagem", {
+        "from_me": from_me,
+        "remote_jid": remote_jid,
+        "is_group": is_group
+    })
+
+    async def reject(route):
+        await storage.add_log("WARNING", "Áudio recusado pela duração", {
+            "reason": route["reject"],
+            "seconds": route["seconds"],
+            "remote_jid": remote_jid
+        })
+        return {"message": f"Áudio ignorado: {route['reject']}"}
+
+    # Rota pela duração informada no payload; refinada pelo container após o download
+    audio_message = body["data"]["message"].get("audioMessage") or {}
+    audio_seconds, duration_source = audio_router.probe_duration(None, audio_message)
+    route = audio_router.route(audio_seconds, None, settings.llm_provider, character_limit)
+    if route["reject"]:
+        return await reject(route)
+
+    # Consultar o cache antes de qualquer download, com o provedor e o
+    # modelo que vão transcrever (inclusive em failover); a entrada é
+    # gravada com o modelo que de fato transcreveu
+    provider, model = await select_transcription_target(route["provider"], route["model"])
+    cache_language = await get_cache_language(settings, remote_jid)
+    media_hash = None
+    cached = None
+    if cache_language:
+        media_hash = transcription_cache.normalize_hash(audio_message.get("fileSha256"))
+        cached = await transcription_cache.get(media_hash, cache_language, model, use_timestamps)
+
+    audio_source = None
+    if cached is None:
+        audio_source = await fetch_audio(body)
+        audio_seconds, duration_source = audio_router.probe_duration(audio_source, audio_message)
+        route = audio_router.route(audio_seconds, audio_source.size, settings.llm_provider, character_limit)
+        await storage.add_log("DEBUG", "Rota do áudio definida", {
+            **route,
+            "duration_source": duration_source,
+            "remote_jid": remote_jid
+        })
+        if route["reject"]:
+            audio_source.close()
+            return await reject(route)
+        # A rota pela duração do container pode trocar o modelo ou o provedor
+        if (route["provider"] == "local") != (provider == "local"):
+            provider, model = await select_transcription_target(route["provider"], route["model"])
+        else:
+            model = transcription_model(provider, route["model"], settings.llm_provider)
+        # Sem fileSha256 no payload, o hash é calculado sobre o áudio baixado
+        if cache_language and media_hash is None:
+            media_hash = audio_source.sha256()
+            cached = await transcription_cache.get(media_hash, cache_language, model, use_timestamps)
+
+    raw_result = None
+    preprocess_stats = None
+    chunks = None
+    if cached is not None:
+        if audio_source is not None:
+            audio_source.close()
+        await storage.add_log("INFO", "Transcrição reaproveitada do cache", {
+            "media_hash": media_hash,
+            "remote_jid": remote_jid
+        })
+    else:
+        # Transcrever áudio
+        audio_source, preprocess_stats = await audio_preprocessor.prepare(audio_source)
+        if preprocess_stats:
+            await storage.add_log("INFO", "Áudio pré-processado", {
+                **preprocess_stats,
+                "remote_jid": remote_jid
+            })
+        # Áudios longos são divididos nas pausas e transcritos em paralelo
+        if route["split"]:
+            try:
+                chunks = await audio_preprocessor.split(audio_source)
+                await storage.add_log("INFO", "Áudio dividido em trechos", {
+                    "seconds": audio_seconds,
+                    "chunks": len(chunks),
+                    "remote_jid": remote_jid
+                })
+            except Exception as e:
+                await storage.add_log("WARNING", "Falha ao dividir o áudio, transcrevendo inteiro", {
+                    "error": str(e)
+                })
+        await storage.add_log("INFO", "Iniciando transcrição")
+        with audio_source:
+            try:
+                raw_result = await transcribe_audio_raw(
+                    audio_source,
+                    remote_jid=remote_jid,
+                    from_me=from_me,
+                    use_timestamps=use_timestamps,
+                    chunks=chunks,
+                    model=model,
+                    provider=provider
+                )
+            finally:
+                for chunk in chunks or ():
+                    chunk["audio"].close()
+        # Log do resultado
+        await storage.add_log("INFO", "Transcrição concluída", {
+            "has_timestamps": raw_result["has_timestamps"],
+            "text_length": len(raw_result["text"]),
+            "remote_jid": remote_jid
+        })
+        cached = {"transcription": raw_result["text"], "has_timestamps": raw_result["has_timestamps"]}
+        model = raw_result["model"]
+
+    # Determinar se precisa de resumo baseado no modo de saída e no tamanho
+    # do texto original (a estimativa da rota vale só antes do download)
+    is_long = len(cached["transcription"]) > character_limit
+    needs_summary = output_mode in ["both", "summary_only"] or (output_mode == "smart" and is_long)
+
+    # Estágios pós-transcrição: tradução e resumo rodam em paralelo; envio
+    # depende de ambos; detecção de idioma, estatísticas e cache ficam fora
+    # do caminho crítico
+    async def translate(results):
+        # No modo "smart" com áudio longo a mensagem leva só o resumo
+        if raw_result is None or (output_mode == "smart" and is_long):
+            return cached["transcription"]
+        return await translate_transcription(raw_result)
+
+    async def summarize(results):
+        if cached.get("summary") is not None:
+            return cached["summary"]
+        if not needs_summary:
+            return None
+        return await summarize_text_if_needed(cached["transcription"])
+
+    async def send(results):
+        transcription_text = results["translate"]
+        summary_text = results["summarize"]
+
+        # Construir mensagem baseada no modo de saída
+        message_parts = []
+
+        if output_mode == "smart":
+            if is_long:
+                message_parts.append(f"{summary_header}\n\n{summary_text}")
+            else:
+                message_parts.append(f"{transcription_header}\n\n{transcription_text}")
+        else:
+            if output_mode in ["both", "summary_only"] and summary_text:
+                message_parts.append(f"{summary_header}\n\n{summary_text}")
+            if output_mode in ["both", "transcription_only"]:
+                message_parts.append(f"{transcription_header}\n\n{transcription_text}")
+
+        # Adicionar mensagem de negócio
+        message_parts.append(settings.business_message)
+
+        # Juntar todas as partes da mensagem
+        summary_message = "\n\n".join(message_parts)
+
+        # Enviar resposta
+        await send_message_to_whatsapp(
+            server_url,
+            instance,
+            apikey,
+            summary_message,
+            remote_jid,
+            audio_key,
+        )
+
+    async def detect_language(results):
+        return await detect_new_contact_language(raw_result)
+
+    async def language_stats(results):
+        await record_transcription_stats(raw_result, results.get("detect_language"))
+
+    async def update_cache(results):
+        summary_text = results["summarize"]
+        if raw_result is not None or summary_text != cached.get("summary"):
+            await transcription_cache.set(
+                media_hash, cache_language, model, use_timestamps,
+                {**cached, "summary": summary_text}
+            )
+
+    async def record_processing(results):
+        await storage.record_processing(remote_jid)
+        if raw_result is not None and audio_seconds:
+            await storage.record_audio_seconds(audio_seconds)
+
+    async def report_stage(name, seconds, error):
+        await storage.add_log("ERROR" if error else "DEBUG", f"Estágio '{name}' finalizado", {
+            "seconds": seconds,
+            "remote_jid": remote_jid,
+            "error": str(error) if error else None
+        })
+
+    graph = StageGraph(on_stage_done=report_stage)
+    graph.add("translate", translate)
+    graph.add("summarize", summarize)
+    graph.add("send", send, after=("translate", "summarize"))
+    graph.add("record_processing", record_processing, after=("send",), critical=False)
+    if raw_result is not None:
+        graph.add("detect_language", detect_language, critical=False)
+        graph.add("language_stats", language_stats, after=("detect_language",), critical=False)
+    if cache_language:
+        graph.add("update_cache", update_cache, after=("summarize",), critical=False)
+    results = await graph.run()
+
+    # Registrar sucesso
+    await storage.add_log("INFO", "Áudio processado com sucesso", {
+        "remote_jid": remote_jid,
+        "transcription_length": len(results["translate"]) if results["translate"] else 0,
+        "summary_length": len(results["summarize"]) if results["summarize"] else 0,
+        "audio_seconds": audio_seconds,
+        "duration_source": duration_source,
+        "model": model,
+        "chunks": len(chunks) if chunks else 0,
+        "stage_seconds": graph.durations,
+        "preprocess": preprocess_stats
+    })
+
+    return {"message": "Áudio transcrito e resposta enviada com sucesso"}
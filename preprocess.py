@@ -0,0 +1,288 @@
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from audio import AudioBuffer
+from config import logger
+
+# Assinaturas dos containers aceitos pelos provedores de transcrição
+AUDIO_FORMATS = (
+    ("ogg", lambda head: head.startswith(b"OggS")),
+    ("mp3", lambda head: head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)),
+    ("m4a", lambda head: head[4:8] == b"ftyp"),
+    ("wav", lambda head: head.startswith(b"RIFF") and head[8:12] == b"WAVE"),
+    ("webm", lambda head: head.startswith(b"\x1aE\xdf\xa3")),
+    ("flac", lambda head: head.startswith(b"fLaC")),
+)
+FFMPEG_DURATION = re.compile(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+FFMPEG_SILENCE = re.compile(rb"silence_(start|end): (-?\d+(?:\.\d+)?)")
+
+def detect_audio_format(head: bytes) -> Optional[str]:
+    """Identifica o container real do áudio pelos primeiros bytes."""
+    for audio_format, matches in AUDIO_FORMATS:
+        if matches(head):
+            return audio_format
+    return None
+
+def ogg_duration(head: bytes, tail: bytes) -> Optional[float]:
+    """
+    Duração de um Ogg (Opus ou Vorbis) sem decodificar: granule position da
+    última página dividida pela taxa de amostragem do cabeçalho.
+    """
+    if not head.startswith(b"OggS"):
+        return None
+    pre_skip = 0
+    opus = head.find(b"OpusHead")
+    vorbis = head.find(b"\x01vorbis")
+    if opus != -1:
+        # Opus sempre usa granule em 48 kHz; pre-skip são amostras descartadas
+        sample_rate = 48000
+        pre_skip = int.from_bytes(head[opus + 10:opus + 12], "little")
+    elif vorbis != -1:
+        sample_rate = int.from_bytes(head[vorbis + 12:vorbis + 16], "little")
+    else:
+        return None
+    if not sample_rate:
+        return None
+
+    position = len(tail)
+    while True:
+        position = tail.rfind(b"OggS", 0, position)
+        if position == -1:
+            return None
+        if position + 14 > len(tail):
+            continue
+        granule = int.from_bytes(tail[position + 6:position + 14], "little")
+        # Páginas sem fim de pacote trazem granule -1
+        if granule != 0xFFFFFFFFFFFFFFFF:
+            return max(granule - pre_skip, 0) / sample_rate
+
+def _transcode(data: bytes, suffix: str, silence_db: int, bitrate: str, timeout: float) -> Tuple[bytes, Optional[float]]:
+    """
+    Executado no pool de processos: remove o silêncio do início e do fim,
+    converte para mono 16 kHz e codifica em Opus. Retorna o Ogg gerado e a
+    duração original informada pelo ffmpeg.
+    """
+    trim = f"silenceremove=start_periods=1:start_threshold={silence_db}dB:start_silence=0.3"
+    # O silêncio final é removido invertendo o áudio, já que stop_periods
+    # também cortaria as pausas do meio da fala
+    audio_filter = f"{trim},areverse,{trim},areverse"
+    # O m4a pode ter o índice (moov) no fim do arquivo e precisa de entrada com seek
+    with tempfile.NamedTemporaryFile(suffix=f".{suffix}") as source:
+        source.write(data)
+        source.flush()
+        result = subprocess.run(
+            [
+                "ffmpeg", "-hide_banner", "-nostdin", "-nostats", "-i", source.name,
+                "-vn", "-af", audio_filter, "-ac", "1", "-ar", "16000",
+                "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+                "-f", "ogg", "pipe:1",
+            ],
+            capture_output=True,
+            timeout=timeout,
+        )
+    if result.returncode != 0:
+        error = result.stderr.decode(errors="replace").strip().splitlines()
+        raise RuntimeError(f"ffmpeg terminou com código {result.returncode}: {error[-1] if error else ''}")
+
+    return result.stdout, _parse_duration(result.stderr)
+
+def _parse_duration(stderr: bytes) -> Optional[float]:
+    match = FFMPEG_DURATION.search(stderr)
+    if not match:
+        return None
+    hours, minutes, secs = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(secs)
+
+def _choose_cuts(duration: float, silences: List[float], chunk_seconds: float) -> List[float]:
+    """
+    Pontos de corte entre os trechos: o meio da última pausa antes de cada
+    limite de chunk_seconds; sem pausa na segunda metade do trecho, corta no
+    limite. O último trecho nunca fica mais curto que metade do tamanho.
+    """
+    cuts = [0.0]
+    while duration - cuts[-1] > chunk_seconds:
+        start, limit = cuts[-1], cuts[-1] + chunk_seconds
+        candidates = [s for s in silences if start + chunk_seconds / 2 < s <= limit]
+        cut = candidates[-1] if candidates else limit
+        if duration - cut < chunk_seconds / 2:
+            break
+        cuts.append(cut)
+    cuts.append(duration)
+    return cuts
+
+def _split(data: bytes, suffix: str, chunk_seconds: float, overlap: float, silence_db: int,
+           bitrate: str, timeout: float) -> List[Tuple[float, float, float, bytes]]:
+    """
+    Executado no pool de processos: localiza as pausas com silencedetect e
+    corta o áudio nelas em trechos de até chunk_seconds, cada um estendido
+    por `overlap` segundos para os dois lados. Retorna (offset, início,
+    fim, ogg) de cada trecho, onde [início, fim) é a parte que pertence a
+    ele e offset é onde o arquivo do trecho começa.
+    """
+    with tempfile.NamedTemporaryFile(suffix=f".{suffix}") as source:
+        source.write(data)
+        source.flush()
+        result = subprocess.run(
+            [
+                "ffmpeg", "-hide_banner", "-nostdin", "-nostats", "-i", source.name,
+                "-vn", "-af", f"silencedetect=noise={silence_db}dB:d=0.4", "-f", "null", "-",
+            ],
+            capture_output=True,
+            timeout=timeout,
+        )
+        duration = _parse_duration(result.stderr)
+        if result.returncode != 0 or not duration:
+            raise RuntimeError(f"ffmpeg não conseguiu analisar o áudio (código {result.returncode})")
+
+        # Meio de cada pausa: silence_start seguido do silence_end correspondente
+        silences = []
+        silence_start = None
+        for kind, value in FFMPEG_SILENCE.findall(result.stderr):
+            if kind == b"start":
+                silence_start = max(float(value), 0.0)
+            elif silence_start is not None:
+                silences.append((silence_start + float(value)) / 2)
+                silence_start = None
+
+        cuts = _choose_cuts(duration, silences, chunk_seconds)
+        chunks = []
+        for start, end in zip(cuts, cuts[1:]):
+            offset = max(start - overlap, 0.0)
+            length = min(end + overlap, duration) - offset
+            result = subprocess.run(
+                [
+                    "ffmpeg", "-hide_banner", "-nostdin", "-nostats",
+                    "-ss", f"{offset:.3f}", "-t", f"{length:.3f}", "-i", source.name,
+                    "-vn", "-ac", "1", "-ar", "16000",
+                    "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+                    "-f", "ogg", "pipe:1",
+                ],
+                capture_output=True,
+                timeout=timeout,
+            )
+            if result.returncode != 0 or not result.stdout:
+                raise RuntimeError(f"ffmpeg falhou ao extrair o trecho {start:.1f}s-{end:.1f}s")
+            chunks.append((offset, start, end, result.stdout))
+    return chunks
+
+class AudioPreprocessor:
+    """
+    Estágio opcional antes do upload para o Whisper.
+
+    Sempre corrige o nome do arquivo para o container real (ogg, mp3, m4a...).
+    Com AUDIO_PREPROCESS=true e o ffmpeg disponível, também remove o silêncio
+    do início e do fim, converte para mono 16 kHz e recodifica em Opus,
+    reduzindo o tamanho do upload e os segundos cobrados. A conversão roda
+    em um pool de AUDIO_PREPROCESS_WORKERS processos, fora do event loop.
+
+    O mesmo pool divide áudios longos (acima de TRANSCRIPTION_CHUNK_THRESHOLD
+    segundos) em trechos cortados nas pausas, transcritos em paralelo.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("AUDIO_PREPROCESS", "false").lower() == "true"
+        self.workers = int(os.getenv("AUDIO_PREPROCESS_WORKERS", 2))
+        self.silence_db = int(os.getenv("AUDIO_PREPROCESS_SILENCE_DB", -45))
+        self.bitrate = os.getenv("AUDIO_PREPROCESS_BITRATE", "24k")
+        self.timeout = float(os.getenv("AUDIO_PREPROCESS_TIMEOUT", 60))
+        self.chunk_threshold = float(os.getenv("TRANSCRIPTION_CHUNK_THRESHOLD", 300))
+        self.chunk_seconds = float(os.getenv("TRANSCRIPTION_CHUNK_SECONDS", 120))
+        self.chunk_overlap = float(os.getenv("TRANSCRIPTION_CHUNK_OVERLAP", 2))
+        self._ffmpeg = shutil.which("ffmpeg")
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if self.enabled and not self._ffmpeg:
+            logger.warning("AUDIO_PREPROCESS ativo, mas o ffmpeg não foi encontrado; pré-processamento desativado")
+
+    @property
+    def available(self) -> bool:
+        return self.enabled and self._ffmpeg is not None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def prepare(self, audio: AudioBuffer) -> Tuple[AudioBuffer, Optional[dict]]:
+        """
+        Retorna o áudio a enviar e as estatísticas do pré-processamento (None
+        quando não houve conversão). Se um novo áudio for gerado, o original
+        é fechado; em caso de falha, o original segue sem alterações.
+        """
+        audio_format = detect_audio_format(audio.head(16))
+        if audio_format:
+            audio.filename = f"audio.{audio_format}"
+        if not self.available:
+            return audio, None
+
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            data, seconds_before = await loop.run_in_executor(
+                self._get_pool(), _transcode,
+                audio.read(), audio_format or "bin", self.silence_db, self.bitrate, self.timeout
+            )
+        except Exception as e:
+            logger.warning(f"Falha no pré-processamento do áudio, enviando o original: {e}")
+            return audio, None
+
+        seconds_after = ogg_duration(data[:4096], data[-65536:])
+        # Áudio só com silêncio: o original segue para o provedor decidir
+        if not data or not seconds_after:
+            return audio, None
+
+        stats = {
+            "format": audio_format,
+            "bytes_before": audio.size,
+            "bytes_after": len(data),
+            "bytes_saved": audio.size - len(data),
+            "seconds_before": round(seconds_before, 2) if seconds_before else None,
+            "seconds_after": round(seconds_after, 2),
+            "seconds_saved": round(seconds_before - seconds_after, 2) if seconds_before else None,
+            "elapsed": round(time.monotonic() - started, 3),
+        }
+        audio.close()
+        return AudioBuffer.from_bytes(data, "audio.ogg"), stats
+
+    @property
+    def can_split(self) -> bool:
+        return self._ffmpeg is not None
+
+    def should_split(self, seconds: Optional[float]) -> bool:
+        """Áudios acima do limite são divididos (0 desativa a divisão)."""
+        return (
+            self.can_split and self.chunk_threshold > 0
+            and seconds is not None and seconds > self.chunk_threshold
+        )
+
+    async def split(self, audio: AudioBuffer) -> List[dict]:
+        """
+        Divide o áudio em trechos para transcrição paralela. Cada trecho traz
+        o AudioBuffer, o `offset` do arquivo na linha do tempo original e o
+        intervalo [`start`, `end`) que ele representa, sem a sobreposição.
+        """
+        audio_format = detect_audio_format(audio.head(16))
+        loop = asyncio.get_running_loop()
+        parts = await loop.run_in_executor(
+            self._get_pool(), _split,
+            audio.read(), audio_format or "bin", self.chunk_seconds, self.chunk_overlap,
+            self.silence_db, self.bitrate, self.timeout
+        )
+        return [
+            {"audio": AudioBuffer.from_bytes(data, "audio.ogg"), "offset": offset, "start": start, "end": end}
+            for offset, start, end, data in parts
+        ]
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+# Instância única por processo
+audio_preprocessor = AudioPreprocessor()
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+import aiohttp
+
+from circuit_breaker import circuit_breaker, endpoint_for_url
+from http_client import http_client
+from key_health import classify_error, key_from_headers, key_health, provider_for_url
+from key_scheduler import key_scheduler, parse_duration
+
+# Classes de erro (ver classify_error) que justificam uma nova tentativa
+RETRYABLE_ERRORS = {"rate_limit", "network", "server"}
+# Classes de erro em que a próxima tentativa usa outra chave
+ROTATE_KEY_ERRORS = {"rate_limit", "auth"}
+
+class RetryPolicy:
+    """
+    Política de retry comum às chamadas aos provedores (GROQ e OpenAI).
+
+    Limite de taxa, falhas de rede e 5xx são repetidos com backoff
+    exponencial com jitter, respeitando o `retry-after` quando informado;
+    erro de autenticação só é repetido se houver outra chave; requisição
+    inválida não é repetida. Cada tentativa tem seu próprio timeout
+    (PROVIDER_ATTEMPT_TIMEOUT) e o conjunto das tentativas, incluindo as
+    esperas, não passa de PROVIDER_RETRY_BUDGET segundos.
+    """
+
+    def __init__(self):
+        self.max_attempts = int(os.getenv("PROVIDER_MAX_ATTEMPTS", 4))
+        self.attempt_timeout = float(os.getenv("PROVIDER_ATTEMPT_TIMEOUT", 120))
+        self.budget = float(os.getenv("PROVIDER_RETRY_BUDGET", 180))
+        self.backoff_base = float(os.getenv("PROVIDER_BACKOFF_BASE", 0.5))
+        self.backoff_max = float(os.getenv("PROVIDER_BACKOFF_MAX", 20))
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Espera antes da próxima tentativa ("full jitter"), nunca menor que o retry-after."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+# Instância única por processo
+retry_policy = RetryPolicy()
+
+BodyFactory = Callable[[], Any]
+
+async def request_with_retry(
+    url: str,
+    headers: dict,
+    data: Any,
+    storage,
+    is_form_data: bool = False,
+    rotate_key: Optional[Callable[[], Awaitable[Optional[Tuple[str, str]]]]] = None,
+    policy: RetryPolicy = retry_policy,
+    lease_id: Optional[str] = None,
+) -> Tuple[bool, dict, str]:
+    """
+    Executa um POST para o provedor aplicando a RetryPolicy.
+
+    `data` pode ser o corpo ou uma fábrica que monta um corpo novo a cada
+    tentativa; corpos multipart precisam da fábrica, porque o arquivo de um
+    FormData é consumido no primeiro envio. `rotate_key` fornece outra chave
+    (chave, lease) quando o erro é de limite de taxa ou de autenticação.
+
+    `lease_id` é o lease da chave do `Authorization` (ver key_scheduler).
+    Ele vale para a requisição inteira: as novas tentativas com a mesma
+    chave seguem nele, a troca de chave o substitui pelo da nova, e o lease
+    em uso é encerrado uma única vez, na saída.
+
+    Returns:
+        (sucesso, resposta JSON, mensagem de erro)
+    """
+    provider = provider_for_url(url)
+    endpoint = endpoint_for_url(url)
+    started = time.monotonic()
+    attempt = 0
+    key = key_from_headers(headers)
+    try:
+        while True:
+            attempt += 1
+            body = data() if callable(data) else data
+            status = None
+            response_headers = {}
+            response_data = {}
+            error_msg = ""
+
+            await storage.add_log("DEBUG", "Iniciando tentativa de requisição ao provedor", {
+                "url": url,
+                "is_form_data": is_form_data,
+                "attempt": attempt
+            })
+            try:
+                session = http_client.get_session_for_url(url)
+                body_arg = {"data": body} if is_form_data else {"json": body}
+                timeout = aiohttp.ClientTimeout(total=policy.attempt_timeout)
+                async with session.post(url, headers=headers, timeout=timeout, **body_arg) as response:
+                    status = response.status
+                    response_headers = response.headers
+                    # Só os limites informados; o lease segue até a saída
+                    await key_scheduler.release(provider, key, None, response.headers, status)
+                    try:
+                        response_data = await response.json(content_type=None)
+                    except ValueError:
+                        response_data = {}
+            except Exception as e:
+                error_msg = f"Request failed: {str(e)}"
+
+            if not isinstance(response_data, dict):
+                response_data = {}
+            if status == 200 and response_data.get("text" if is_form_data else "choices"):
+                await key_health.report(provider, key, None)
+                await circuit_breaker.record(provider, endpoint, None)
+                await storage.record_key_usage(provider, key)
+                return True, response_data, ""
+
+            if not error_msg:
+                error = response_data.get("error")
+                error_msg = error.get("message", "") if isinstance(error, dict) else str(error or "")
+            error_class = classify_error(status, error_msg) or "bad_request"
+            # Atualiza passivamente a saúde da chave com o resultado real
+            await key_health.report(provider, key, error_class)
+            # Limite de taxa é da chave: só conta para o circuito do provedor
+            # uma vez, se a requisição terminar limitada (ver abaixo)
+            if error_class != "rate_limit":
+                await circuit_breaker.record(provider, endpoint, error_class)
+            await storage.record_key_usage(provider, key, error_class)
+
+            retryable = error_class in RETRYABLE_ERRORS
+            rotated = False
+            if error_class in ROTATE_KEY_ERRORS and rotate_key is not None:
+                rotation = await rotate_key()
+                if rotation:
+                    new_key, new_lease_id = rotation
+                    if new_key != key:
+                        await key_scheduler.release(provider, key, lease_id)
+                        key, lease_id = new_key, new_lease_id
+                        headers["Authorization"] = f"Bearer {key}"
+                        retryable = rotated = True
+                    else:
+                        # Mesma chave: segue no lease atual, o extra não será usado
+                        await key_scheduler.release(provider, new_key, new_lease_id)
+
+            # O retry-after vale para a chave que o recebeu, não para a nova
+            retry_after = None
+            if status == 429 and not rotated:
+                retry_after = parse_duration(response_headers.get("retry-after", ""))
+            delay = policy.delay(attempt, retry_after)
+            elapsed = time.monotonic() - started
+            if not retryable or attempt >= policy.max_attempts or elapsed + delay > policy.budget:
+                if error_class == "rate_limit":
+                    # Nenhuma chave resolveu: o limite é do provedor
+                    await circuit_breaker.record(provider, endpoint, error_class)
+                await storage.add_log("ERROR", "Requisição ao provedor falhou", {
+                    "url": url,
+                    "status": status,
+                    "error_class": error_class,
+                    "error": error_msg,
+                    "attempts": attempt,
+                    "elapsed": round(elapsed, 3)
+                })
+                return False, response_data, error_msg or f"HTTP {status}"
+
+            await storage.add_log("WARNING", "Nova tentativa de requisição ao provedor", {
+                "url": url,
+                "status": status,
+                "error_class": error_class,
+                "attempt": attempt,
+                "delay": round(delay, 3)
+            })
+            await asyncio.sleep(delay)
+    finally:
+        # Também quando a requisição é descartada (ex.: perdeu para a cópia do hedging)
+        if lease_id:
+            await key_scheduler.release(provider, key, lease_id)
@@ -0,0 +1,86 @@
+import os
+from typing import Optional, Tuple
+
+from audio import AudioBuffer
+from local_whisper import local_whisper
+from preprocess import audio_preprocessor, ogg_duration
+
+class AudioRouter:
+    """
+    Decide o caminho de cada áudio antes da transcrição, pela duração e pelo
+    tamanho:
+
+    - acima de MEDIA_MAX_SECONDS o áudio é recusado sem transcrever;
+    - áudios longos (ou maiores que TRANSCRIPTION_MAX_UPLOAD_BYTES) seguem
+      para a transcrição em trechos paralelos;
+    - com o provedor "local", ou para áudios de até LOCAL_WHISPER_MAX_SECONDS,
+      a transcrição é feita pelo Whisper local, inteira e sem upload;
+    - notas curtas (até TRANSCRIPTION_FAST_MAX_SECONDS) usam o modelo
+      rápido do provedor, quando TRANSCRIPTION_FAST_MODEL está definido;
+    - `long_text` estima pela duração (SPEECH_CHARS_PER_SECOND) se o texto
+      passará do limite de caracteres; é só uma indicação antes do
+      download, a decisão pelo resumo usa o tamanho real da transcrição.
+
+    A rota depende só do áudio, então um mesmo arquivo sempre segue o mesmo
+    caminho e o cache de transcrições continua consistente.
+    """
+
+    def __init__(self):
+        self.max_seconds = float(os.getenv("MEDIA_MAX_SECONDS", 1800))
+        self.max_upload_bytes = int(os.getenv("TRANSCRIPTION_MAX_UPLOAD_BYTES", 25 * 1024 * 1024))
+        self.fast_max_seconds = float(os.getenv("TRANSCRIPTION_FAST_MAX_SECONDS", 60))
+        # Opcional: sem TRANSCRIPTION_FAST_MODEL todas as notas usam o modelo padrão
+        self.fast_models = {
+            "groq": os.getenv("TRANSCRIPTION_FAST_MODEL") or None,
+        }
+        self.chars_per_second = float(os.getenv("SPEECH_CHARS_PER_SECOND", 15))
+
+    @staticmethod
+    def probe_duration(audio: Optional[AudioBuffer], audio_message: dict) -> Tuple[Optional[float], Optional[str]]:
+        """
+        Duração sem decodificar o áudio: granule position da última página
+        Ogg ou, na falta dela, o `seconds` informado pelo WhatsApp. Retorna
+        a duração e a origem ("container" ou "payload").
+        """
+        if audio is not None:
+            seconds = ogg_duration(audio.head(4096), audio.tail(65536))
+            if seconds:
+                return round(seconds, 2), "container"
+        try:
+            seconds = float(audio_message.get("seconds") or 0)
+        except (TypeError, ValueError):
+            seconds = 0
+        if seconds > 0:
+            return seconds, "payload"
+        return None, None
+
+    def route(self, seconds: Optional[float], size: Optional[int], provider: str, character_limit: int) -> dict:
+        route = {
+            "seconds": seconds,
+            "bytes": size,
+            "reject": None,
+            "model": None,
+            "split": False,
+            "long_text": None,
+            "provider": None,
+        }
+        if seconds is not None and self.max_seconds > 0 and seconds > self.max_seconds:
+            route["reject"] = f"Áudio de {seconds:.0f}s excede o limite de {self.max_seconds:.0f}s"
+            return route
+
+        if (provider == "local" and local_whisper.available) or local_whisper.should_route(seconds):
+            route["provider"] = "local"
+            route["model"] = local_whisper.model_name
+        elif audio_preprocessor.should_split(seconds) or (
+            size and size > self.max_upload_bytes and audio_preprocessor.can_split
+        ):
+            route["split"] = True
+        elif seconds is not None and seconds <= self.fast_max_seconds:
+            route["model"] = self.fast_models.get(provider)
+
+        if seconds is not None and self.chars_per_second > 0:
+            route["long_text"] = seconds * self.chars_per_second > character_limit
+        return route
+
+# Instância única por processo
+audio_router = AudioRouter()
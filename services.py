@@ -1,70 +1,91 @@
 import aiohttp
+import asyncio
 import base64
 import aiofiles
 from fastapi import HTTPException
-from config import settings, logger, redis_client
-from storage import StorageHandler
+from config import settings, logger
+from storage import AsyncStorageHandler
+from settings_cache import settings_cache
+from http_client import http_client
+from audio import AudioBuffer, Base64FieldDecoder
 import os
 import json
-import tempfile
+import time
 import traceback
-from groq_handler import get_working_groq_key, validate_transcription_response, handle_groq_request
+from circuit_breaker import circuit_breaker, select_provider
+from groq_handler import get_working_key, validate_transcription_response, handle_groq_request
+from hedging import transcription_hedger
+from local_whisper import local_whisper
 # Inicializa o storage handler
-storage = StorageHandler()
-
-async def convert_base64_to_file(base64_data):
-    """Converte dados base64 em arquivo temporário"""
+storage = AsyncStorageHandler()
+
+# Modelo de transcrição usado por cada provedor
+TRANSCRIPTION_MODELS = {
+    "openai": "whisper-1",
+    "groq": "whisper-large-v3",
+    "local": local_whisper.model_name,
+}
+TRANSCRIPTION_URLS = {
+    "openai": "https://api.openai.com/v1/audio/transcriptions",
+    "groq": "https://api.groq.com/openai/v1/audio/transcriptions",
+}
+
+async def decode_base64_audio(base64_data) -> AudioBuffer:
+    """Decodifica o áudio base64 direto para um AudioBuffer em memória"""
     try:
-        storage.add_log("DEBUG", "Iniciando conversão de base64 para arquivo")
-        audio_data = base64.b64decode(base64_data)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-            temp_file.write(audio_data)
-            audio_file_path = temp_file.name
-        
-        storage.add_log("DEBUG", "Arquivo temporário criado", {
-            "path": audio_file_path
+        await storage.add_log("DEBUG", "Iniciando decodificação do áudio base64")
+        max_bytes = int(os.getenv("MEDIA_MAX_BYTES", 25 * 1024 * 1024))
+        # Tamanho decodificado estimado antes de alocar qualquer coisa
+        if len(base64_data) * 3 // 4 > max_bytes:
+            raise Exception(f"Áudio excede o limite de {max_bytes} bytes")
+        audio = AudioBuffer.from_bytes(base64.b64decode(base64_data, validate=True))
+        await storage.add_log("DEBUG", "Áudio decodificado", {
+            "bytes": audio.size,
+            "on_disk": audio.on_disk
         })
-        return audio_file_path
+        return audio
     except Exception as e:
-        storage.add_log("ERROR", "Erro na conversão base64", {
+        await storage.add_log("ERROR", "Erro na decodificação base64", {
             "error": str(e),
             "type": type(e).__name__
         })
         raise
 
-async def get_groq_key():
-    """Obtém a próxima chave GROQ do sistema de rodízio."""
-    key = storage.get_next_groq_key()
-    if not key:
-        raise HTTPException(
-            status_code=500,
-            detail="Nenhuma chave GROQ configurada. Configure pelo menos uma chave no painel administrativo."
-        )
-    return key
+async def acquire_key(provider):
+    """
+    Reserva uma chave do provedor para uma única requisição: o lease é
+    encerrado por request_with_retry quando a requisição termina.
+
+    Returns:
+        tuple: (chave, id do lease)
+    """
+    lease = await get_working_key(provider, storage)
+    if not lease:
+        raise Exception(f"Nenhuma chave {'OpenAI' if provider == 'openai' else 'GROQ'} disponível")
+    return lease
 
 async def summarize_text_if_needed(text):
     """Resumir texto usando a API GROQ com sistema de rodízio de chaves"""
-    storage.add_log("DEBUG", "Iniciando processo de resumo", {
+    await storage.add_log("DEBUG", "Iniciando processo de resumo", {
         "text_length": len(text)
     })
-    provider = storage.get_llm_provider()
+    runtime_settings = await settings_cache.current()
+    provider = await select_provider("chat")
     
     # Obter idioma configurado
-    language = redis_client.get("TRANSCRIPTION_LANGUAGE") or "pt"
-    storage.add_log("DEBUG", "Idioma configurado para resumo", {
+    language = runtime_settings.transcription_language
+    await storage.add_log("DEBUG", "Idioma configurado para resumo", {
     "language": language,
-    "redis_value": redis_client.get("TRANSCRIPTION_LANGUAGE")
+    "settings_version": runtime_settings.version
     })
     
     if provider == "openai":
-        api_key = storage.get_openai_keys()[0]
+        api_key, lease_id = await acquire_key("openai")
         url = "https://api.openai.com/v1/chat/completions"
         model = "gpt-4o-mini"
     else:  # groq
         url = "https://api.groq.com/openai/v1/chat/completions"
-        api_key = await get_working_groq_key(storage)
-        if not api_key:
-            raise Exception("Nenhuma chave GROQ disponível")
+        api_key, lease_id = await acquire_key("groq")
         model = "llama-3.3-70b-versatile"
         
     headers = {
@@ -156,22 +177,22 @@ async def summarize_text_if_needed(text):
     }
 
     try:
-        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False)
+        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False, lease_id=lease_id)
         if not success:
            raise Exception(error)
        
         summary_text = response_data["choices"][0]["message"]["content"]
         # Validar se o resumo não está vazio
         if not await validate_transcription_response(summary_text):
-            storage.add_log("ERROR", "Resumo vazio ou inválido recebido")
+            await storage.add_log("ERROR", "Resumo vazio ou inválido recebido")
             raise Exception("Resumo vazio ou inválido recebido")
         # Validar se o resumo é menor que o texto original
         if len(summary_text) >= len(text):
-            storage.add_log("WARNING", "Resumo maior que texto original", {
+            await storage.add_log("WARNING", "Resumo maior que texto original", {
                 "original_length": len(text),
                 "summary_length": len(summary_text)
             })
-        storage.add_log("INFO", "Resumo gerado com sucesso", {
+        await storage.add_log("INFO", "Resumo gerado com sucesso", {
             "original_length": len(text),
             "summary_length": len(summary_text),
             "language": language
@@ -180,48 +201,79 @@ async def summarize_text_if_needed(text):
         return summary_text
     
     except Exception as e:
-        storage.add_log("ERROR", "Erro no processo de resumo", {
+        await storage.add_log("ERROR", "Erro no processo de resumo", {
             "error": str(e),
             "type": type(e).__name__
         })
         raise
 
-async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=False, use_timestamps=False):
+def transcription_form(audio_source, model, language=None, response_format=None):
     """
-    Transcreve áudio com suporte a detecção de idioma e tradução automática.
-    
-    Args:
-        audio_source: Caminho do arquivo de áudio ou URL
-        apikey: Chave da API opcional para download de áudio
-        remote_jid: ID do remetente/destinatário
-        from_me: Se o áudio foi enviado pelo próprio usuário
-        use_timestamps: Se True, usa verbose_json para incluir timestamps
-        
+    Fábrica do corpo multipart da transcrição: cada tentativa recebe um
+    FormData novo, montado a partir do áudio em memória (o arquivo de um
+    FormData é consumido no primeiro envio).
+    """
+    def build():
+        data = aiohttp.FormData()
+        data.add_field('file', audio_source.payload(), filename=audio_source.filename)
+        data.add_field('model', model)
+        if language:
+            data.add_field('language', language)
+        if response_format:
+            data.add_field('response_format', response_format)
+        return data
+    return build
+
+def transcription_model(provider, route_model, configured_provider):
+    """Modelo usado pelo provedor escolhido, dado o modelo da rota."""
+    if provider == "local":
+        return local_whisper.model_name
+    if provider != configured_provider:
+        # Failover: o modelo da rota é do provedor principal
+        return TRANSCRIPTION_MODELS[provider]
+    return route_model or TRANSCRIPTION_MODELS[provider]
+
+async def select_transcription_target(route_provider=None, route_model=None):
+    """
+    Provedor e modelo que vão transcrever o áudio: o Whisper local quando a
+    rota o escolheu, senão o provedor de select_provider (circuit breaker e
+    failover). A seleção consome a vez de teste de um circuito semiaberto,
+    então é feita uma vez por áudio e o resultado serve tanto para consultar
+    o cache quanto para a transcrição.
+
     Returns:
-        tuple: (texto_transcrito, has_timestamps)
+        tuple: (provedor, modelo)
+    """
+    runtime_settings = await settings_cache.current()
+    provider = route_provider if route_provider == "local" else await select_provider("transcription")
+    return provider, transcription_model(provider, route_model, runtime_settings.llm_provider)
+
+async def transcribe_audio_raw(audio_source, remote_jid=None, from_me=False, use_timestamps=False, chunks=None, model=None,
+                               provider=None) -> dict:
     """
-    storage.add_log("INFO", "Iniciando processo de transcrição", {
+    Executa apenas a transcrição (Whisper), já no idioma definido para o chat.
+    Com `chunks` (ver AudioPreprocessor.split), os trechos são transcritos em
+    paralelo e o resultado é reunido em ordem. `provider` e `model` são os
+    de select_transcription_target; sem `provider`, a seleção é feita aqui.
+
+    Returns:
+        dict: texto transcrito e o contexto de idiomas usado pelos estágios
+        seguintes (detecção, tradução e estatísticas)
+    """
+    await storage.add_log("INFO", "Iniciando processo de transcrição", {
         "from_me": from_me,
         "remote_jid": remote_jid
     })
-    provider = storage.get_llm_provider()
-    
-    if provider == "openai":
-        api_key = storage.get_openai_keys()[0]  # Get first OpenAI key
-        url = "https://api.openai.com/v1/audio/transcriptions"
-        model = "whisper-1"
-    else:  # groq
-        api_key = await get_working_groq_key(storage)
-        if not api_key:
-            raise Exception("Nenhuma chave GROQ disponível")
-        url = "https://api.groq.com/openai/v1/audio/transcriptions"
-        model = "whisper-large-v3"
-
-    headers = {"Authorization": f"Bearer {api_key}"}
+    runtime_settings = await settings_cache.current()
+    if provider is None:
+        provider, model = await select_transcription_target(model=model)
+    # As chaves são reservadas em cada requisição (acquire_key), para que
+    # todo lease seja liberado pela requisição que o usou
+    url = TRANSCRIPTION_URLS.get(provider)
     
     # Inicializar variáveis
     contact_language = None
-    system_language = redis_client.get("TRANSCRIPTION_LANGUAGE") or "pt"
+    system_language = runtime_settings.transcription_language
     is_private = remote_jid and "@s.whatsapp.net" in remote_jid
 
     # Determinar idioma do contato em conversas privadas
@@ -230,21 +282,21 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
         contact_id = remote_jid.split('@')[0]
         
         # 1. Primeiro tentar obter idioma configurado manualmente
-        contact_language = storage.get_contact_language(contact_id)
+        contact_language = await storage.get_contact_language(contact_id)
         if contact_language:
-            storage.add_log("DEBUG", "Usando idioma configurado manualmente", {
+            await storage.add_log("DEBUG", "Usando idioma configurado manualmente", {
                 "contact_language": contact_language,
                 "from_me": from_me,
                 "remote_jid": remote_jid,
                 "is_private": is_private
             })
         # 2. Se não houver configuração manual e detecção automática estiver ativa
-        elif storage.get_auto_language_detection():
+        elif runtime_settings.auto_language_detection:
             # Verificar cache primeiro
-            cached_lang = storage.get_cached_language(contact_id)
+            cached_lang = await storage.get_cached_language(contact_id)
             if cached_lang:
                 contact_language = cached_lang.get('language')
-                storage.add_log("DEBUG", "Usando idioma do cache", {
+                await storage.add_log("DEBUG", "Usando idioma do cache", {
                     "contact_language": contact_language,
                     "auto_detected": True
                 })
@@ -252,36 +304,41 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
             elif not from_me:  # Só detecta em mensagens recebidas
                 try:
                     # Realizar transcrição inicial sem idioma específico
-                    with open(audio_source, 'rb') as audio_file:
-                        data = aiohttp.FormData()
-                        data.add_field('file', audio_file, filename='audio.mp3')
-                        data.add_field('model', model)
-
-                        success, response_data, error = await handle_groq_request(url, headers, data, storage, is_form_data=True)
-                        if success:
-                            initial_text = response_data.get("text", "")
-
-                            # Detectar idioma do texto transcrito
-                            detected_lang = await detect_language(initial_text)
-
-                            # Salvar no cache E na configuração do contato
-                            storage.cache_language_detection(contact_id, detected_lang)
-                            storage.set_contact_language(contact_id, detected_lang)
-
-                            contact_language = detected_lang
-                            storage.add_log("INFO", "Idioma detectado e configurado", {
-                                "language": detected_lang,
-                                "remote_jid": remote_jid,
-                                "auto_detected": True
-                            })
+                    # (em áudios divididos, o primeiro trecho basta)
+                    sample = chunks[0]["audio"] if chunks else audio_source
+                    if provider == "local":
+                        success, response_data = True, await local_whisper.transcribe(sample)
+                    else:
+                        data = transcription_form(sample, model)
+                        api_key, lease_id = await acquire_key(provider)
+                        headers = {"Authorization": f"Bearer {api_key}"}
+                        success, response_data, error = await handle_groq_request(
+                            url, headers, data, storage, is_form_data=True, lease_id=lease_id
+                        )
+                    if success:
+                        initial_text = response_data.get("text", "")
+
+                        # Detectar idioma do texto transcrito
+                        detected_lang = await detect_language(initial_text)
+
+                        # Salvar no cache E na configuração do contato
+                        await storage.cache_language_detection(contact_id, detected_lang)
+                        await storage.set_contact_language(contact_id, detected_lang)
+
+                        contact_language = detected_lang
+                        await storage.add_log("INFO", "Idioma detectado e configurado", {
+                            "language": detected_lang,
+                            "remote_jid": remote_jid,
+                            "auto_detected": True
+                        })
                 except Exception as e:
-                    storage.add_log("WARNING", "Erro na detecção automática de idioma", {
+                    await storage.add_log("WARNING", "Erro na detecção automática de idioma", {
                         "error": str(e),
                         "remote_jid": remote_jid
                     })
 
         if not contact_language:
-            storage.add_log("DEBUG", "Usando idioma padrão do sistema", {
+            await storage.add_log("DEBUG", "Usando idioma padrão do sistema", {
                 "from_me": from_me,
                 "remote_jid": remote_jid,
                 "is_private": is_private,
@@ -294,7 +351,7 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
             # Se estou enviando para um contato com idioma configurado
             transcription_language = contact_language  # Transcrever no idioma do contato
             target_language = contact_language        # Não precisa traduzir
-            storage.add_log("DEBUG", "Usando idioma do contato para áudio enviado", {
+            await storage.add_log("DEBUG", "Usando idioma do contato para áudio enviado", {
                 "transcription_language": transcription_language,
                 "target_language": target_language
             })
@@ -302,7 +359,7 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
             # Se estou recebendo
             transcription_language = contact_language  # Transcrever no idioma do contato
             target_language = system_language         # Traduzir para o idioma do sistema
-            storage.add_log("DEBUG", "Processando áudio recebido com tradução", {
+            await storage.add_log("DEBUG", "Processando áudio recebido com tradução", {
                 "transcription_language": transcription_language,
                 "target_language": target_language
             })
@@ -310,12 +367,12 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
         # Caso padrão: usar idioma do sistema
         transcription_language = system_language
         target_language = system_language
-        storage.add_log("DEBUG", "Usando idioma do sistema", {
+        await storage.add_log("DEBUG", "Usando idioma do sistema", {
             "transcription_language": transcription_language,
             "target_language": target_language
         })
 
-    storage.add_log("DEBUG", "Configuração de idiomas definida", {
+    await storage.add_log("DEBUG", "Configuração de idiomas definida", {
         "transcription_language": transcription_language,
         "target_language": target_language,
         "from_me": from_me,
@@ -323,91 +380,236 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
         "contact_language": contact_language
     })
 
-    try:
-        # Realizar transcrição
-        with open(audio_source, 'rb') as audio_file:
-            data = aiohttp.FormData()
-            data.add_field('file', audio_file, filename='audio.mp3')
-            data.add_field('model', model)
-            data.add_field('language', transcription_language)
-
-            if use_timestamps:
-                data.add_field('response_format', 'verbose_json')
+    response_format = 'verbose_json' if use_timestamps else None
+    # Chave da requisição original, que a cópia do hedging evita
+    primary_keys = []
 
-            # Usar handle_groq_request para ter retry e validação
-            success, response_data, error = await handle_groq_request(url, headers, data, storage, is_form_data=True)
-            if not success:
-                raise Exception(f"Erro na transcrição: {error}")
-
-            transcription = format_timestamped_result(response_data) if use_timestamps else response_data.get("text", "")
+    async def send(target_provider, target_model, target_lease=None):
+        if target_lease is None:
+            target_lease = await acquire_key(target_provider)
+            primary_keys.append(target_lease[0])
+        target_key, lease_id = target_lease
 
-            # Validar o conteúdo da transcrição
-            if not await validate_transcription_response(transcription):
-                storage.add_log("ERROR", "Transcrição vazia ou inválida recebida")
-                raise Exception("Transcrição vazia ou inválida recebida")
+        # Realizar transcrição
+        data = transcription_form(audio_source, target_model, transcription_language, response_format)
 
-            # Detecção automática para novos contatos
-            if (is_private and storage.get_auto_language_detection() and 
-                not from_me and not contact_language):
-                try:
-                    detected_lang = await detect_language(transcription)
-                    storage.cache_language_detection(remote_jid, detected_lang)
-                    contact_language = detected_lang
-                    storage.add_log("INFO", "Idioma detectado e cacheado", {
-                        "language": detected_lang,
-                        "remote_jid": remote_jid
-                    })
-                except Exception as e:
-                    storage.add_log("WARNING", "Erro na detecção de idioma", {"error": str(e)})
-
-            # Tradução quando necessário
-            need_translation = (
-                is_private and contact_language and
-                (
-                    (from_me and transcription_language != target_language) or
-                    (not from_me and target_language != transcription_language)
-                )
-            )
+        # Usar handle_groq_request para ter retry e validação
+        target_headers = {"Authorization": f"Bearer {target_key}"}
+        success, response_data, error = await handle_groq_request(
+            TRANSCRIPTION_URLS[target_provider], target_headers, data, storage, is_form_data=True, lease_id=lease_id
+        )
+        if not success:
+            raise Exception(f"Erro na transcrição: {error}")
+        return response_data, target_model
 
-            if need_translation:
-                try:
-                    transcription = await translate_text(
-                        transcription,
-                        transcription_language,
-                        target_language
-                    )
-                    storage.add_log("INFO", "Texto traduzido automaticamente", {
-                        "from": transcription_language,
-                        "to": target_language
-                    })
-                except Exception as e:
-                    storage.add_log("ERROR", "Erro na tradução", {"error": str(e)})
-
-            # Registrar estatísticas de uso
-            used_language = contact_language if contact_language else system_language
-            storage.record_language_usage(
-                used_language,
-                from_me,
-                bool(contact_language and contact_language != system_language)
-            )
+    async def hedge():
+        target = await hedge_transcription_target(provider, primary_keys[0] if primary_keys else None)
+        if not target:
+            return None
+        target_provider, target_lease = target
+        target_model = model if target_provider == provider else TRANSCRIPTION_MODELS[target_provider]
+        return lambda: send(target_provider, target_model, target_lease)
 
-            return transcription, use_timestamps
+    try:
+        try:
+            if provider == "local":
+                # Sem limite de upload, o áudio inteiro vai para o modelo local
+                response_data = await local_whisper.transcribe(audio_source, transcription_language)
+            elif chunks:
+                response_data = await transcribe_chunks(chunks, provider, url, model, transcription_language)
+            else:
+                # O modelo que transcreveu muda se a cópia do hedging vencer
+                response_data, model = await transcription_hedger.run(lambda: send(provider, model), hedge)
+        except Exception as e:
+            if provider == "local":
+                # Modelo local sem carregar (ex.: falta de memória): segue
+                # com o provedor remoto, sem a divisão em trechos
+                remote = await select_provider("transcription", allow_local=False)
+                await storage.add_log("WARNING", "Whisper local falhou, usando o provedor remoto", {
+                    "provider": remote,
+                    "error": str(e)
+                })
+                response_data, model = await send(remote, TRANSCRIPTION_MODELS[remote])
+            elif local_whisper.fallback:
+                await storage.add_log("WARNING", "Transcrição remota falhou, usando o Whisper local", {
+                    "provider": provider,
+                    "error": str(e)
+                })
+                response_data = await local_whisper.transcribe(audio_source, transcription_language)
+                model = local_whisper.model_name
+            else:
+                raise
+
+        transcription = format_timestamped_result(response_data) if use_timestamps else response_data.get("text", "")
+
+        # Validar o conteúdo da transcrição
+        if not await validate_transcription_response(transcription):
+            await storage.add_log("ERROR", "Transcrição vazia ou inválida recebida")
+            raise Exception("Transcrição vazia ou inválida recebida")
+
+        return {
+            "text": transcription,
+            "has_timestamps": use_timestamps,
+            "model": model,
+            "remote_jid": remote_jid,
+            "from_me": from_me,
+            "is_private": is_private,
+            "contact_language": contact_language,
+            "system_language": system_language,
+            "transcription_language": transcription_language,
+            "target_language": target_language,
+        }
 
     except Exception as e:
-        storage.add_log("ERROR", "Erro no processo de transcrição", {
+        await storage.add_log("ERROR", "Erro no processo de transcrição", {
             "error": str(e),
             "type": type(e).__name__
         })
         raise
-    finally:
-        # Limpar arquivos temporários
-        if isinstance(audio_source, str) and os.path.exists(audio_source):
-            try:
-                os.unlink(audio_source)
-            except Exception as e:
-                storage.add_log("WARNING", "Erro ao remover arquivo temporário", {
-                    "error": str(e)
-                })
+
+async def hedge_transcription_target(provider, primary_key):
+    """
+    Chave para a cópia de uma transcrição lenta (hedging): outra chave do
+    mesmo provedor ou, sem ela, uma do outro provedor.
+
+    Returns:
+        tuple: (provedor, (chave, id do lease)) ou None se não houver alternativa
+    """
+    lease = await get_working_key(provider, storage, exclude=primary_key)
+    if lease:
+        return provider, lease
+
+    secondary = "openai" if provider == "groq" else "groq"
+    if not await circuit_breaker.allow(secondary, "transcription"):
+        return None
+    lease = await get_working_key(secondary, storage)
+    return (secondary, lease) if lease else None
+
+async def transcribe_chunks(chunks, provider, url, model, language) -> dict:
+    """
+    Transcreve os trechos de um áudio longo em paralelo, até
+    TRANSCRIPTION_CHUNK_PARALLELISM ao mesmo tempo. Cada trecho pega a
+    próxima chave do pool do provedor, espalhando a carga entre as chaves.
+    """
+    parallelism = max(int(os.getenv("TRANSCRIPTION_CHUNK_PARALLELISM", 4)), 1)
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def transcribe_chunk(chunk):
+        async with semaphore:
+            api_key, lease_id = await acquire_key(provider)
+
+            # Os segmentos com tempo são necessários para descartar a sobreposição
+            data = transcription_form(chunk["audio"], model, language, response_format='verbose_json')
+
+            headers = {"Authorization": f"Bearer {api_key}"}
+            success, response_data, error = await handle_groq_request(
+                url, headers, data, storage, is_form_data=True, lease_id=lease_id
+            )
+            if not success:
+                raise Exception(f"Erro na transcrição do trecho {chunk['start']:.0f}s-{chunk['end']:.0f}s: {error}")
+            return response_data
+
+    started = time.monotonic()
+    tasks = [asyncio.create_task(transcribe_chunk(chunk)) for chunk in chunks]
+    try:
+        responses = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    await storage.add_log("INFO", "Trechos transcritos", {
+        "chunks": len(chunks),
+        "parallelism": parallelism,
+        "seconds": round(time.monotonic() - started, 3)
+    })
+    return merge_chunk_transcriptions(chunks, responses)
+
+def merge_chunk_transcriptions(chunks, responses) -> dict:
+    """
+    Junta as respostas verbose_json dos trechos, em ordem, no mesmo formato
+    de uma resposta única: os tempos dos segmentos são deslocados para a
+    linha do tempo do áudio original. Na sobreposição, um trecho fica com os
+    segmentos cujo ponto médio cai antes do seu fim, e o trecho seguinte só
+    com os que começam depois do último segmento já aceito.
+    """
+    segments = []
+    last = len(chunks) - 1
+    for index, (chunk, response) in enumerate(zip(chunks, responses)):
+        lower = segments[-1]["end"] if segments else float("-inf")
+        upper = chunk["end"] if index < last else float("inf")
+        chunk_segments = response.get("segments")
+        if not chunk_segments:
+            chunk_segments = [{"start": chunk["start"] - chunk["offset"], "end": chunk["end"] - chunk["offset"],
+                               "text": response.get("text", "")}]
+        for segment in chunk_segments:
+            start = segment.get("start", 0) + chunk["offset"]
+            end = segment.get("end", 0) + chunk["offset"]
+            if lower <= (start + end) / 2 < upper:
+                segments.append({**segment, "id": len(segments), "start": start, "end": end})
+
+    text = " ".join(segment.get("text", "").strip() for segment in segments if segment.get("text", "").strip())
+    return {"text": text, "segments": segments}
+
+async def detect_new_contact_language(result: dict):
+    """Detecta e guarda o idioma de um contato novo a partir do texto transcrito."""
+    runtime_settings = await settings_cache.current()
+    if not (result["is_private"] and runtime_settings.auto_language_detection and
+            not result["from_me"] and not result["contact_language"]):
+        return None
+    try:
+        detected_lang = await detect_language(result["text"])
+        await storage.cache_language_detection(result["remote_jid"], detected_lang)
+        await storage.add_log("INFO", "Idioma detectado e cacheado", {
+            "language": detected_lang,
+            "remote_jid": result["remote_jid"]
+        })
+        return detected_lang
+    except Exception as e:
+        await storage.add_log("WARNING", "Erro na detecção de idioma", {"error": str(e)})
+        return None
+
+async def translate_transcription(result: dict) -> str:
+    """Traduz a transcrição quando o idioma do contato difere do destino."""
+    transcription = result["text"]
+    transcription_language = result["transcription_language"]
+    target_language = result["target_language"]
+    from_me = result["from_me"]
+
+    # Tradução quando necessário
+    need_translation = (
+        result["is_private"] and result["contact_language"] and
+        (
+            (from_me and transcription_language != target_language) or
+            (not from_me and target_language != transcription_language)
+        )
+    )
+
+    if need_translation:
+        try:
+            transcription = await translate_text(
+                transcription,
+                transcription_language,
+                target_language
+            )
+            await storage.add_log("INFO", "Texto traduzido automaticamente", {
+                "from": transcription_language,
+                "to": target_language
+            })
+        except Exception as e:
+            await storage.add_log("ERROR", "Erro na tradução", {"error": str(e)})
+    return transcription
+
+async def record_transcription_stats(result: dict, detected_language=None):
+    """Registra as estatísticas de uso de idioma da transcrição."""
+    contact_language = result["contact_language"] or detected_language
+    system_language = result["system_language"]
+    used_language = contact_language if contact_language else system_language
+    await storage.record_language_usage(
+        used_language,
+        result["from_me"],
+        bool(contact_language and contact_language != system_language)
+    )
 
 def format_timestamped_result(result):
     """
@@ -445,8 +647,8 @@ async def detect_language(text: str) -> str:
     Returns:
         str: Código ISO 639-1 do idioma detectado
     """
-    provider = storage.get_llm_provider()
-    storage.add_log("DEBUG", "Iniciando detecção de idioma", {
+    provider = await select_provider("chat")
+    await storage.add_log("DEBUG", "Iniciando detecção de idioma", {
         "text_length": len(text)
     })
     
@@ -456,14 +658,12 @@ async def detect_language(text: str) -> str:
         "zh", "ro", "ru", "ar", "hi", "nl", "pl", "tr"
     }
     if provider == "openai":
-        api_key = storage.get_openai_keys()[0]
+        api_key, lease_id = await acquire_key("openai")
         url = "https://api.openai.com/v1/chat/completions"
         model = "gpt-4o-mini"
     else:  # groq
         url = "https://api.groq.com/openai/v1/chat/completions"
-        api_key = await get_working_groq_key(storage)
-        if not api_key:
-            raise Exception("Nenhuma chave GROQ disponível")
+        api_key, lease_id = await acquire_key("groq")
         model = "llama-3.3-70b-versatile"
         
     headers = {
@@ -501,7 +701,7 @@ async def detect_language(text: str) -> str:
     }
 
     try:
-        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False)
+        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False, lease_id=lease_id)
         if not success:
             raise Exception(f"Falha na detecção de idioma: {error}")
         
@@ -509,19 +709,19 @@ async def detect_language(text: str) -> str:
                             
         # Validar o resultado
         if detected_language not in SUPPORTED_LANGUAGES:
-            storage.add_log("WARNING", "Idioma detectado não suportado", {
+            await storage.add_log("WARNING", "Idioma detectado não suportado", {
                 "detected": detected_language,
                 "fallback": "en"
             })
             detected_language = "en"
         
-        storage.add_log("INFO", "Idioma detectado com sucesso", {
+        await storage.add_log("INFO", "Idioma detectado com sucesso", {
             "detected_language": detected_language
         })
         return detected_language
 
     except Exception as e:
-        storage.add_log("ERROR", "Erro no processo de detecção de idioma", {
+        await storage.add_log("ERROR", "Erro no processo de detecção de idioma", {
             "error": str(e),
             "type": type(e).__name__
         })
@@ -529,7 +729,7 @@ async def detect_language(text: str) -> str:
 
 async def send_message_to_whatsapp(server_url, instance, apikey, message, remote_jid, message_id):
     """Envia mensagem via WhatsApp"""
-    storage.add_log("DEBUG", "Preparando envio de mensagem", {
+    await storage.add_log("DEBUG", "Preparando envio de mensagem", {
         "remote_jid": remote_jid,
         "instance": instance
     })
@@ -539,20 +739,20 @@ async def send_message_to_whatsapp(server_url, instance, apikey, message, remote
     try:
         # Tentar enviar na V1
         body = get_body_message_to_whatsapp_v1(message, remote_jid)
-        storage.add_log("DEBUG", "Tentando envio no formato V1")
-        result = await call_whatsapp(url, body, headers)
+        await storage.add_log("DEBUG", "Tentando envio no formato V1")
+        result = await call_whatsapp(url, body, headers, server_url)
 
         # Se falhar, tenta V2
         if not result:
-            storage.add_log("DEBUG", "Formato V1 falhou, tentando formato V2")
+            await storage.add_log("DEBUG", "Formato V1 falhou, tentando formato V2")
             body = get_body_message_to_whatsapp_v2(message, remote_jid, message_id)
-            await call_whatsapp(url, body, headers)
+            await call_whatsapp(url, body, headers, server_url)
             
-        storage.add_log("INFO", "Mensagem enviada com sucesso", {
+        await storage.add_log("INFO", "Mensagem enviada com sucesso", {
             "remote_jid": remote_jid
         })
     except Exception as e:
-        storage.add_log("ERROR", "Erro no envio da mensagem", {
+        await storage.add_log("ERROR", "Erro no envio da mensagem", {
             "error": str(e),
             "type": type(e).__name__,
             "remote_jid": remote_jid
@@ -575,56 +775,74 @@ def get_body_message_to_whatsapp_v2(message, remote_jid, message_id):
         "quoted": {"key": {"remoteJid": remote_jid, "fromMe": False, "id": message_id}},
     }
 
-async def call_whatsapp(url, body, headers):
+async def call_whatsapp(url, body, headers, server_url=None):
     """Realiza chamada à API do WhatsApp"""
     try:
-        async with aiohttp.ClientSession() as session:
-            storage.add_log("DEBUG", "Enviando requisição para WhatsApp", {
-                "url": url
-            })
-            async with session.post(url, json=body, headers=headers) as response:
-                if response.status not in [200, 201]:
-                    error_text = await response.text()
-                    storage.add_log("ERROR", "Erro na API do WhatsApp", {
-                        "status": response.status,
-                        "error": error_text
-                    })
-                    return False
-                storage.add_log("DEBUG", "Requisição bem-sucedida")
-                return True
+        session = http_client.get_session("evolution", server_url)
+        await storage.add_log("DEBUG", "Enviando requisição para WhatsApp", {
+            "url": url
+        })
+        async with session.post(url, json=body, headers=headers) as response:
+            if response.status not in [200, 201]:
+                error_text = await response.text()
+                await storage.add_log("ERROR", "Erro na API do WhatsApp", {
+                    "status": response.status,
+                    "error": error_text
+                })
+                return False
+            await storage.add_log("DEBUG", "Requisição bem-sucedida")
+            return True
     except Exception as e:
-        storage.add_log("ERROR", "Erro na chamada WhatsApp", {
+        await storage.add_log("ERROR", "Erro na chamada WhatsApp", {
             "error": str(e),
             "type": type(e).__name__
         })
         return False
 
-async def get_audio_base64(server_url, instance, apikey, message_id):
-    """Obtém áudio em Base64 via API do WhatsApp"""
-    storage.add_log("DEBUG", "Obtendo áudio base64", {
+async def get_audio_from_evolution(server_url, instance, apikey, message_id) -> AudioBuffer:
+    """
+    Obtém o áudio via getBase64FromMediaMessage da API do WhatsApp.
+
+    A resposta é lida em blocos e o campo base64 é decodificado à medida
+    que chega, direto para um AudioBuffer; o JSON inteiro e a string base64
+    nunca ficam em memória.
+    """
+    await storage.add_log("DEBUG", "Obtendo áudio base64", {
         "message_id": message_id,
         "instance": instance
     })
     url = f"{server_url}/chat/getBase64FromMediaMessage/{instance}"
     headers = {"apikey": apikey}
     body = {"message": {"key": {"id": message_id}}, "convertToMp4": False}
+    max_bytes = int(os.getenv("MEDIA_MAX_BYTES", 25 * 1024 * 1024))
 
+    audio = AudioBuffer()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=body, headers=headers) as response:
-                if response.status in [200, 201]:
-                    result = await response.json()
-                    storage.add_log("INFO", "Áudio base64 obtido com sucesso")
-                    return result.get("base64", "")
-                else:
-                    error_text = await response.text()
-                    storage.add_log("ERROR", "Erro ao obter áudio base64", {
-                        "status": response.status,
-                        "error": error_text
-                    })
-                    raise HTTPException(status_code=500, detail="Falha ao obter áudio em base64")
+        session = http_client.get_session("evolution", server_url)
+        async with session.post(url, json=body, headers=headers) as response:
+            if response.status in [200, 201]:
+                decoder = Base64FieldDecoder(audio)
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    decoder.feed(chunk)
+                    if audio.size > max_bytes:
+                        raise Exception(f"Áudio excede o limite de {max_bytes} bytes")
+                    if decoder.done:
+                        break
+                decoder.close()
+                await storage.add_log("INFO", "Áudio base64 obtido com sucesso", {
+                    "bytes": audio.size
+                })
+                return audio
+            else:
+                error_text = await response.text()
+                await storage.add_log("ERROR", "Erro ao obter áudio base64", {
+                    "status": response.status,
+                    "error": error_text
+                })
+                raise HTTPException(status_code=500, detail="Falha ao obter áudio em base64")
     except Exception as e:
-        storage.add_log("ERROR", "Erro na obtenção do áudio base64", {
+        audio.close()
+        await storage.add_log("ERROR", "Erro na obtenção do áudio base64", {
             "error": str(e),
             "type": type(e).__name__,
             "message_id": message_id
@@ -633,7 +851,7 @@ async def get_audio_base64(server_url, instance, apikey, message_id):
     
 async def format_message(transcription_text, summary_text=None):
     """Formata a mensagem baseado nas configurações."""
-    settings = storage.get_message_settings()
+    settings = await storage.get_message_settings()
     message_parts = []
     
     # Determinar modo de saída
@@ -674,8 +892,8 @@ async def translate_text(text: str, source_language: str, target_language: str)
     Returns:
         str: Texto traduzido
     """
-    provider = storage.get_llm_provider()
-    storage.add_log("DEBUG", "Iniciando tradução", {
+    provider = await select_provider("chat")
+    await storage.add_log("DEBUG", "Iniciando tradução", {
        "source_language": source_language,
        "target_language": target_language,
        "text_length": len(text)
@@ -686,14 +904,12 @@ async def translate_text(text: str, source_language: str, target_language: str)
         return text
    
     if provider == "openai":
-        api_key = storage.get_openai_keys()[0]
+        api_key, lease_id = await acquire_key("openai")
         url = "https://api.openai.com/v1/chat/completions"
         model = "gpt-4o-mini"
     else:  # groq
         url = "https://api.groq.com/openai/v1/chat/completions"
-        api_key = await get_working_groq_key(storage)
-        if not api_key:
-            raise Exception("Nenhuma chave GROQ disponível")
+        api_key, lease_id = await acquire_key("groq")
         model = "llama-3.3-70b-versatile"
         
     headers = {
@@ -730,7 +946,7 @@ async def translate_text(text: str, source_language: str, target_language: str)
     }
 
     try:
-        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False)
+        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False, lease_id=lease_id)
         if not success:
             raise Exception(f"Falha na tradução: {error}")
         
@@ -739,7 +955,7 @@ async def translate_text(text: str, source_language: str, target_language: str)
         # Verificar se a tradução manteve aproximadamente o mesmo tamanho
         length_ratio = len(translated_text) / len(text)
         if not (0.5 <= length_ratio <= 1.5):
-            storage.add_log("WARNING", "Possível erro na tradução - diferença significativa no tamanho", {
+            await storage.add_log("WARNING", "Possível erro na tradução - diferença significativa no tamanho", {
                 "original_length": len(text),
                 "translated_length": len(translated_text),
                 "ratio": length_ratio
@@ -747,10 +963,10 @@ async def translate_text(text: str, source_language: str, target_language: str)
         
         # Validar se a tradução não está vazia
         if not await validate_transcription_response(translated_text):
-            storage.add_log("ERROR", "Tradução vazia ou inválida recebida")
+            await storage.add_log("ERROR", "Tradução vazia ou inválida recebida")
             raise Exception("Tradução vazia ou inválida recebida")
         
-        storage.add_log("INFO", "Tradução concluída com sucesso", {
+        await storage.add_log("INFO", "Tradução concluída com sucesso", {
             "original_length": len(text),
             "translated_length": len(translated_text),
             "ratio": length_ratio
@@ -759,29 +975,46 @@ async def translate_text(text: str, source_language: str, target_language: str)
         return translated_text
 
     except Exception as e:
-        storage.add_log("ERROR", "Erro no processo de tradução", {
+        await storage.add_log("ERROR", "Erro no processo de tradução", {
             "error": str(e),
             "type": type(e).__name__
         })
         raise
 
 # Nova função para baixar áudio remoto
-async def download_remote_audio(url: str) -> str:
+async def download_remote_audio(url: str) -> AudioBuffer:
     """
-    Baixa um arquivo de áudio remoto e salva localmente como um arquivo temporário.
-    Retorna o caminho para o arquivo salvo.
+    Baixa um arquivo de áudio remoto em blocos direto para um AudioBuffer.
+
+    O download é abortado quando o conteúdo passa de MEDIA_MAX_BYTES, seja
+    pelo Content-Length ou durante a transferência. O limite de duração
+    (MEDIA_MAX_SECONDS) é aplicado antes, pelo AudioRouter.
     """
+    max_bytes = int(os.getenv("MEDIA_MAX_BYTES", 25 * 1024 * 1024))
+    audio = AudioBuffer()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    audio_data = await response.read()
-                    # Cria um arquivo temporário para armazenar o áudio (pode ajustar o sufixo caso necessário)
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-                        temp_file.write(audio_data)
-                        local_path = temp_file.name
-                    return local_path
-                else:
-                    raise Exception(f"Falha no download, código de status: {response.status}")
+        started = time.monotonic()
+        total_bytes = 0
+        session = http_client.get_session("media")
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise Exception(f"Falha no download, código de status: {response.status}")
+            if response.content_length and response.content_length > max_bytes:
+                raise Exception(f"Arquivo de {response.content_length} bytes excede o limite de {max_bytes} bytes")
+
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                total_bytes += len(chunk)
+                if total_bytes > max_bytes:
+                    raise Exception(f"Download excedeu o limite de {max_bytes} bytes")
+                audio.write(chunk)
+
+        elapsed = time.monotonic() - started
+        await storage.add_log("INFO", "Download de áudio concluído", {
+            "bytes": total_bytes,
+            "seconds": round(elapsed, 3),
+            "bytes_per_second": round(total_bytes / elapsed) if elapsed > 0 else None
+        })
+        return audio
     except Exception as e:
+        audio.close()
         raise Exception(f"Erro ao baixar áudio remoto: {str(e)}")
\ No newline at end of file
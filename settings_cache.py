@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict
+
+from config import logger
+from utils import create_async_redis_client
+
+def _prefixed(key: str) -> str:
+    return f"transcrevezap:{key}"
+
+class SettingsSnapshot(BaseModel):
+    """
+    Fotografia imutável das configurações usadas no caminho das requisições.
+    Uma nova instância é criada a cada recarga e trocada atomicamente.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    version: int = 0
+    loaded_at: float = 0.0
+
+    # Configurações gerais (chaves sem prefixo, gravadas pelo manager)
+    groq_api_key: str = "default_key"
+    business_message: str = "*Impacte AI* Premium Services"
+    process_group_messages: bool = False
+    process_self_messages: bool = True
+    debug_mode: bool = False
+    transcription_language: str = "pt"
+
+    # Formatação das mensagens
+    output_mode: str = "both"
+    summary_header: str = "🤖 *Resumo do áudio:*"
+    transcription_header: str = "🔊 *Transcrição do áudio:*"
+    character_limit: int = 500
+    use_timestamps: bool = False
+
+    # Configurações do StorageHandler (chaves com prefixo transcrevezap:)
+    process_mode: str = "all"
+    llm_provider: str = "groq"
+    auto_language_detection: bool = False
+    auto_translation: bool = False
+    allowed_groups: FrozenSet[str] = frozenset()
+    blocked_users: FrozenSet[str] = frozenset()
+    groq_keys: Tuple[str, ...] = ()
+    openai_keys: Tuple[str, ...] = ()
+    webhooks: Tuple[Dict[str, str], ...] = ()
+
+    def can_process_message(self, remote_jid: str) -> bool:
+        """Mesma regra de StorageHandler.can_process_message, sem acesso ao Redis."""
+        if remote_jid in self.blocked_users:
+            return False
+        if "@g.us" in remote_jid and remote_jid not in self.allowed_groups:
+            return False
+        return True
+
+class SettingsCache:
+    """
+    Mantém em memória a SettingsSnapshot do processo.
+
+    O manager publica em CHANNEL sempre que salva uma configuração
+    (StorageHandler.notify_settings_changed); cada processo da API e dos
+    workers escuta o canal e recarrega a fotografia. Como fallback, uma
+    fotografia mais velha que SETTINGS_CACHE_TTL segundos é recarregada em
+    segundo plano na próxima leitura. Componentes que guardam valores
+    derivados das configurações se registram com `on_change`.
+    """
+    CHANNEL = "transcrevezap:settings_changed"
+    VERSION_KEY = "transcrevezap:settings_version"
+
+    # (chave no Redis, campo da fotografia)
+    PLAIN_KEYS = [
+        ("GROQ_API_KEY", "groq_api_key"),
+        ("BUSINESS_MESSAGE", "business_message"),
+        ("PROCESS_GROUP_MESSAGES", "process_group_messages"),
+        ("PROCESS_SELF_MESSAGES", "process_self_messages"),
+        ("DEBUG_MODE", "debug_mode"),
+        ("TRANSCRIPTION_LANGUAGE", "transcription_language"),
+        ("output_mode", "output_mode"),
+        ("summary_header", "summary_header"),
+        ("transcription_header", "transcription_header"),
+        ("character_limit", "character_limit"),
+        ("use_timestamps", "use_timestamps"),
+    ]
+    PREFIXED_KEYS = [
+        ("process_mode", "process_mode"),
+        ("active_llm_provider", "llm_provider"),
+        ("auto_language_detection", "auto_language_detection"),
+        ("auto_translation", "auto_translation"),
+    ]
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        self.ttl = float(os.getenv("SETTINGS_CACHE_TTL", 60))
+        self._snapshot: Optional[SettingsSnapshot] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._callbacks: List[Callable[[SettingsSnapshot], None]] = []
+
+    def on_change(self, callback: Callable[[SettingsSnapshot], None]):
+        """Chama `callback` com cada fotografia carregada (e já com a atual, se houver)."""
+        if callback in self._callbacks:
+            return
+        self._callbacks.append(callback)
+        if self._snapshot is not None:
+            callback(self._snapshot)
+
+    async def start(self):
+        """Carrega a primeira fotografia e inicia a escuta de invalidações."""
+        await self.refresh()
+        if self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        for task in (self._listener_task, self._refresh_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._listener_task = None
+        self._refresh_task = None
+
+    async def current(self) -> SettingsSnapshot:
+        """
+        Retorna a fotografia atual sem acessar o Redis. Só carrega de forma
+        síncrona na primeira chamada; fotografias expiradas são servidas
+        enquanto a recarga acontece em segundo plano.
+        """
+        if self._snapshot is None:
+            return await self.refresh()
+        if time.monotonic() - self._snapshot.loaded_at > self.ttl:
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(self.refresh())
+        return self._snapshot
+
+    async def refresh(self) -> SettingsSnapshot:
+        """Lê todas as configurações em uma única ida ao Redis e troca a fotografia."""
+        async with self._lock:
+            try:
+                self._snapshot = await self._load()
+                logger.debug(f"Configurações recarregadas (versão {self._snapshot.version})")
+                for callback in self._callbacks:
+                    try:
+                        callback(self._snapshot)
+                    except Exception as e:
+                        logger.error(f"Erro ao aplicar configurações recarregadas: {e}")
+            except Exception as e:
+                logger.error(f"Erro ao recarregar configurações: {e}")
+                if self._snapshot is None:
+                    self._snapshot = SettingsSnapshot(loaded_at=time.monotonic())
+            return self._snapshot
+
+    async def _load(self) -> SettingsSnapshot:
+        keys = [key for key, _ in self.PLAIN_KEYS] + [_prefixed(key) for key, _ in self.PREFIXED_KEYS]
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self.VERSION_KEY)
+        pipe.mget(keys)
+        pipe.smembers(_prefixed("allowed_groups"))
+        pipe.smembers(_prefixed("blocked_users"))
+        pipe.smembers(_prefixed("groq_keys"))
+        pipe.smembers(_prefixed("openai_keys"))
+        pipe.hgetall(_prefixed("webhook_redirects"))
+        version, values, allowed, blocked, groq_keys, openai_keys, webhooks_raw = await pipe.execute()
+
+        defaults = SettingsSnapshot()
+        fields = {}
+        for (_, field), value in zip(self.PLAIN_KEYS + self.PREFIXED_KEYS, values):
+            if value is None:
+                continue
+            default = getattr(defaults, field)
+            if isinstance(default, bool):
+                fields[field] = value.lower() == "true"
+            elif isinstance(default, int):
+                try:
+                    fields[field] = int(value)
+                except ValueError:
+                    logger.warning(f"Valor inválido para '{field}': {value}")
+            else:
+                fields[field] = value
+
+        webhooks = []
+        for webhook_id, data in webhooks_raw.items():
+            try:
+                webhooks.append({"id": webhook_id, "url": json.loads(data)["url"]})
+            except (ValueError, KeyError):
+                logger.warning(f"Webhook {webhook_id} com dados inválidos ignorado")
+
+        return SettingsSnapshot(
+            version=int(version or 0),
+            loaded_at=time.monotonic(),
+            allowed_groups=frozenset(allowed),
+            blocked_users=frozenset(blocked),
+            groq_keys=tuple(sorted(groq_keys)),
+            openai_keys=tuple(sorted(openai_keys)),
+            webhooks=tuple(webhooks),
+            **fields
+        )
+
+    async def _listen(self):
+        """Escuta o canal de invalidação, reconectando em caso de falha."""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.CHANNEL)
+                # Mensagens perdidas durante uma reconexão são cobertas por esta recarga
+                await self.refresh()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        version = int(message.get("data") or 0)
+                    except ValueError:
+                        version = 0
+                    if self._snapshot is None or version == 0 or version > self._snapshot.version:
+                        await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Escuta de configurações interrompida: {e}. Reconectando...")
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+# Instância única por processo
+settings_cache = SettingsCache()
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from config import logger
+
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Any]]
+StageCallback = Callable[[str, float, Optional[BaseException]], Awaitable[None]]
+
+# Tasks de estágios fora do caminho crítico ainda em execução
+_background_tasks = set()
+
+def run_in_background(coro, name: str = None) -> asyncio.Task:
+    """Executa a corotina sem bloquear o chamador, mantendo a referência até o fim."""
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+def _background_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Erro em tarefa de segundo plano {task.get_name()}: {task.exception()}")
+
+async def drain_background(timeout: float = 10.0):
+    """Aguarda as tarefas de segundo plano pendentes (usado no shutdown)."""
+    if _background_tasks:
+        await asyncio.wait(list(_background_tasks), timeout=timeout)
+
+class StageGraph:
+    """
+    Pequeno grafo de dependências para o trabalho pós-transcrição.
+
+    Cada estágio é uma corotina que recebe o dicionário de resultados dos
+    estágios anteriores e começa assim que suas dependências (`after`)
+    terminam; estágios independentes rodam ao mesmo tempo. `run()` retorna
+    quando todos os estágios críticos terminam. Estágios com
+    `critical=False` (estatísticas, por exemplo) continuam em segundo plano
+    e uma falha neles só é registrada.
+
+    A duração de cada estágio fica em `durations` e é informada ao
+    callback `on_stage_done`.
+    """
+
+    def __init__(self, on_stage_done: Optional[StageCallback] = None):
+        self._stages: Dict[str, tuple] = {}
+        self.results: Dict[str, Any] = {}
+        self.durations: Dict[str, float] = {}
+        self.on_stage_done = on_stage_done
+
+    def add(self, name: str, func: StageFunc, after: Iterable[str] = (), critical: bool = True):
+        after = tuple(after)
+        for dependency in after:
+            if dependency not in self._stages:
+                raise ValueError(f"Estágio '{name}' depende de '{dependency}', que não foi adicionado")
+        self._stages[name] = (func, after, critical)
+        return self
+
+    async def run(self) -> Dict[str, Any]:
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def execute(name: str):
+            func, after, _ = self._stages[name]
+            if after:
+                await asyncio.gather(*(tasks[dependency] for dependency in after))
+            started = time.monotonic()
+            error = None
+            try:
+                self.results[name] = await func(self.results)
+                return self.results[name]
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self.durations[name] = round(time.monotonic() - started, 3)
+                if self.on_stage_done is not None:
+                    try:
+                        await self.on_stage_done(name, self.durations[name], error)
+                    except Exception:
+                        pass
+
+        for name, (_, _, critical) in self._stages.items():
+            coro = execute(name)
+            tasks[name] = asyncio.create_task(coro) if critical else run_in_background(coro, name)
+
+        critical_tasks = [tasks[name] for name, (_, _, critical) in self._stages.items() if critical]
+        try:
+            await asyncio.gather(*critical_tasks)
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return self.results
@@ -47,6 +47,12 @@ initialize_redis_config
 # Iniciar o FastAPI em background
 uvicorn main:app --host 0.0.0.0 --port 8005 &
 
+# Iniciar os workers da fila de transcrição (apenas no modo fila)
+if [ "${PROCESSING_MODE:-inline}" = "queue" ]; then
+    echo "Modo fila ativo - iniciando workers..."
+    python worker.py &
+fi
+
 # Iniciar o Streamlit
 streamlit run manager.py --server.address 0.0.0.0 --server.port 8501
 
@@ -5,7 +5,8 @@ from datetime import datetime, timedelta
 import traceback
 import logging
 import redis
-from utils import create_redis_client
+from utils import create_redis_client, create_async_redis_client
+from log_sink import log_sink
 import uuid
 
 class StorageHandler:
@@ -42,6 +43,17 @@ class StorageHandler:
     def _get_redis_key(self, key):
         return f"transcrevezap:{key}"
 
+    def notify_settings_changed(self):
+        """
+        Incrementa a versão das configurações e avisa os processos da API e
+        dos workers para recarregarem sua fotografia em memória.
+        """
+        try:
+            version = self.redis.incr(self._get_redis_key("settings_version"))
+            self.redis.publish(self._get_redis_key("settings_changed"), version)
+        except Exception as e:
+            self.logger.error(f"Erro ao notificar alteração de configurações: {e}")
+
     def add_log(self, level: str, message: str, metadata: dict = None):
         log_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -58,18 +70,22 @@ class StorageHandler:
 
     def add_allowed_group(self, group: str):
         self.redis.sadd(self._get_redis_key("allowed_groups"), group)
+        self.notify_settings_changed()
 
     def remove_allowed_group(self, group: str):
         self.redis.srem(self._get_redis_key("allowed_groups"), group)
+        self.notify_settings_changed()
 
     def get_blocked_users(self) -> List[str]:
         return self.redis.smembers(self._get_redis_key("blocked_users"))
 
     def add_blocked_user(self, user: str):
         self.redis.sadd(self._get_redis_key("blocked_users"), user)
+        self.notify_settings_changed()
 
     def remove_blocked_user(self, user: str):
         self.redis.srem(self._get_redis_key("blocked_users"), user)
+        self.notify_settings_changed()
 
     def get_statistics(self) -> Dict:
         total_processed = int(self.redis.get(self._get_redis_key("total_processed")) or 0)
@@ -79,6 +95,11 @@ class StorageHandler:
         user_count = json.loads(self.redis.get(self._get_redis_key("user_count")) or "{}")
         error_count = int(self.redis.get(self._get_redis_key("error_count")) or 0)
         success_rate = float(self.redis.get(self._get_redis_key("success_rate")) or 100.0)
+        total_audio_seconds = float(self.redis.get(self._get_redis_key("total_audio_seconds")) or 0)
+        daily_audio_seconds = {
+            day: float(seconds)
+            for day, seconds in self.redis.hgetall(self._get_redis_key("daily_audio_seconds")).items()
+        }
 
         return {
             "total_processed": total_processed,
@@ -89,6 +110,8 @@ class StorageHandler:
                 "user_count": user_count,
                 "error_count": error_count,
                 "success_rate": success_rate,
+                "total_audio_seconds": total_audio_seconds,
+                "daily_audio_seconds": daily_audio_seconds,
             }
         }
 
@@ -187,12 +210,14 @@ class StorageHandler:
         """Adiciona uma nova chave GROQ ao conjunto."""
         if key and key.startswith("gsk_"):
             self.redis.sadd(self._get_redis_key("groq_keys"), key)
+            self.notify_settings_changed()
             return True
         return False
 
     def remove_groq_key(self, key: str):
         """Remove uma chave GROQ do conjunto."""
         self.redis.srem(self._get_redis_key("groq_keys"), key)
+        self.notify_settings_changed()
 
     def get_next_groq_key(self) -> str:
         """
@@ -245,7 +270,8 @@ class StorageHandler:
         """Salva as configurações de mensagens."""
         for key, value in settings.items():
             self.redis.set(self._get_redis_key(key), str(value))
-            
+        self.notify_settings_changed()
+
     def get_process_mode(self):
         """Retorna o modo de processamento configurado"""
         mode = self.redis.get(self._get_redis_key("process_mode")) or "all"
@@ -296,6 +322,7 @@ class StorageHandler:
         """
         self.redis.set(self._get_redis_key("auto_language_detection"), str(enabled).lower())
         self.logger.info(f"Detecção automática de idioma {'ativada' if enabled else 'desativada'}")
+        self.notify_settings_changed()
 
     def get_auto_translation(self) -> bool:
         """
@@ -309,7 +336,8 @@ class StorageHandler:
         """
         self.redis.set(self._get_redis_key("auto_translation"), str(enabled).lower())
         self.logger.info(f"Tradução automática {'ativada' if enabled else 'desativada'}")
-        
+        self.notify_settings_changed()
+
     def record_language_usage(self, language: str, from_me: bool, auto_detected: bool = False):
         """
         Registra estatísticas de uso de idiomas
@@ -476,6 +504,7 @@ class StorageHandler:
             webhook_id,
             json.dumps(webhook_data)
         )
+        self.notify_settings_changed()
         return webhook_id
     
     def clean_webhook_data(self, webhook_id: str):
@@ -512,6 +541,7 @@ class StorageHandler:
             
             # Depois remove o webhook em si
             self.redis.hdel(self._get_redis_key("webhook_redirects"), webhook_id)
+            self.notify_settings_changed()
             self.logger.info(f"Webhook {webhook_id} removido com sucesso")
             
         except Exception as e:
@@ -696,15 +726,20 @@ class StorageHandler:
         self.redis.ltrim(key, 0, 99)
     
     def get_llm_provider(self) -> str:
-        """Returns active LLM provider (groq or openai)"""
+        """Returns active LLM provider (groq, openai or local)"""
         return self.redis.get(self._get_redis_key("active_llm_provider")) or "groq"
     
     def set_llm_provider(self, provider: str):
         """Sets active LLM provider"""
-        if provider not in ["groq", "openai"]:
-            raise ValueError("Provider must be 'groq' or 'openai'")
+        if provider not in ["groq", "openai", "local"]:
+            raise ValueError("Provider must be 'groq', 'openai' or 'local'")
+        if provider == "local":
+            from local_whisper import local_whisper
+            if not local_whisper.available:
+                raise ValueError("O provedor local requer o pacote faster-whisper instalado")
         self.redis.set(self._get_redis_key("active_llm_provider"), provider)
-    
+        self.notify_settings_changed()
+
     def get_openai_keys(self) -> List[str]:
         """Get stored OpenAI API keys"""
         return list(self.redis.smembers(self._get_redis_key("openai_keys")))
@@ -713,5 +748,323 @@ class StorageHandler:
         """Add OpenAI API key"""
         if key and key.startswith("sk-"):
             self.redis.sadd(self._get_redis_key("openai_keys"), key)
+            self.notify_settings_changed()
             return True
-        return False
\ No newline at end of file
+        return False
+
+    def remove_openai_key(self, key: str):
+        """Remove uma chave OpenAI do conjunto."""
+        self.redis.srem(self._get_redis_key("openai_keys"), key)
+        self.notify_settings_changed()
+
+    def get_key_usage(self, provider: str) -> Dict[str, dict]:
+        """
+        Uso e saúde de cada chave do provedor: chamadas, erros, limites de
+        taxa atingidos, último uso e o último estado do monitor de saúde.
+        """
+        usage = self.redis.hgetall(self._get_redis_key(f"key_usage:{provider}"))
+        health = self.redis.hgetall(self._get_redis_key(f"key_health:{provider}"))
+        keys = self.get_openai_keys() if provider == "openai" else self.get_groq_keys()
+        result = {}
+        for key in keys:
+            try:
+                key_health = json.loads(health[key]) if key in health else {}
+            except ValueError:
+                key_health = {}
+            result[key] = {
+                "requests": int(usage.get(f"{key}:requests", 0)),
+                "errors": int(usage.get(f"{key}:errors", 0)),
+                "rate_limited": int(usage.get(f"{key}:rate_limited", 0)),
+                "last_used": usage.get(f"{key}:last_used"),
+                "healthy": key_health.get("healthy", True),
+                "last_error": key_health.get("error"),
+            }
+        return result
+
+
+class AsyncStorageHandler:
+    """
+    Versão assíncrona do StorageHandler, baseada em redis.asyncio e no pool
+    de conexões compartilhado do processo. Cobre as operações usadas no
+    caminho das requisições (API e workers); o manager continua usando
+    o StorageHandler síncrono.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("StorageHandler")
+        if not self.logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            ))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.DEBUG)
+
+        # Cliente assíncrono sobre o pool compartilhado
+        self.redis = create_async_redis_client()
+
+    def _get_redis_key(self, key):
+        return f"transcrevezap:{key}"
+
+    async def add_log(self, level: str, message: str, metadata: dict = None):
+        """
+        Registra um log pelo LogSink do processo: o registro é filtrado por
+        nível e colocado em buffer, sem ida ao Redis no caminho da requisição.
+        """
+        log_sink.emit(level, message, metadata)
+
+    async def get_allowed_groups(self) -> List[str]:
+        return await self.redis.smembers(self._get_redis_key("allowed_groups"))
+
+    async def get_blocked_users(self) -> List[str]:
+        return await self.redis.smembers(self._get_redis_key("blocked_users"))
+
+    async def can_process_message(self, remote_jid):
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.sismember(self._get_redis_key("blocked_users"), remote_jid)
+            pipe.sismember(self._get_redis_key("allowed_groups"), remote_jid)
+            is_blocked, is_allowed_group = await pipe.execute()
+
+            if is_blocked:
+                return False
+            if "@g.us" in remote_jid and not is_allowed_group:
+                return False
+
+            return True
+        except Exception as e:
+            self.logger.error(f"Erro ao verificar se pode processar mensagem: {e}")
+            return False
+
+    async def record_processing(self, remote_jid):
+        try:
+            today = datetime.now().strftime("%Y-%m-%d")
+            count_key = "group_count" if "@g.us" in remote_jid else "user_count"
+
+            # Leitura dos contadores em uma única ida ao Redis
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.incr(self._get_redis_key("total_processed"))
+            pipe.get(self._get_redis_key("daily_count"))
+            pipe.get(self._get_redis_key(count_key))
+            pipe.get(self._get_redis_key("error_count"))
+            total, daily_raw, count_raw, errors = await pipe.execute()
+
+            daily_count = json.loads(daily_raw or "{}")
+            daily_count[today] = daily_count.get(today, 0) + 1
+            chat_count = json.loads(count_raw or "{}")
+            chat_count[remote_jid] = chat_count.get(remote_jid, 0) + 1
+
+            total = int(total or 0)
+            errors = int(errors or 0)
+            success_rate = ((total - errors) / total) * 100 if total > 0 else 100
+
+            # Escrita das atualizações em uma única ida ao Redis
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(self._get_redis_key("last_processed"), datetime.now().isoformat())
+            pipe.set(self._get_redis_key("daily_count"), json.dumps(daily_count))
+            pipe.set(self._get_redis_key(count_key), json.dumps(chat_count))
+            pipe.set(self._get_redis_key("success_rate"), success_rate)
+            await pipe.execute()
+
+        except Exception as e:
+            self.logger.error(f"Erro ao registrar processamento: {e}")
+
+    async def record_error(self):
+        await self.redis.incr(self._get_redis_key("error_count"))
+
+    async def record_audio_seconds(self, seconds: float):
+        """Acumula os segundos de áudio transcritos, no total e por dia."""
+        try:
+            today = datetime.now().strftime("%Y-%m-%d")
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.incrbyfloat(self._get_redis_key("total_audio_seconds"), seconds)
+            pipe.hincrbyfloat(self._get_redis_key("daily_audio_seconds"), today, seconds)
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Erro ao registrar segundos de áudio: {e}")
+
+    async def record_key_usage(self, provider: str, key: str, error_class: Optional[str] = None):
+        """Conta uma chamada feita com a chave (e o erro, se houver) para o manager."""
+        if not provider or not key:
+            return
+        try:
+            usage_key = self._get_redis_key(f"key_usage:{provider}")
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hincrby(usage_key, f"{key}:requests", 1)
+            if error_class:
+                pipe.hincrby(usage_key, f"{key}:errors", 1)
+                if error_class == "rate_limit":
+                    pipe.hincrby(usage_key, f"{key}:rate_limited", 1)
+            pipe.hset(usage_key, f"{key}:last_used", datetime.now().isoformat())
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Erro ao registrar uso da chave {provider}: {e}")
+
+    async def get_groq_keys(self) -> List[str]:
+        """Obtém todas as chaves GROQ armazenadas."""
+        return list(await self.redis.smembers(self._get_redis_key("groq_keys")))
+
+    async def get_message_settings(self):
+        """Obtém as configurações de mensagens."""
+        summary_header, transcription_header, output_mode, character_limit = await self.redis.mget(
+            self._get_redis_key("summary_header"),
+            self._get_redis_key("transcription_header"),
+            self._get_redis_key("output_mode"),
+            self._get_redis_key("character_limit"),
+        )
+        return {
+            "summary_header": summary_header or "🤖 *Resumo do áudio:*",
+            "transcription_header": transcription_header or "🔊 *Transcrição do áudio:*",
+            "output_mode": output_mode or "both",
+            "character_limit": int(character_limit or "500"),
+        }
+
+    async def get_contact_language(self, contact_id: str) -> str:
+        """
+        Obtém o idioma configurado para um contato específico.
+        O contact_id pode vir com ou sem @s.whatsapp.net
+        """
+        contact_id = contact_id.split('@')[0]
+        return await self.redis.hget(self._get_redis_key("contact_languages"), contact_id)
+
+    async def set_contact_language(self, contact_id: str, language: str):
+        """
+        Define o idioma para um contato específico
+        """
+        contact_id = contact_id.split('@')[0]
+        await self.redis.hset(self._get_redis_key("contact_languages"), contact_id, language)
+        self.logger.info(f"Idioma {language} definido para o contato {contact_id}")
+
+    async def record_language_usage(self, language: str, from_me: bool, auto_detected: bool = False):
+        """
+        Registra estatísticas de uso de idiomas
+        Args:
+            language: Código do idioma (ex: 'pt', 'en')
+            from_me: Se o áudio foi enviado por nós
+            auto_detected: Se o idioma foi detectado automaticamente
+        """
+        try:
+            if not language:
+                await self.add_log("WARNING", "Tentativa de registrar uso sem idioma definido")
+                return
+
+            stats_key = self._get_redis_key("language_stats")
+            direction = 'sent' if from_me else 'received'
+
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hincrby(stats_key, f"{language}_total", 1)
+            pipe.hincrby(stats_key, f"{language}_{direction}", 1)
+            if auto_detected:
+                pipe.hincrby(stats_key, f"{language}_auto_detected", 1)
+            pipe.hset(stats_key, f"{language}_last_used", datetime.now().isoformat())
+            await pipe.execute()
+
+            await self.add_log("DEBUG", "Uso de idioma registrado", {
+                "language": language,
+                "direction": direction,
+                "auto_detected": auto_detected
+            })
+
+        except Exception as e:
+            await self.add_log("ERROR", "Erro ao registrar uso de idioma", {
+                "error": str(e),
+                "type": type(e).__name__
+            })
+
+    async def cache_language_detection(self, contact_id: str, language: str, confidence: float = 1.0):
+        """
+        Armazena em cache o idioma detectado para um contato
+        """
+        contact_id = contact_id.split('@')[0]
+        cache_data = {
+            'language': language,
+            'confidence': confidence,
+            'timestamp': datetime.now().isoformat(),
+            'auto_detected': True
+        }
+        await self.redis.hset(
+            self._get_redis_key("language_detection_cache"),
+            contact_id,
+            json.dumps(cache_data)
+        )
+
+    async def get_cached_language(self, contact_id: str) -> Dict:
+        """
+        Obtém o idioma em cache para um contato
+        Retorna None se não houver cache ou se estiver expirado
+        """
+        contact_id = contact_id.split('@')[0]
+        cached = await self.redis.hget(
+            self._get_redis_key("language_detection_cache"),
+            contact_id
+        )
+
+        if not cached:
+            return None
+
+        try:
+            data = json.loads(cached)
+            # Verificar se o cache expirou (24 horas)
+            cache_time = datetime.fromisoformat(data['timestamp'])
+            if datetime.now() - cache_time > timedelta(hours=24):
+                return None
+            return data
+        except:
+            return None
+
+    async def get_webhook_redirects(self) -> List[Dict]:
+        """Obtém todos os webhooks de redirecionamento cadastrados."""
+        webhooks_raw = await self.redis.hgetall(self._get_redis_key("webhook_redirects"))
+        webhooks = []
+
+        for webhook_id, data in webhooks_raw.items():
+            webhook_data = json.loads(data)
+            webhook_data['id'] = webhook_id
+            webhooks.append(webhook_data)
+
+        return webhooks
+
+    async def update_webhook_stats(self, webhook_id: str, success: bool, error_message: str = None):
+        """Atualiza as estatísticas de um webhook."""
+        try:
+            webhook_data = json.loads(
+                await self.redis.hget(self._get_redis_key("webhook_redirects"), webhook_id)
+            )
+
+            if success:
+                webhook_data["success_count"] += 1
+                webhook_data["last_success"] = datetime.now().isoformat()
+            else:
+                webhook_data["error_count"] += 1
+                webhook_data["last_error"] = {
+                    "timestamp": datetime.now().isoformat(),
+                    "message": error_message
+                }
+
+            await self.redis.hset(
+                self._get_redis_key("webhook_redirects"),
+                webhook_id,
+                json.dumps(webhook_data)
+            )
+        except Exception as e:
+            self.logger.error(f"Erro ao atualizar estatísticas do webhook {webhook_id}: {e}")
+
+    async def add_failed_delivery(self, webhook_id: str, payload: dict):
+        """
+        Registra uma entrega falha para retry posterior
+        """
+        key = self._get_redis_key(f"webhook_failed_{webhook_id}")
+        failed_delivery = {
+            "timestamp": datetime.now().isoformat(),
+            "payload": payload,
+            "retry_count": 0
+        }
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lpush(key, json.dumps(failed_delivery))
+        # Manter apenas as últimas 100 falhas
+        pipe.ltrim(key, 0, 99)
+        await pipe.execute()
+
+    async def get_openai_keys(self) -> List[str]:
+        """Get stored OpenAI API keys"""
+        return list(await self.redis.smembers(self._get_redis_key("openai_keys")))
@@ -0,0 +1,86 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+import redis
+import redis.asyncio
+
+# Os módulos do projeto criam seus clientes Redis na importação (instâncias
+# únicas por processo); nos testes eles usam um servidor fakeredis em memória
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_server = fakeredis.FakeServer()
+_CONNECTION_PARAMS = (
+    "host", "port", "db", "username", "password", "connection_pool",
+    "max_connections", "health_check_interval", "socket_keepalive",
+    "socket_connect_timeout", "socket_timeout", "retry_on_timeout",
+)
+
+def _fake_params(kwargs: dict) -> dict:
+    pool = kwargs.get("connection_pool")
+    if pool is not None:
+        kwargs.setdefault("decode_responses", pool.connection_kwargs.get("decode_responses", False))
+    for name in _CONNECTION_PARAMS:
+        kwargs.pop(name, None)
+    return dict(kwargs, server=_server)
+
+class FakeRedis(fakeredis.FakeRedis):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **_fake_params(kwargs))
+
+class FakeAsyncRedis(fakeredis.FakeAsyncRedis):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **_fake_params(kwargs))
+
+redis.Redis = redis.StrictRedis = FakeRedis
+redis.asyncio.Redis = redis.asyncio.StrictRedis = FakeAsyncRedis
+
+class FakeResponse:
+    def __init__(self, status: int, data: dict, headers: dict = None):
+        self.status = status
+        self.headers = headers or {}
+        self._data = data
+
+    async def json(self, content_type=None):
+        return self._data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeSession:
+    """Responde às requisições em ordem e anota a URL e a chave de cada uma."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.urls = []
+        self.keys = []
+
+    def post(self, url, headers=None, **kwargs):
+        self.urls.append(url)
+        self.keys.append(headers["Authorization"][len("Bearer "):])
+        return self.responses.pop(0)
+
+@pytest.fixture
+def storage():
+    from key_health import key_health
+    from storage import AsyncStorageHandler
+
+    redis.Redis().flushall()
+    key_health._local.clear()
+    return AsyncStorageHandler()
+
+@pytest.fixture
+def session(monkeypatch):
+    """Troca as sessões HTTP dos provedores por uma FakeSession com as respostas dadas."""
+    from http_client import http_client
+
+    def install(*responses):
+        fake = FakeSession(responses)
+        monkeypatch.setattr(http_client, "get_session_for_url", lambda url: fake)
+        return fake
+    return install
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+from keyed_executor import KeyedExecutor
+
+def controller(monkeypatch, queue_size=32, queue_timeout=30.0) -> AdmissionController:
+    monkeypatch.setenv("ADMISSION_QUEUE_SIZE", str(queue_size))
+    monkeypatch.setenv("ADMISSION_QUEUE_TIMEOUT", str(queue_timeout))
+    return AdmissionController()
+
+async def submit(admission, executor, chat, job):
+    async with admission.queued() as ticket:
+        async def run_in_slot():
+            async with admission.slot("instancia", ticket):
+                return await job()
+        return await executor.submit(chat, run_in_slot)
+
+def test_chat_queue_counts_against_queue_size(monkeypatch):
+    admission = controller(monkeypatch, queue_size=1)
+    executor = KeyedExecutor()
+
+    async def run():
+        release = asyncio.Event()
+        first = asyncio.create_task(submit(admission, executor, "a", release.wait))
+        await asyncio.sleep(0)
+        # Aguarda na fila do chat "a", atrás do primeiro áudio
+        second = asyncio.create_task(submit(admission, executor, "a", release.wait))
+        await asyncio.sleep(0)
+        waiting = admission.waiting
+        with pytest.raises(AdmissionRejected) as rejected:
+            await submit(admission, executor, "b", release.wait)
+        release.set()
+        await asyncio.gather(first, second)
+        return waiting, rejected.value
+
+    waiting, rejected = asyncio.run(run())
+
+    assert waiting == 1
+    assert rejected.status_code == 429
+    assert admission.waiting == 0
+
+def test_chat_queue_time_counts_against_queue_timeout(monkeypatch):
+    admission = controller(monkeypatch, queue_timeout=0.05)
+    executor = KeyedExecutor()
+    processed = []
+
+    async def slow():
+        await asyncio.sleep(0.1)
+        processed.append("slow")
+
+    async def fast():
+        processed.append("fast")
+
+    async def run():
+        first = asyncio.create_task(submit(admission, executor, "a", slow))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await submit(admission, executor, "a", fast)
+        await first
+        return rejected.value
+
+    rejected = asyncio.run(run())
+
+    assert rejected.status_code == 503
+    assert processed == ["slow"]
+    assert admission.waiting == 0
@@ -0,0 +1,51 @@
+import asyncio
+
+import retry
+from circuit_breaker import circuit_breaker
+from conftest import FakeResponse
+from groq_handler import get_working_key
+from key_scheduler import key_scheduler
+from openai_handler import handle_openai_request
+
+URL = "https://api.openai.com/v1/chat/completions"
+SUCCESS = {"choices": [{"message": {"content": "ok"}}]}
+RATE_LIMITED = {"error": {"message": "Rate limit reached"}}
+
+def run_requests(storage, keys, count):
+    async def run():
+        for key in keys:
+            await storage.redis.sadd(storage._get_redis_key("openai_keys"), key)
+        results = []
+        for _ in range(count):
+            key, lease_id = await get_working_key("openai", storage)
+            results.append(await handle_openai_request(
+                URL, {"Authorization": f"Bearer {key}"}, {}, storage, lease_id=lease_id
+            ))
+        circuit = await circuit_breaker.redis.hgetall(circuit_breaker._get_key("openai", "chat"))
+        return results, circuit
+    return asyncio.run(run())
+
+def test_rate_limit_rescued_by_rotation_keeps_circuit_closed(storage, session, monkeypatch):
+    monkeypatch.setattr(retry.retry_policy, "backoff_base", 0.01)
+    monkeypatch.setattr(circuit_breaker, "failure_threshold", 1)
+    monkeypatch.setattr(key_scheduler, "default_park", 0)
+    # A primeira chave de cada requisição está limitada; a troca resolve
+    fake = session(*[FakeResponse(429, RATE_LIMITED), FakeResponse(200, SUCCESS)] * 2)
+
+    results, circuit = run_requests(storage, ["sk-a", "sk-b"], 2)
+
+    assert all(success for success, _, _ in results)
+    assert fake.keys[0] != fake.keys[1] and fake.keys[2] != fake.keys[3]
+    assert circuit.get("state", "closed") == "closed"
+    assert int(circuit.get("failures", 0)) == 0
+
+def test_rate_limited_request_counts_once(storage, session, monkeypatch):
+    monkeypatch.setattr(retry.retry_policy, "backoff_base", 0.01)
+    monkeypatch.setattr(retry.retry_policy, "max_attempts", 3)
+    monkeypatch.setattr(key_scheduler, "default_park", 0)
+    session(*[FakeResponse(429, RATE_LIMITED)] * 3)
+
+    results, circuit = run_requests(storage, ["sk-a", "sk-b"], 1)
+
+    assert not results[0][0]
+    assert int(circuit["failures"]) == 1
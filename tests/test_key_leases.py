@@ -0,0 +1,87 @@
+import asyncio
+
+import retry
+from conftest import FakeResponse
+from groq_handler import get_working_key
+from key_scheduler import key_scheduler
+from openai_handler import handle_openai_request
+
+URL = "https://api.openai.com/v1/chat/completions"
+SUCCESS = {"choices": [{"message": {"content": "ok"}}]}
+RATE_LIMITED = {"error": {"message": "Rate limit reached"}}
+
+async def lease_ids(key):
+    return await key_scheduler.redis.zrange(key_scheduler._get_keys("openai", key)[1], 0, -1)
+
+async def open_leases(keys) -> int:
+    return sum([len(await lease_ids(key)) for key in keys])
+
+def request(storage, keys, before=None):
+    async def run():
+        for key in keys:
+            await storage.redis.sadd(storage._get_redis_key("openai_keys"), key)
+        held = await before() if before else None
+        key, lease_id = await get_working_key("openai", storage)
+        result = await handle_openai_request(URL, {"Authorization": f"Bearer {key}"}, {}, storage, lease_id=lease_id)
+        return result, await open_leases(keys), held
+    return asyncio.run(run())
+
+def test_leases_released_after_success(storage, session):
+    fake = session(FakeResponse(200, SUCCESS))
+
+    (success, _, _), leases, _ = request(storage, ["sk-a"])
+
+    assert success
+    assert fake.keys == ["sk-a"]
+    assert leases == 0
+
+def test_leases_released_after_rotation(storage, session, monkeypatch):
+    monkeypatch.setattr(retry.retry_policy, "backoff_base", 0.01)
+    monkeypatch.setattr(retry.retry_policy, "budget", 10)
+    # O retry-after é da chave que o recebeu: a nova chave não espera por ele
+    fake = session(FakeResponse(429, RATE_LIMITED, {"retry-after": "60"}), FakeResponse(200, SUCCESS))
+
+    (success, _, _), leases, _ = request(storage, ["sk-a", "sk-b"])
+
+    assert success
+    assert len(set(fake.keys)) == 2
+    assert leases == 0
+
+def test_leases_released_when_rotation_returns_same_key(storage, session, monkeypatch):
+    monkeypatch.setattr(retry.retry_policy, "backoff_base", 0.01)
+    monkeypatch.setattr(key_scheduler, "default_park", 0)
+    session(FakeResponse(429, RATE_LIMITED), FakeResponse(200, SUCCESS))
+
+    (success, _, _), leases, _ = request(storage, ["sk-a"])
+
+    assert success
+    assert leases == 0
+
+def test_leases_released_when_retry_budget_runs_out(storage, session, monkeypatch):
+    monkeypatch.setattr(retry.retry_policy, "backoff_base", 0.01)
+    monkeypatch.setattr(retry.retry_policy, "max_attempts", 2)
+    monkeypatch.setattr(key_scheduler, "default_park", 0)
+    # A segunda falha ainda reserva outra chave, que não chega a ser usada
+    fake = session(FakeResponse(429, RATE_LIMITED), FakeResponse(429, RATE_LIMITED))
+
+    (success, _, error), leases, _ = request(storage, ["sk-a", "sk-b"])
+
+    assert not success
+    assert error == "Rate limit reached"
+    assert len(fake.keys) == 2
+    assert leases == 0
+
+def test_retry_on_same_key_keeps_other_leases(storage, session, monkeypatch):
+    monkeypatch.setattr(retry.retry_policy, "backoff_base", 0.01)
+    fake = session(FakeResponse(500, {"error": {"message": "Internal error"}}), FakeResponse(200, SUCCESS))
+
+    async def hold_lease():
+        # Lease de outra requisição em andamento na mesma chave
+        return await key_scheduler.acquire("openai", ["sk-a"])
+
+    (success, _, _), leases, held = request(storage, ["sk-a"], before=hold_lease)
+
+    assert success
+    assert fake.keys == ["sk-a", "sk-a"]
+    assert asyncio.run(lease_ids("sk-a")) == [held[1]]
+    assert leases == 1
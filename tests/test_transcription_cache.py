@@ -0,0 +1,60 @@
+import asyncio
+import base64
+import hashlib
+
+import pipeline
+from circuit_breaker import circuit_breaker
+from conftest import FakeResponse
+from settings_cache import settings_cache
+
+AUDIO = b"OggS" + bytes(range(256)) * 4
+TRANSCRIPTION = {"text": "texto transcrito pela OpenAI"}
+
+def audio_body(message_id: str) -> dict:
+    # Áudio encaminhado em um grupo: mesmo arquivo (fileSha256) nas duas mensagens
+    return {
+        "server_url": "http://evolution",
+        "instance": "instancia",
+        "apikey": "apikey",
+        "data": {
+            "key": {"id": message_id, "fromMe": False, "remoteJid": "123@g.us"},
+            "message": {
+                "base64": base64.b64encode(AUDIO).decode(),
+                "audioMessage": {
+                    "seconds": 5,
+                    "fileSha256": base64.b64encode(hashlib.sha256(AUDIO).digest()).decode(),
+                },
+            },
+        },
+    }
+
+def test_failover_transcription_is_served_from_cache(storage, session, monkeypatch):
+    fake = session(FakeResponse(200, TRANSCRIPTION))
+    sent = []
+
+    async def allow(provider, endpoint):
+        # Circuito do GROQ aberto: a transcrição vai para a OpenAI
+        return provider != "groq"
+
+    async def summarize(text):
+        return "resumo"
+
+    async def send_message(server_url, instance, apikey, message, remote_jid, message_id):
+        sent.append(message)
+
+    monkeypatch.setattr(circuit_breaker, "allow", allow)
+    monkeypatch.setattr(pipeline, "summarize_text_if_needed", summarize)
+    monkeypatch.setattr(pipeline, "send_message_to_whatsapp", send_message)
+
+    async def run():
+        await storage.redis.sadd(storage._get_redis_key("groq_keys"), "gsk_a")
+        await storage.redis.sadd(storage._get_redis_key("openai_keys"), "sk-a")
+        settings = await settings_cache.refresh()
+        await pipeline.process_audio_message(audio_body("1"), settings)
+        await pipeline.process_audio_message(audio_body("2"), settings)
+
+    asyncio.run(run())
+
+    assert fake.urls == ["https://api.openai.com/v1/audio/transcriptions"]
+    assert len(sent) == 2
+    assert all(TRANSCRIPTION["text"] in message for message in sent)
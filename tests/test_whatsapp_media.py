@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+
+from audio import AudioBuffer
+from utils import decode_binary_field
+from whatsapp_media import MediaDecryptionError, MediaDecryptor
+
+# audio.enc: audio.ogg cifrado como na CDN do WhatsApp, com o mediaKey e os
+# hashes do audioMessage em audio_message.json
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+@pytest.fixture
+def audio_message() -> dict:
+    with open(os.path.join(FIXTURES, "audio_message.json")) as f:
+        return json.load(f)
+
+def decrypt(audio_message: dict, encrypted: bytes, chunk_size: int = 64) -> bytes:
+    output = AudioBuffer()
+    decryptor = MediaDecryptor(
+        decode_binary_field(audio_message["mediaKey"]),
+        output,
+        file_enc_sha256=decode_binary_field(audio_message["fileEncSha256"]),
+        file_sha256=decode_binary_field(audio_message["fileSha256"]),
+    )
+    # Blocos que não coincidem com os 16 bytes do AES nem com o MAC
+    for start in range(0, len(encrypted), chunk_size):
+        decryptor.feed(encrypted[start:start + chunk_size])
+    decryptor.finish()
+    return output.read()
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 4096])
+def test_decrypts_fixture(audio_message, chunk_size):
+    plain = decrypt(audio_message, read_fixture("audio.enc"), chunk_size)
+
+    assert plain == read_fixture("audio.ogg")
+    assert len(plain) == audio_message["fileLength"]
+
+def test_rejects_bad_mac(audio_message):
+    encrypted = bytearray(read_fixture("audio.enc"))
+    encrypted[-1] ^= 0x01
+
+    with pytest.raises(MediaDecryptionError, match="MAC"):
+        decrypt(audio_message, bytes(encrypted))
+
+def test_rejects_tampered_ciphertext(audio_message):
+    encrypted = bytearray(read_fixture("audio.enc"))
+    encrypted[20] ^= 0x01
+
+    with pytest.raises(MediaDecryptionError, match="MAC"):
+        decrypt(audio_message, bytes(encrypted))
+
+def test_rejects_truncated_file(audio_message):
+    encrypted = read_fixture("audio.enc")
+
+    # Sem o último bloco, o fim do cifrado passa a ser lido como MAC
+    with pytest.raises(MediaDecryptionError, match="MAC"):
+        decrypt(audio_message, encrypted[:-16])
+    with pytest.raises(MediaDecryptionError, match="truncado"):
+        decrypt(audio_message, encrypted[:5])
+
+def test_rejects_wrong_file_enc_sha256(audio_message):
+    audio_message["fileEncSha256"] = audio_message["fileSha256"]
+
+    with pytest.raises(MediaDecryptionError, match="fileEncSha256"):
+        decrypt(audio_message, read_fixture("audio.enc"))
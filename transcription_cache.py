@@ -0,0 +1,91 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import logger
+from utils import create_async_redis_client, decode_binary_field
+
+class TranscriptionCache:
+    """
+    Cache de transcrições por hash da mídia.
+
+    Um mesmo áudio encaminhado para vários chats chega com o mesmo
+    `audioMessage.fileSha256` (SHA-256 do áudio decifrado). A chave combina
+    esse hash com o idioma, o modelo e o uso de timestamps, e o valor guarda
+    a transcrição e, quando já calculado, o resumo.
+
+    Duas camadas:
+    - memória do processo: LRU limitado a TRANSCRIPTION_CACHE_MAX_ENTRIES
+    - Redis: compartilhado entre API e workers, expira em TRANSCRIPTION_CACHE_TTL
+    """
+    KEY_PREFIX = "transcrevezap:transcription_cache"
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or create_async_redis_client()
+        self.enabled = os.getenv("TRANSCRIPTION_CACHE_ENABLED", "true").lower() == "true"
+        self.ttl = int(os.getenv("TRANSCRIPTION_CACHE_TTL", 604800))
+        self.max_entries = int(os.getenv("TRANSCRIPTION_CACHE_MAX_ENTRIES", 1000))
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @staticmethod
+    def normalize_hash(value) -> Optional[str]:
+        """
+        Converte o fileSha256 do payload para hex. A Evolution envia o hash
+        em base64 ou como Buffer serializado ({"0": 12, "1": 200, ...}).
+        """
+        raw = decode_binary_field(value)
+        if raw is None:
+            return None
+        return raw.hex() if len(raw) == 32 else None
+
+    def _get_key(self, media_hash: str, language: str, model: str, use_timestamps: bool) -> str:
+        timestamps = "ts" if use_timestamps else "text"
+        return f"{self.KEY_PREFIX}:{media_hash}:{language}:{model}:{timestamps}"
+
+    async def get(self, media_hash: str, language: str, model: str, use_timestamps: bool) -> Optional[dict]:
+        if not self.enabled or not media_hash:
+            return None
+        key = self._get_key(media_hash, language, model, use_timestamps)
+
+        local = self._local.get(key)
+        if local is not None:
+            expires_at, entry = local
+            if expires_at > time.monotonic():
+                self._local.move_to_end(key)
+                return entry
+            del self._local[key]
+
+        try:
+            data = await self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"Erro ao consultar cache de transcrição: {e}")
+            return None
+        if not data:
+            return None
+        try:
+            entry = json.loads(data)
+        except ValueError:
+            return None
+        self._remember(key, entry)
+        return entry
+
+    async def set(self, media_hash: str, language: str, model: str, use_timestamps: bool, entry: dict):
+        if not self.enabled or not media_hash:
+            return
+        key = self._get_key(media_hash, language, model, use_timestamps)
+        self._remember(key, entry)
+        try:
+            await self.redis.set(key, json.dumps(entry), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Erro ao gravar cache de transcrição: {e}")
+
+    def _remember(self, key: str, entry: dict):
+        self._local[key] = (time.monotonic() + self.ttl, entry)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+# Instância única por processo
+transcription_cache = TranscriptionCache()
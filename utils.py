@@ -1,5 +1,8 @@
+import base64
+import binascii
 import os
 import redis
+import redis.asyncio as aioredis
 import logging
 
 logger = logging.getLogger("TranscreveZAP")
@@ -46,4 +49,52 @@ def create_redis_client():
         raise
     except Exception as e:
         logger.error(f"Erro ao configurar Redis: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Pool de conexões assíncronas compartilhado por todo o processo
+_async_pool = None
+
+def get_async_redis_pool():
+    """
+    Retorna o pool de conexões redis.asyncio do processo, criando-o na
+    primeira chamada. Todos os clientes assíncronos compartilham este pool.
+    """
+    global _async_pool
+    if _async_pool is None:
+        params = get_redis_connection_params()
+        _async_pool = aioredis.ConnectionPool(
+            max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+            health_check_interval=30,
+            **params
+        )
+    return _async_pool
+
+def create_async_redis_client():
+    """
+    Cria um cliente Redis assíncrono (redis.asyncio) sobre o pool compartilhado.
+    A conexão é estabelecida no primeiro comando.
+    """
+    return aioredis.Redis(connection_pool=get_async_redis_pool())
+
+async def close_async_redis_pool():
+    """Fecha as conexões do pool assíncrono (usado no shutdown)."""
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.disconnect()
+        _async_pool = None
+
+def decode_binary_field(value):
+    """
+    Converte campos binários do payload da Evolution (mediaKey, fileSha256...)
+    para bytes. Chegam em base64 ou como Buffer serializado ({"0": 12, ...}).
+    """
+    try:
+        if isinstance(value, str) and value:
+            return base64.b64decode(value)
+        if isinstance(value, dict) and value:
+            return bytes(value[k] for k in sorted(value, key=int))
+        if isinstance(value, list) and value:
+            return bytes(value)
+    except (binascii.Error, ValueError, TypeError):
+        pass
+    return None
@@ -0,0 +1,145 @@
+import hashlib
+import hmac
+import os
+from typing import Optional
+from urllib.parse import urlparse
+
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from audio import AudioBuffer
+from http_client import http_client
+from utils import decode_binary_field
+
+# Rótulos do HKDF por tipo de mídia do WhatsApp
+MEDIA_INFO = {
+    "audio": b"WhatsApp Audio Keys",
+    "image": b"WhatsApp Image Keys",
+    "video": b"WhatsApp Video Keys",
+    "document": b"WhatsApp Document Keys",
+}
+MAC_SIZE = 10
+WHATSAPP_CDN = "https://mmg.whatsapp.net"
+
+class MediaDecryptionError(Exception):
+    """Falha na verificação ou decifragem de uma mídia do WhatsApp."""
+
+def expand_media_key(media_key: bytes, media_type: str = "audio") -> dict:
+    """Deriva IV, chave AES e chave do MAC a partir do mediaKey (HKDF-SHA256, 112 bytes)."""
+    expanded = HKDF(
+        algorithm=hashes.SHA256(),
+        length=112,
+        salt=None,
+        info=MEDIA_INFO[media_type],
+    ).derive(media_key)
+    return {
+        "iv": expanded[:16],
+        "cipher_key": expanded[16:48],
+        "mac_key": expanded[48:80],
+    }
+
+def is_encrypted_media_url(url: str) -> bool:
+    """URLs da CDN do WhatsApp entregam o arquivo cifrado (.enc)."""
+    parsed = urlparse(url)
+    return (parsed.hostname or "").endswith("whatsapp.net") or parsed.path.endswith(".enc")
+
+def encrypted_media_url(audio_message: dict) -> Optional[str]:
+    """URL do arquivo cifrado: `url` da mensagem ou a CDN + `directPath`."""
+    url = audio_message.get("url")
+    if url and is_encrypted_media_url(url):
+        return url
+    direct_path = audio_message.get("directPath")
+    if direct_path:
+        return f"{WHATSAPP_CDN}{direct_path}"
+    return None
+
+class MediaDecryptor:
+    """
+    Decifra em fluxo um arquivo de mídia do WhatsApp.
+
+    O arquivo baixado é `AES-256-CBC(mídia) || HMAC-SHA256(iv + cifrado)[:10]`.
+    Os blocos são decifrados à medida que chegam; os últimos 10 bytes (o MAC)
+    ficam retidos até o fim, quando o MAC, o fileEncSha256 (arquivo baixado)
+    e o fileSha256 (mídia decifrada) são conferidos.
+    """
+
+    def __init__(self, media_key: bytes, output: AudioBuffer, media_type: str = "audio",
+                 file_enc_sha256: Optional[bytes] = None, file_sha256: Optional[bytes] = None):
+        keys = expand_media_key(media_key, media_type)
+        self.output = output
+        self.file_enc_sha256 = file_enc_sha256
+        self.file_sha256 = file_sha256
+        self._mac = hmac.new(keys["mac_key"], keys["iv"], hashlib.sha256)
+        self._enc_digest = hashlib.sha256()
+        self._plain_digest = hashlib.sha256()
+        self._decryptor = Cipher(algorithms.AES(keys["cipher_key"]), modes.CBC(keys["iv"])).decryptor()
+        self._unpadder = padding.PKCS7(128).unpadder()
+        self._tail = b""
+
+    def feed(self, chunk: bytes):
+        self._enc_digest.update(chunk)
+        data = self._tail + chunk
+        # Retém os bytes que podem ser o MAC no fim do arquivo
+        if len(data) <= MAC_SIZE:
+            self._tail = data
+            return
+        ciphertext, self._tail = data[:-MAC_SIZE], data[-MAC_SIZE:]
+        self._mac.update(ciphertext)
+        self._write(self._unpadder.update(self._decryptor.update(ciphertext)))
+
+    def finish(self):
+        if len(self._tail) != MAC_SIZE:
+            raise MediaDecryptionError("Arquivo cifrado truncado")
+        if not hmac.compare_digest(self._mac.digest()[:MAC_SIZE], self._tail):
+            raise MediaDecryptionError("MAC da mídia inválido")
+        if self.file_enc_sha256 and self._enc_digest.digest() != self.file_enc_sha256:
+            raise MediaDecryptionError("fileEncSha256 não confere")
+        try:
+            self._write(self._unpadder.update(self._decryptor.finalize()))
+            self._write(self._unpadder.finalize())
+        except ValueError as e:
+            raise MediaDecryptionError(f"Padding inválido: {e}")
+        if self.file_sha256 and self._plain_digest.digest() != self.file_sha256:
+            raise MediaDecryptionError("fileSha256 não confere")
+
+    def _write(self, data: bytes):
+        if data:
+            self._plain_digest.update(data)
+            self.output.write(data)
+
+async def download_whatsapp_media(url: str, audio_message: dict, max_bytes: Optional[int] = None) -> AudioBuffer:
+    """
+    Baixa a mídia cifrada da CDN do WhatsApp e a decifra localmente com o
+    mediaKey do payload, sem passar pela Evolution API.
+    """
+    media_key = decode_binary_field(audio_message.get("mediaKey"))
+    if not media_key or len(media_key) != 32:
+        raise MediaDecryptionError("mediaKey ausente ou inválido")
+    max_bytes = max_bytes or int(os.getenv("MEDIA_MAX_BYTES", 25 * 1024 * 1024))
+
+    audio = AudioBuffer()
+    decryptor = MediaDecryptor(
+        media_key,
+        audio,
+        file_enc_sha256=decode_binary_field(audio_message.get("fileEncSha256")),
+        file_sha256=decode_binary_field(audio_message.get("fileSha256")),
+    )
+    total_bytes = 0
+    try:
+        session = http_client.get_session("media")
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise MediaDecryptionError(f"Falha no download, código de status: {response.status}")
+            if response.content_length and response.content_length > max_bytes + MAC_SIZE + 16:
+                raise MediaDecryptionError(f"Arquivo de {response.content_length} bytes excede o limite de {max_bytes} bytes")
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                total_bytes += len(chunk)
+                if total_bytes > max_bytes + MAC_SIZE + 16:
+                    raise MediaDecryptionError(f"Download excedeu o limite de {max_bytes} bytes")
+                decryptor.feed(chunk)
+        decryptor.finish()
+    except Exception:
+        audio.close()
+        raise
+    return audio
@@ -0,0 +1,180 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import traceback
+
+from config import logger
+from job_queue import JobQueue
+from keyed_executor import KeyedExecutor
+from pipeline import process_audio_message, storage
+from settings_cache import settings_cache
+from http_client import http_client
+from log_sink import log_sink
+from stages import drain_background
+from preprocess import audio_preprocessor
+from key_health import key_health
+from local_whisper import local_whisper
+from idempotency import idempotency
+from utils import close_async_redis_pool
+
+async def handle_job(queue: JobQueue, job_id: str, payload: dict):
+    """Processa um job e decide entre ack, nova tentativa ou dead letter."""
+    attempts = await queue.register_attempt(job_id)
+
+    if payload is None:
+        await storage.add_log("ERROR", "Job inválido descartado", {"job_id": job_id})
+        await queue.dead_letter(job_id, {}, "Payload inválido")
+        return
+
+    remote_jid = payload.get("data", {}).get("key", {}).get("remoteJid")
+    instance = payload.get("instance")
+    message_id = payload.get("data", {}).get("key", {}).get("id")
+    try:
+        outcome = await process_audio_message(payload)
+        await idempotency.complete(instance, message_id, outcome)
+        await queue.ack(job_id)
+    except Exception as e:
+        await storage.add_log("ERROR", f"Erro ao processar job: {str(e)}", {
+            "job_id": job_id,
+            "attempt": attempts,
+            "remote_jid": remote_jid,
+            "error_type": type(e).__name__,
+            "traceback": traceback.format_exc()
+        })
+        if attempts >= queue.max_attempts:
+            await storage.record_error()
+            await idempotency.fail(instance, message_id, str(e))
+            await queue.dead_letter(job_id, payload, str(e))
+        # Caso contrário o job continua pendente e será reassumido
+        # por algum worker após JOB_CLAIM_IDLE_MS
+
+def chat_key(payload) -> str:
+    """Chave de ordenação do job: o chat de origem do áudio."""
+    if not payload:
+        return ""
+    return payload.get("data", {}).get("key", {}).get("remoteJid") or ""
+
+async def run_worker(queue: JobQueue, consumer: str, executor: KeyedExecutor, stop_event: asyncio.Event):
+    """
+    Loop de leitura do processo: reassume jobs parados, consome novos jobs
+    e os entrega ao executor, que mantém a ordem por chat e roda chats
+    diferentes em paralelo.
+    """
+    claim_interval = queue.claim_idle_ms / 1000
+    read_ahead = executor.max_concurrency * 2
+    last_claim = 0.0
+    # Jobs lidos por este processo e ainda não finalizados
+    local_jobs = set()
+
+    async def run_job(job_id, payload):
+        try:
+            await handle_job(queue, job_id, payload)
+        finally:
+            local_jobs.discard(job_id)
+
+    async def keep_alive():
+        # Jobs esperando a vez do chat não podem parecer parados para outros workers
+        while True:
+            await asyncio.sleep(max(claim_interval / 2, 1))
+            if local_jobs:
+                try:
+                    await queue.touch(consumer, list(local_jobs))
+                except Exception as e:
+                    logger.warning(f"Erro ao renovar jobs do worker {consumer}: {e}")
+
+    keep_alive_task = asyncio.create_task(keep_alive())
+
+    while not stop_event.is_set():
+        try:
+            # Só busca novos jobs quando há capacidade livre no executor
+            await executor.wait_for_capacity(read_ahead)
+
+            jobs = []
+            if time.monotonic() - last_claim >= claim_interval:
+                last_claim = time.monotonic()
+                capacity = max(read_ahead - executor.total_pending(), 1)
+                claimed = await queue.claim_stalled(consumer, count=capacity)
+                if len(claimed) >= capacity:
+                    # Ainda pode haver jobs parados: reassume de novo assim que houver capacidade
+                    last_claim = 0.0
+                jobs = [(job_id, payload) for job_id, payload in claimed if job_id not in local_jobs]
+                if jobs:
+                    await storage.add_log("WARNING", "Jobs parados reassumidos", {
+                        "consumer": consumer,
+                        "job_ids": [job_id for job_id, _ in jobs]
+                    })
+            if not jobs:
+                count = max(read_ahead - executor.total_pending(), 1)
+                jobs = await queue.read(consumer, count=count, block_ms=5000)
+
+            # Todo o lote passa a ser renovado pelo keep_alive desde já, para
+            # nenhum job lido parecer parado a outros workers
+            local_jobs.update(job_id for job_id, _ in jobs)
+            for job_id, payload in jobs:
+                # Um chat com a fila cheia não segura a leitura dos demais: o
+                # job fica estacionado na fila do chat (o total continua
+                # limitado pelo read-ahead)
+                executor.spawn(chat_key(payload), functools.partial(run_job, job_id, payload), park=True)
+        except Exception as e:
+            logger.error(f"Erro no loop do worker {consumer}: {e}")
+            await asyncio.sleep(1)
+
+    await executor.join()
+    keep_alive_task.cancel()
+
+async def run_process(process_index: int = 0):
+    """Executa até WORKER_CONCURRENCY jobs simultâneos neste processo."""
+    # 0 deixaria o executor sem limite e a leitura sem read-ahead
+    concurrency = max(int(os.getenv("WORKER_CONCURRENCY", 4)), 1)
+    queue = JobQueue()
+    await queue.ensure_group()
+    await settings_cache.start()
+    await http_client.start()
+    await log_sink.start()
+    await key_health.start()
+    await local_whisper.start()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    executor = KeyedExecutor(max_concurrency=concurrency)
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    logger.info(f"Processo de workers {process_index} iniciado com {concurrency} worker(s)")
+    await run_worker(queue, consumer, executor, stop_event)
+    await drain_background()
+    audio_preprocessor.shutdown()
+    local_whisper.shutdown()
+    await key_health.stop()
+    await settings_cache.stop()
+    await http_client.close()
+    await log_sink.stop()
+    await queue.close()
+    await close_async_redis_pool()
+    logger.info(f"Processo de workers {process_index} finalizado")
+
+def _process_entrypoint(process_index: int):
+    asyncio.run(run_process(process_index))
+
+def main():
+    processes = int(os.getenv("WORKER_PROCESSES", 1))
+    if processes <= 1:
+        _process_entrypoint(0)
+        return
+
+    children = [
+        multiprocessing.Process(target=_process_entrypoint, args=(i,), daemon=False)
+        for i in range(processes)
+    ]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+
+if __name__ == "__main__":
+    main()